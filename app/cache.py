@@ -0,0 +1,118 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import wraps
+from app import database
+
+"""
+In-memory response cache for the read-only Api methods.
+
+Each cached method declares the tables it reads. An entry is only served while none
+of those tables has been written since it was computed (database.get_table_versions),
+and entries are dropped as soon as a committed write touches one of their tables.
+The cache is bounded (LRU, overall and per method) and keeps hit/miss counters.
+Cached responses are shared between callers: treat them as read-only.
+"""
+
+DEFAULT_MAX_ENTRIES = 512
+
+class ResponseCache:
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (method, args) -> (token, expires_at, response)
+        self._policies = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+        database.add_write_listener(self._on_write)
+
+    def cached(self, tables, ttl=None, per_day=False, max_entries=None):
+        """
+        Decorates an Api method so its successful responses are cached.
+        tables: tables the method reads; a write to any of them invalidates its entries.
+        ttl: optional lifetime in seconds. per_day: the response depends on today's
+        date (periods relative to now), so entries also expire at UTC midnight.
+        max_entries: optional bound for this method's entries.
+        """
+        tables = tuple(tables)
+
+        def decorator(method):
+            name = method.__name__
+            self._policies[name] = {'tables': tables, 'ttl': ttl, 'per_day': per_day, 'max_entries': max_entries}
+            self._stats[name] = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+            @wraps(method)
+            def wrapper(api, *args, **kwargs):
+                try:
+                    key = (name, json.dumps([args, kwargs], sort_keys=True, default=str))
+                except (TypeError, ValueError):
+                    return method(api, *args, **kwargs)
+                # Taken before the call: a write that lands while computing makes the entry stale
+                token = database.get_table_versions(tables)
+                if per_day:
+                    token += (datetime.now(timezone.utc).date(),)
+                now = time.monotonic()
+                with self._lock:
+                    entry = self._entries.get(key)
+                    if entry and entry[0] == token and (entry[1] is None or entry[1] > now):
+                        self._entries.move_to_end(key)
+                        self._stats[name]['hits'] += 1
+                        return entry[2]
+                    self._stats[name]['misses'] += 1
+                response = method(api, *args, **kwargs)
+                if isinstance(response, dict) and response.get('success'):
+                    self._store(name, key, token, now + ttl if ttl else None, response)
+                return response
+            return wrapper
+        return decorator
+
+    def _store(self, name, key, token, expires_at, response):
+        with self._lock:
+            self._entries[key] = (token, expires_at, response)
+            self._entries.move_to_end(key)
+            limit = self._policies[name]['max_entries']
+            if limit:
+                own = [entry_key for entry_key in self._entries if entry_key[0] == name]
+                for entry_key in own[:max(0, len(own) - limit)]:
+                    del self._entries[entry_key]
+                    self._stats[name]['evictions'] += 1
+            while len(self._entries) > self.max_entries:
+                evicted_key, _ = self._entries.popitem(last=False)
+                self._stats[evicted_key[0]]['evictions'] += 1
+
+    def _on_write(self, tables):
+        """Drops the entries of every method that reads one of the written tables."""
+        if database.ALL_TABLES in tables:
+            self.clear()
+            return
+        stale = {name for name, policy in self._policies.items() if tables.intersection(policy['tables'])}
+        if not stale:
+            return
+        with self._lock:
+            for key in [key for key in self._entries if key[0] in stale]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self):
+        """Returns hit/miss/eviction counters and live entries per method, plus totals."""
+        with self._lock:
+            entries = {}
+            for name, _ in self._entries:
+                entries[name] = entries.get(name, 0) + 1
+            methods = {name: dict(stats, entries=entries.get(name, 0)) for name, stats in self._stats.items()}
+        hits = sum(stats['hits'] for stats in methods.values())
+        misses = sum(stats['misses'] for stats in methods.values())
+        return {
+            'entries': sum(entries.values()),
+            'max_entries': self.max_entries,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / (hits + misses) if hits + misses else 0,
+            'methods': methods
+        }
+
+response_cache = ResponseCache()
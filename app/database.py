@@ -1,6 +1,15 @@
 import sqlite3
 import os
 import sys
+import json
+import base64
+import csv
+import itertools
+import math
+import re
+import threading
+from contextlib import contextmanager
+from datetime import date as date_type, datetime, timedelta, timezone
 
 """
 This module handles all interaction with the local SQLite database.
@@ -34,23 +43,274 @@ def get_db_path():
 
 DB_FILE = get_db_path()
 
-def get_db_connection():
-    """Connects to the SQLite database."""
-    conn = sqlite3.connect(DB_FILE)
+# Pragma profile applied once to every connection when it is opened.
+# journal_mode=WAL is persistent in the database file; the rest are per-connection.
+CONNECTION_PRAGMAS = (
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+    ('busy_timeout', 5000),        # ms to wait on a locked database
+    ('cache_size', -20000),        # negative = KiB (~20 MB page cache)
+    ('mmap_size', 268435456),      # 256 MB memory-mapped I/O
+    # Older versions ran without it: _migrate_nullable_sale_product() clears the orphans they left
+    ('foreign_keys', 'ON'),
+)
+
+# Idle connections kept open for reuse. pywebview runs every JS call on a new
+# thread, so connections are checked out per call rather than owned by a thread.
+POOL_SIZE = 4
+_pool = []
+_pool_lock = threading.Lock()
+# Bumped after every committed transaction that changed at least one row, so
+# in-memory caches can tell whether the data they were computed from is still current.
+_write_version = 0
+_write_version_lock = threading.Lock()
+# Same idea per table, for caches that only depend on a few tables
+ALL_TABLES = '*'
+_table_versions = {}
+_write_listeners = []
+# Per-thread checkout state: the connection in use, how many connection()/transaction()
+# blocks are holding it, and the current transaction nesting depth.
+_local = threading.local()
+
+def _open_connection(isolation_level=None):
+    """Opens a new connection to DB_FILE with the pragma profile applied."""
+    conn = sqlite3.connect(DB_FILE, isolation_level=isolation_level, check_same_thread=False)
     conn.row_factory = sqlite3.Row # Allows accessing results by column name
+    for pragma, value in CONNECTION_PRAGMAS:
+        conn.execute(f"PRAGMA {pragma} = {value}")
     return conn
 
-def init_db():
+def _acquire():
     """
-    Initializes the database.
-    Creates tables if they don't exist.
+    Returns the connection checked out by the current thread, taking one from the pool
+    (or opening a new one) if this is the outermost block. Runs in autocommit mode;
+    transactions are driven explicitly by transaction().
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        _local.refs += 1
+        return conn
+    with _pool_lock:
+        while _pool:
+            pooled, path = _pool.pop()
+            if path == DB_FILE:
+                conn = pooled
+                break
+            pooled.close()  # DB_FILE was repointed since this connection was opened
+    if conn is None:
+        conn = _open_connection()
+    _local.conn = conn
+    _local.refs = 1
+    _local.depth = 0
+    return conn
+
+def _release():
+    """Releases one hold on the thread's connection; the last one returns it to the pool."""
+    _local.refs -= 1
+    if _local.refs:
+        return
+    conn = _local.conn
+    _local.conn = None
+    if conn.in_transaction:
+        conn.execute("ROLLBACK")
+    with _pool_lock:
+        if len(_pool) < POOL_SIZE:
+            _pool.append((conn, DB_FILE))
+            return
+    conn.close()
+
+def close_all_connections():
+    """Closes every idle pooled connection (call on shutdown or after replacing the database file)."""
+    with _pool_lock:
+        connections = [conn for conn, _ in _pool]
+        _pool.clear()
+    for conn in connections:
+        conn.close()
+
+@contextmanager
+def connection():
+    """
+    Yields a pooled connection for reads.
+    Inside a transaction() block it is the same connection, so reads see uncommitted writes.
+    """
+    conn = _acquire()
+    try:
+        yield conn
+    finally:
+        _release()
+
+@contextmanager
+def transaction(immediate=True, tables=()):
+    """
+    Runs the block inside a transaction on a pooled connection.
+    The outermost block issues BEGIN IMMEDIATE and COMMIT/ROLLBACK. Taking the write lock
+    up front matters: a deferred transaction that reads and then writes fails at once with
+    SQLITE_BUSY_SNAPSHOT if another connection committed in between (busy_timeout does
+    not retry that), while BEGIN IMMEDIATE simply waits for the lock. immediate=False
+    (plain BEGIN) is only for read-only blocks, see read_snapshot(). Nested blocks join it through a SAVEPOINT, so a nested helper
+    shares the caller's transaction and an error inside it only undoes its own work.
+    tables names the tables the block writes (tables maintained by triggers on them are
+    added automatically); a commit that changed rows without declaring any is treated
+    as touching every table.
+    """
+    conn = _acquire()
+    depth = _local.depth
+    try:
+        if depth == 0:
+            _local.tables = set()
+            _local.changes_before = conn.total_changes
+            conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+        else:
+            conn.execute(f"SAVEPOINT sp_{depth}")
+        _local.depth = depth + 1
+        _local.tables.update(tables)
+        try:
+            yield conn
+        except BaseException:
+            _local.depth = depth
+            if conn.in_transaction:  # some errors (e.g. SQLITE_FULL) already rolled back
+                if depth == 0:
+                    conn.execute("ROLLBACK")
+                else:
+                    conn.execute(f"ROLLBACK TO sp_{depth}")
+                    conn.execute(f"RELEASE sp_{depth}")
+            raise
+        _local.depth = depth
+        if depth == 0:
+            conn.execute("COMMIT")
+            if conn.total_changes != _local.changes_before:
+                _notify_write(_local.tables)
+        else:
+            conn.execute(f"RELEASE sp_{depth}")
+    finally:
+        _release()
+
+@contextmanager
+def read_snapshot():
+    """
+    Runs a group of reads inside one transaction, so every query in the block sees
+    the same committed state of the database (WAL readers are never blocked by writers).
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    with transaction(immediate=False) as conn:
+        yield conn
 
+# Tables filled by triggers on another table: a write to the key also changes these
+_TRIGGER_TABLES = {
+    'products': ('sync_state', 'sync_tombstones', 'products_fts'),
+    'bill_of_materials': ('sync_state', 'sync_tombstones'),
+    'revenue': ('daily_revenue', 'sync_state', 'sync_tombstones'),
+    'costs': ('daily_costs', 'daily_cost_categories', 'sync_state', 'sync_tombstones'),
+    'sales': ('daily_sales', 'daily_product_sales', 'product_sales_stats', 'products', 'sync_state', 'sync_tombstones'),
+    'stock_movements': ('stock_snapshots', 'products', 'sync_state'),
+}
+
+def _notify_write(tables):
+    """Bumps the global and per-table write versions, then calls the write listeners."""
+    global _write_version
+    changed = set(tables) or {ALL_TABLES}
+    for table in list(changed):
+        changed.update(_TRIGGER_TABLES.get(table, ()))
+    changed = frozenset(changed)
+    with _write_version_lock:
+        _write_version += 1
+        for table in changed:
+            _table_versions[table] = _table_versions.get(table, 0) + 1
+        listeners = list(_write_listeners)
+    for listener in listeners:
+        try:
+            listener(changed)
+        except Exception as e:
+            print(f"Write listener error: {e}")
+
+def get_write_version():
+    """Returns the write counter (changes whenever a transaction commits changed rows)."""
+    return _write_version
+
+def get_table_versions(tables):
+    """
+    Returns a token that changes whenever any of `tables` is written
+    (or a write without declared tables commits).
+    """
+    versions = _table_versions
+    return tuple(versions.get(table, 0) for table in tables) + (versions.get(ALL_TABLES, 0),)
+
+def add_write_listener(listener):
+    """
+    Registers listener(tables) to be called after every committed write, with the
+    frozenset of tables it touched (ALL_TABLES means unknown: assume everything changed).
+    Listeners run on the writing thread and must be quick.
+    """
+    with _write_version_lock:
+        _write_listeners.append(listener)
+
+def remove_write_listener(listener):
+    with _write_version_lock:
+        if listener in _write_listeners:
+            _write_listeners.remove(listener)
+
+def mark_written(tables=()):
+    """Tells caches that the data changed outside transaction() (e.g. via get_db_connection())."""
+    _notify_write(tables)
+
+def get_db_connection():
+    """
+    Opens a standalone connection to the SQLite database (with the same pragma profile).
+    Prefer connection()/transaction(); the caller owns and must close this connection.
+    Writes made through it do not bump the write counter: call mark_written() afterwards.
+    """
+    return _open_connection(isolation_level='')
+
+# --- Schema Migrations ---
+# Each migration runs exactly once, in order, inside its own transaction.
+# PRAGMA user_version stores how many have been applied, so an up-to-date
+# database only needs that single pragma read at startup.
+# To change the schema, append a new function to MIGRATIONS (never edit an applied one).
+
+def _add_missing_columns(cursor, table, columns):
+    """Adds the (name, definition) columns that `table` does not have yet."""
+    existing = {row['name'] for row in cursor.execute(f"PRAGMA table_info({table})")}
+    for name, definition in columns:
+        if name not in existing:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+def _create_rollup_triggers(cursor, source, rollup, keys, values, watched_columns):
+    """
+    Creates the triggers that keep `rollup` in sync with every write to `source`.
+    keys/values are (rollup_column, expression) pairs where '{row}' stands for NEW/OLD;
+    values are additive and must include an 'entry_count' column (rows with 0 are dropped).
+    """
+    key_columns = [column for column, _ in keys]
+    value_columns = [column for column, _ in values]
+
+    def add(row):
+        return (
+            f"INSERT INTO {rollup} ({', '.join(key_columns + value_columns)}) "
+            f"VALUES ({', '.join(expr.format(row=row) for _, expr in keys + values)}) "
+            f"ON CONFLICT({', '.join(key_columns)}) DO UPDATE SET "
+            + ', '.join(f"{column} = {column} + excluded.{column}" for column in value_columns)
+            + ";"
+        )
+
+    def remove(row):
+        match = ' AND '.join(f"{column} = {expr.format(row=row)}" for column, expr in keys)
+        return (
+            f"UPDATE {rollup} SET "
+            + ', '.join(f"{column} = {column} - {expr.format(row=row)}" for column, expr in values)
+            + f" WHERE {match};"
+            f" DELETE FROM {rollup} WHERE {match} AND entry_count <= 0;"
+        )
+
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {rollup}_after_insert AFTER INSERT ON {source} BEGIN {add('NEW')} END")
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {rollup}_after_delete AFTER DELETE ON {source} BEGIN {remove('OLD')} END")
+    cursor.execute(
+        f"CREATE TRIGGER IF NOT EXISTS {rollup}_after_update AFTER UPDATE OF {', '.join(watched_columns)} ON {source} "
+        f"BEGIN {remove('OLD')} {add('NEW')} END"
+    )
+
+def _migrate_base_schema(cursor):
+    """Creates the original tables and brings pre-migration databases up to the same columns."""
     # --- Products Table (Inventory) ---
     # product_type: 'final' (to sell), 'hijo' (component), 'padre' (sub-assembly), 'otro' (expenses)
-    # NEW! Added 'cost' field, supplier, purchase_date, exit_date, SKU
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS products (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -66,55 +326,19 @@ def init_db():
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     );
     ''')
-    
-    # Migration: Add new columns if they don't exist (for existing databases)
-    try:
-        cursor.execute('ALTER TABLE products ADD COLUMN cost REAL NOT NULL DEFAULT 0')
-    except sqlite3.OperationalError:
-        pass  # Column already exists
-    
-    try:
-        cursor.execute('ALTER TABLE products ADD COLUMN supplier TEXT')
-    except sqlite3.OperationalError:
-        pass  # Column already exists
-    
-    try:
-        cursor.execute('ALTER TABLE products ADD COLUMN purchase_date DATE')
-    except sqlite3.OperationalError:
-        pass  # Column already exists
-    
-    try:
-        cursor.execute('ALTER TABLE products ADD COLUMN exit_date DATE')
-    except sqlite3.OperationalError:
-        pass  # Column already exists
-    
-    try:
-        cursor.execute('ALTER TABLE products ADD COLUMN sku TEXT')
-    except sqlite3.OperationalError:
-        pass  # Column already exists
-    
-    try:
-        cursor.execute('ALTER TABLE products ADD COLUMN weight REAL DEFAULT 0')
-    except sqlite3.OperationalError:
-        pass  # Column already exists
-    
-    try:
-        cursor.execute('ALTER TABLE products ADD COLUMN stock_unit_type TEXT DEFAULT "units"')
-    except sqlite3.OperationalError:
-        pass  # Column already exists
-    
+    # Databases created by older versions may lack some of these columns
+    _add_missing_columns(cursor, 'products', [
+        ('cost', 'REAL NOT NULL DEFAULT 0'),
+        ('supplier', 'TEXT'),
+        ('purchase_date', 'DATE'),
+        ('exit_date', 'DATE'),
+        ('sku', 'TEXT'),
+        ('weight', 'REAL DEFAULT 0'),
+        ('stock_unit_type', "TEXT DEFAULT 'units'"),
+        ('additional_cost', 'REAL DEFAULT 0'),
+    ])
     # Ensure stock_unit_type has valid values
-    try:
-        cursor.execute('UPDATE products SET stock_unit_type = "units" WHERE stock_unit_type IS NULL OR stock_unit_type NOT IN ("units", "grams")')
-    except sqlite3.OperationalError:
-        pass
-    
-    try:
-        cursor.execute('ALTER TABLE products ADD COLUMN additional_cost REAL DEFAULT 0')
-    except sqlite3.OperationalError:
-        pass  # Column already exists
-    
-    conn.commit()
+    cursor.execute("UPDATE products SET stock_unit_type = 'units' WHERE stock_unit_type IS NULL OR stock_unit_type NOT IN ('units', 'grams')")
 
     # --- BOM (Bill of Materials) Table ---
     # Defines which 'hijos' (children) compose a 'padre' (parent) or 'final'.
@@ -128,7 +352,7 @@ def init_db():
         FOREIGN KEY (child_product_id) REFERENCES products(id) ON DELETE CASCADE
     );
     ''')
-    
+
     # --- Finance Tables ---
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS revenue (
@@ -147,7 +371,8 @@ def init_db():
         date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     );
     ''')
-    
+    _add_missing_columns(cursor, 'costs', [('category', "TEXT DEFAULT 'Others'")])
+
     # --- Sales Table (Sales History) ---
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS sales (
@@ -161,76 +386,574 @@ def init_db():
         FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE SET NULL
     );
     ''')
-    
-    # Migration: Add category column to costs if it doesn't exist
+
+def _migrate_nullable_sale_product(cursor):
+    """
+    Makes sales.product_id nullable. With foreign_keys=ON, deleting a product that has
+    sales runs ON DELETE SET NULL, which the original NOT NULL column rejected.
+    SQLite cannot alter a column constraint, so the table is rebuilt.
+    Older versions ran with foreign keys off, so deleting a product left its sales and
+    BOM rows pointing at nothing. Those references are cleared here, before anything
+    checks them: sales keep their product_name with no product_id, BOM rows are dropped.
+    """
+    cursor.execute("""
+    DELETE FROM bill_of_materials
+    WHERE parent_product_id NOT IN (SELECT id FROM products)
+       OR child_product_id NOT IN (SELECT id FROM products)
+    """)
+    cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'sales'")
+    row = cursor.fetchone()
+    last_id = row['seq'] if row else 0
+    cursor.execute('''
+    CREATE TABLE sales_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        product_id INTEGER,
+        product_name TEXT NOT NULL,
+        quantity REAL NOT NULL,
+        unit_price REAL NOT NULL,
+        total_amount REAL NOT NULL,
+        date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE SET NULL
+    );
+    ''')
+    cursor.execute('''
+    INSERT INTO sales_new (id, product_id, product_name, quantity, unit_price, total_amount, date)
+    SELECT id, CASE WHEN product_id IN (SELECT id FROM products) THEN product_id END,
+           product_name, quantity, unit_price, total_amount, date
+    FROM sales
+    ''')
+    cursor.execute("DROP TABLE sales")
+    cursor.execute("ALTER TABLE sales_new RENAME TO sales")
+    # Keep AUTOINCREMENT from reusing ids of sales deleted before the rebuild
+    cursor.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'sales'", (last_id,))
+    violations = cursor.execute("PRAGMA foreign_key_check").fetchall()
+    if violations:
+        raise sqlite3.IntegrityError(f"Foreign key violations left after cleanup: {[tuple(row) for row in violations]}")
+
+def _migrate_query_indexes(cursor):
+    """Adds the indexes used by period filters, per-product sales lookups and BOM joins."""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sales_date ON sales(date)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sales_product_date ON sales(product_id, date)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_revenue_date ON revenue(date)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_costs_date ON costs(date)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_costs_category ON costs(category)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_bom_parent ON bill_of_materials(parent_product_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_bom_child ON bill_of_materials(child_product_id)")
+
+def _migrate_daily_rollups(cursor):
+    """
+    Adds per-day rollups of revenue, costs (overall and per category) and sales.
+    Triggers keep them current on every insert/update/delete, so period summaries
+    aggregate at most one row per day instead of the raw history.
+    """
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS daily_revenue (
+        day TEXT PRIMARY KEY, -- 'YYYY-MM-DD'
+        total_amount REAL NOT NULL DEFAULT 0,
+        entry_count INTEGER NOT NULL DEFAULT 0
+    );
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS daily_costs (
+        day TEXT PRIMARY KEY,
+        total_amount REAL NOT NULL DEFAULT 0,
+        entry_count INTEGER NOT NULL DEFAULT 0
+    );
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS daily_cost_categories (
+        day TEXT NOT NULL,
+        category TEXT NOT NULL,
+        total_amount REAL NOT NULL DEFAULT 0,
+        entry_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, category)
+    );
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS daily_sales (
+        day TEXT PRIMARY KEY,
+        quantity REAL NOT NULL DEFAULT 0,
+        total_amount REAL NOT NULL DEFAULT 0,
+        entry_count INTEGER NOT NULL DEFAULT 0
+    );
+    ''')
+    for rollup, source, keys, values, watched in ROLLUPS:
+        _create_rollup_triggers(cursor, source, rollup, keys, values, watched)
+    _rebuild_rollups(cursor)
+
+def _parses_as(text, number):
+    """True if `text` is a number equal to `number` ('2' and '2.0' both match 2)."""
     try:
-        cursor.execute('ALTER TABLE costs ADD COLUMN category TEXT DEFAULT "Others"')
-    except sqlite3.OperationalError:
-        pass  # Column already exists
+        return float(text) == number
+    except ValueError:
+        return False
 
-    conn.commit()
-    conn.close()
+def _migrate_revenue_sale_link(cursor):
+    """
+    Links each sale's revenue row through revenue.sale_id instead of matching
+    "Sale: <name> x<qty>" descriptions, and backfills the link for existing rows.
+    """
+    _add_missing_columns(cursor, 'revenue', [('sale_id', 'INTEGER REFERENCES sales(id) ON DELETE CASCADE')])
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_revenue_sale ON revenue(sale_id)")
+
+    # Backfill: pair each sale with one unlinked revenue row written for it: same date
+    # and amount, and a description that is exactly "Sale: <product name> x<quantity>"
+    # (so "Bolt" never takes the row of "Bolt xl"). Identical candidates cannot be told
+    # apart, so ties go in id order: the oldest sale gets the oldest matching row.
+    # Rows that match no sale stay unlinked, as plain revenue.
+    candidates = {}
+    cursor.execute("""
+        SELECT id, description, amount, date FROM revenue
+        WHERE sale_id IS NULL AND description LIKE 'Sale: %'
+        ORDER BY id
+    """)
+    for row in cursor.fetchall():
+        candidates.setdefault((row['date'], row['amount']), []).append(row)
+    links = []
+    cursor.execute("SELECT id, product_name, quantity, total_amount, date FROM sales ORDER BY id")
+    for sale in cursor.fetchall():
+        rows = candidates.get((sale['date'], sale['total_amount']), [])
+        prefix = f"Sale: {sale['product_name']} x"
+        for index, row in enumerate(rows):
+            if row['description'].startswith(prefix) and _parses_as(row['description'][len(prefix):], sale['quantity']):
+                links.append((sale['id'], row['id']))
+                del rows[index]
+                break
+    cursor.executemany("UPDATE revenue SET sale_id = ? WHERE id = ?", links)
+
+def _migrate_bom_cost_cache(cursor):
+    """Adds the persisted rolled-up BOM cost of every product and fills it."""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS bom_cost_cache (
+        product_id INTEGER PRIMARY KEY REFERENCES products(id) ON DELETE CASCADE,
+        materials_cost REAL NOT NULL DEFAULT 0,
+        calculated_cost REAL NOT NULL DEFAULT 0,
+        component_unit_cost REAL NOT NULL DEFAULT 0
+    );
+    ''')
+    _rebuild_bom_cost_cache(cursor.connection)
+
+def _migrate_production_orders(cursor):
+    """Adds the production order log."""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS production_orders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        product_id INTEGER REFERENCES products(id) ON DELETE SET NULL,
+        product_name TEXT,
+        quantity REAL NOT NULL,
+        status TEXT NOT NULL CHECK(status IN ('completed', 'failed')),
+        message TEXT,
+        materials_cost REAL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_production_orders_created ON production_orders(created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_production_orders_product ON production_orders(product_id, created_at)")
+
+def _migrate_stock_ledger(cursor):
+    """Adds the stock movement ledger and month-end snapshots, opened with the current stock."""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS stock_movements (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        product_id INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+        quantity REAL NOT NULL,
+        reason TEXT NOT NULL CHECK(reason IN ('opening', 'initial', 'adjustment', 'sale', 'sale_reversal', 'production', 'import')),
+        reference_id INTEGER,
+        movement_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_stock_movements_product_date ON stock_movements(product_id, movement_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_stock_movements_date ON stock_movements(movement_at)")
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS stock_snapshots (
+        product_id INTEGER NOT NULL REFERENCES products(id) ON DELETE CASCADE,
+        snapshot_date TEXT NOT NULL,
+        stock REAL NOT NULL,
+        unit_cost REAL,
+        PRIMARY KEY (product_id, snapshot_date)
+    ) WITHOUT ROWID;
+    ''')
+    # A movement effective on or before a snapshot's day makes that snapshot (and later ones) stale
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS stock_movements_invalidate_snapshots
+    AFTER INSERT ON stock_movements
+    BEGIN
+        DELETE FROM stock_snapshots
+        WHERE product_id = NEW.product_id AND snapshot_date >= substr(NEW.movement_at, 1, 10);
+    END;
+    """)
+    # History before the ledger is unknown: open it with today's stock
+    cursor.execute("""
+    INSERT INTO stock_movements (product_id, quantity, reason)
+    SELECT id, stock, 'opening' FROM products WHERE stock != 0
+    """)
+
+def _migrate_low_stock_index(cursor):
+    """Adds a partial index holding only the products below their minimum stock."""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_low_stock ON products(id) WHERE stock < min_stock")
+
+def _create_sync_triggers(cursor, table):
+    """Stamps every inserted/updated row of `table` with a new sync version and tombstones deletes."""
+    bump = "UPDATE sync_state SET version = version + 1 WHERE id = 1;"
+    stamp = f"UPDATE {table} SET row_version = (SELECT version FROM sync_state WHERE id = 1) WHERE id = NEW.id;"
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_sync_insert AFTER INSERT ON {table} BEGIN {bump} {stamp} END")
+    cursor.execute(
+        f"CREATE TRIGGER IF NOT EXISTS {table}_sync_update AFTER UPDATE ON {table} "
+        f"WHEN NEW.row_version = OLD.row_version BEGIN {bump} {stamp} END"
+    )
+    cursor.execute(
+        f"CREATE TRIGGER IF NOT EXISTS {table}_sync_delete AFTER DELETE ON {table} BEGIN {bump} "
+        f"INSERT INTO sync_tombstones (table_name, row_id, row_version) "
+        f"VALUES ('{table}', OLD.id, (SELECT version FROM sync_state WHERE id = 1)); END"
+    )
+
+def _migrate_sync_tracking(cursor):
+    """Adds row versions and delete tombstones for delta sync (see get_changes_since)."""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS sync_state (
+        id INTEGER PRIMARY KEY CHECK(id = 1),
+        version INTEGER NOT NULL
+    );
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO sync_state (id, version) VALUES (1, 0)")
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS sync_tombstones (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        table_name TEXT NOT NULL,
+        row_id INTEGER NOT NULL,
+        row_version INTEGER NOT NULL
+    );
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sync_tombstones_version ON sync_tombstones(table_name, row_version)")
+    # Existing rows keep version 0: clients get them from the initial full snapshot
+    for table in SYNC_TABLES:
+        _add_missing_columns(cursor, table, [('row_version', 'INTEGER NOT NULL DEFAULT 0')])
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_row_version ON {table}(row_version)")
+        _create_sync_triggers(cursor, table)
+
+def _migrate_product_search(cursor):
+    """
+    Adds the products_fts full-text index (name, sku, supplier), kept in sync by triggers.
+    Skipped when this SQLite build has no FTS5; search_products() then falls back to LIKE.
+    """
+    try:
+        cursor.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+            name, sku, supplier,
+            content='products', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+        """)
+    except sqlite3.OperationalError as e:
+        print(f"FTS5 not available, product search will use LIKE: {e}")
+        return
+    insert = "INSERT INTO products_fts (rowid, name, sku, supplier) VALUES (NEW.id, NEW.name, NEW.sku, NEW.supplier);"
+    delete = ("INSERT INTO products_fts (products_fts, rowid, name, sku, supplier) "
+              "VALUES ('delete', OLD.id, OLD.name, OLD.sku, OLD.supplier);")
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN {insert} END")
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN {delete} END")
+    cursor.execute(
+        f"CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF name, sku, supplier ON products "
+        f"BEGIN {delete} {insert} END"
+    )
+    cursor.execute("INSERT INTO products_fts (products_fts) VALUES ('rebuild')")
+
+def _migrate_daily_product_sales(cursor):
+    """Adds the per-product daily sales rollup used for sales velocity."""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS daily_product_sales (
+        product_id INTEGER NOT NULL, -- 0 for sales whose product was deleted
+        day TEXT NOT NULL,
+        quantity REAL NOT NULL DEFAULT 0,
+        total_amount REAL NOT NULL DEFAULT 0,
+        entry_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (product_id, day)
+    );
+    ''')
+    for rollup, source, keys, values, watched in PRODUCT_ROLLUPS:
+        _create_rollup_triggers(cursor, source, rollup, keys, values, watched)
+    _rebuild_rollups(cursor, PRODUCT_ROLLUPS)
+
+def _migrate_last_movement(cursor):
+    """
+    Adds products.last_sold_at and last_moved_at, backfilled from sales and the ledger.
+    Triggers keep them current: last_sold_at follows the latest sale of the product
+    (recomputed through idx_sales_product_date when that sale is edited or deleted),
+    last_moved_at the latest stock movement. The ledger opening and sale reversals
+    are bookkeeping, not activity, so they do not count as movement.
+    """
+    _add_missing_columns(cursor, 'products', [('last_sold_at', 'TIMESTAMP'), ('last_moved_at', 'TIMESTAMP')])
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_last_sold ON products(last_sold_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_last_moved ON products(last_moved_at)")
+
+    def touch_sold(product, sold_at):
+        return (f"UPDATE products SET last_sold_at = {sold_at} WHERE id = {product} "
+                f"AND (last_sold_at IS NULL OR last_sold_at < {sold_at});")
+
+    def recompute_sold(product):
+        return (f"UPDATE products SET last_sold_at = (SELECT MAX(date) FROM sales WHERE product_id = {product}) "
+                f"WHERE id = {product};")
+
+    cursor.execute(
+        "CREATE TRIGGER IF NOT EXISTS sales_last_sold_insert AFTER INSERT ON sales "
+        f"WHEN NEW.product_id IS NOT NULL AND NEW.date IS NOT NULL BEGIN {touch_sold('NEW.product_id', 'NEW.date')} END"
+    )
+    # Only the product's latest sale going away changes its last_sold_at
+    cursor.execute(
+        "CREATE TRIGGER IF NOT EXISTS sales_last_sold_delete AFTER DELETE ON sales "
+        "WHEN OLD.product_id IS NOT NULL AND OLD.date IS NOT NULL "
+        "AND OLD.date = (SELECT last_sold_at FROM products WHERE id = OLD.product_id) "
+        f"BEGIN {recompute_sold('OLD.product_id')} END"
+    )
+    cursor.execute(
+        "CREATE TRIGGER IF NOT EXISTS sales_last_sold_update AFTER UPDATE OF product_id, date ON sales "
+        f"BEGIN {recompute_sold('OLD.product_id')} {recompute_sold('NEW.product_id')} END"
+    )
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS stock_movements_last_moved
+    AFTER INSERT ON stock_movements
+    WHEN NEW.reason NOT IN ('opening', 'sale_reversal')
+    BEGIN
+        UPDATE products SET last_moved_at = NEW.movement_at
+        WHERE id = NEW.product_id AND (last_moved_at IS NULL OR last_moved_at < NEW.movement_at);
+    END;
+    """)
+
+    cursor.execute("UPDATE products SET last_sold_at = (SELECT MAX(date) FROM sales WHERE product_id = products.id)")
+    # Sales older than the ledger only show up in sales
+    cursor.execute("""
+    UPDATE products SET last_moved_at = (
+        SELECT MAX(moved_at) FROM (
+            SELECT MAX(movement_at) as moved_at FROM stock_movements
+            WHERE product_id = products.id AND reason NOT IN ('opening', 'sale_reversal')
+            UNION ALL
+            SELECT products.last_sold_at
+        )
+    )
+    """)
+
+def _migrate_product_sales_stats(cursor):
+    """
+    Captures the unit cost on every sale and adds the per-product sales totals.
+    Existing sales get the product's current cost (the cost they were sold at is unknown).
+    daily_product_sales gains cost_of_goods, so its triggers are recreated.
+    """
+    _add_missing_columns(cursor, 'sales', [('unit_cost', 'REAL')])
+    cursor.execute("UPDATE sales SET unit_cost = (SELECT cost FROM products WHERE id = sales.product_id) WHERE product_id IS NOT NULL")
+    _add_missing_columns(cursor, 'daily_product_sales', [('cost_of_goods', 'REAL NOT NULL DEFAULT 0')])
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS product_sales_stats (
+        product_id INTEGER PRIMARY KEY, -- 0 for sales whose product was deleted
+        quantity REAL NOT NULL DEFAULT 0,
+        total_amount REAL NOT NULL DEFAULT 0,
+        cost_of_goods REAL NOT NULL DEFAULT 0,
+        entry_count INTEGER NOT NULL DEFAULT 0
+    );
+    ''')
+    # One index per ranking (quantity, revenue, profit)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_product_sales_stats_quantity ON product_sales_stats(quantity)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_product_sales_stats_revenue ON product_sales_stats(total_amount)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_product_sales_stats_profit ON product_sales_stats(total_amount - cost_of_goods)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_daily_product_sales_day ON daily_product_sales(day)")
+    for event in ('insert', 'delete', 'update'):
+        cursor.execute(f"DROP TRIGGER IF EXISTS daily_product_sales_after_{event}")
+    for rollup, source, keys, values, watched in PRODUCT_SALES_ROLLUPS:
+        _create_rollup_triggers(cursor, source, rollup, keys, values, watched)
+    _rebuild_rollups(cursor, PRODUCT_SALES_ROLLUPS)
+
+def _migrate_nullable_production_quantity(cursor):
+    """
+    Makes production_orders.quantity nullable, so orders rejected before running (e.g. a
+    quantity that is not a number) are logged too. The table is rebuilt, as SQLite
+    cannot alter a column constraint.
+    """
+    cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'production_orders'")
+    row = cursor.fetchone()
+    last_id = row['seq'] if row else 0
+    cursor.execute('''
+    CREATE TABLE production_orders_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        product_id INTEGER REFERENCES products(id) ON DELETE SET NULL,
+        product_name TEXT,
+        quantity REAL,
+        status TEXT NOT NULL CHECK(status IN ('completed', 'failed')),
+        message TEXT,
+        materials_cost REAL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    ''')
+    cursor.execute('''
+    INSERT INTO production_orders_new (id, product_id, product_name, quantity, status, message, materials_cost, created_at)
+    SELECT id, product_id, product_name, quantity, status, message, materials_cost, created_at FROM production_orders
+    ''')
+    cursor.execute("DROP TABLE production_orders")
+    cursor.execute("ALTER TABLE production_orders_new RENAME TO production_orders")
+    cursor.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'production_orders'", (last_id,))
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_production_orders_created ON production_orders(created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_production_orders_product ON production_orders(product_id, created_at)")
+
+def _migrate_snapshot_adjustments(cursor):
+    """
+    A movement dated on or before a snapshot now adjusts the snapshot's stock instead of
+    deleting it, so the unit cost recorded when the month closed is kept.
+    """
+    cursor.execute("DROP TRIGGER IF EXISTS stock_movements_invalidate_snapshots")
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS stock_movements_adjust_snapshots
+    AFTER INSERT ON stock_movements
+    BEGIN
+        UPDATE stock_snapshots SET stock = stock + NEW.quantity
+        WHERE product_id = NEW.product_id AND snapshot_date >= substr(NEW.movement_at, 1, 10);
+    END;
+    """)
+
+def _migrate_product_sort_indexes(cursor):
+    """Adds the indexes behind the stock and cost sorts of the paginated product list."""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_stock ON products(stock, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_cost ON products(cost, id)")
+
+def _migrate_aging_index(cursor):
+    """
+    Replaces the last_moved_at index with a partial one over the products in stock that
+    also holds stock and cost, so each aging bucket is an index range read on its own.
+    """
+    cursor.execute("DROP INDEX IF EXISTS idx_products_last_moved")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_in_stock_moved ON products(last_moved_at, stock, cost) WHERE stock > 0")
+
+def _migrate_unique_sku(cursor):
+    """
+    Adds a unique index on products.sku. Databases whose sku column came from ALTER TABLE
+    have no UNIQUE constraint, which the import upsert and the exact SKU lookup rely on.
+    Blank SKUs become NULL, and repeated ones are kept only by the oldest product.
+    """
+    cursor.execute("UPDATE products SET sku = NULL WHERE TRIM(sku) = ''")
+    cursor.execute("""
+    UPDATE products SET sku = NULL
+    WHERE sku IS NOT NULL
+      AND id NOT IN (SELECT MIN(id) FROM products WHERE sku IS NOT NULL GROUP BY sku)
+    """)
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_products_sku ON products(sku) WHERE sku IS NOT NULL")
+
+def _migrate_tombstone_retention(cursor):
+    """
+    Dates sync tombstones so old ones can be pruned (prune_sync_tombstones), and records
+    in sync_state.pruned_version the newest version pruned: tokens older than that can
+    no longer get a complete delta. Existing tombstones are dated now.
+    """
+    _add_missing_columns(cursor, 'sync_state', [('pruned_version', 'INTEGER NOT NULL DEFAULT 0')])
+    _add_missing_columns(cursor, 'sync_tombstones', [('deleted_at', 'TIMESTAMP')])
+    cursor.execute("UPDATE sync_tombstones SET deleted_at = CURRENT_TIMESTAMP WHERE deleted_at IS NULL")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sync_tombstones_deleted ON sync_tombstones(deleted_at)")
+    for table in SYNC_TABLES:
+        cursor.execute(f"DROP TRIGGER IF EXISTS {table}_sync_delete")
+        cursor.execute(
+            f"CREATE TRIGGER {table}_sync_delete AFTER DELETE ON {table} BEGIN "
+            f"UPDATE sync_state SET version = version + 1 WHERE id = 1; "
+            f"INSERT INTO sync_tombstones (table_name, row_id, row_version, deleted_at) "
+            f"VALUES ('{table}', OLD.id, (SELECT version FROM sync_state WHERE id = 1), CURRENT_TIMESTAMP); END"
+        )
+
+MIGRATIONS = [
+    _migrate_base_schema,
+    _migrate_nullable_sale_product,
+    _migrate_query_indexes,
+    _migrate_daily_rollups,
+    _migrate_revenue_sale_link,
+    _migrate_bom_cost_cache,
+    _migrate_production_orders,
+    _migrate_stock_ledger,
+    _migrate_low_stock_index,
+    _migrate_sync_tracking,
+    _migrate_product_search,
+    _migrate_daily_product_sales,
+    _migrate_last_movement,
+    _migrate_product_sales_stats,
+    _migrate_nullable_production_quantity,
+    _migrate_snapshot_adjustments,
+    _migrate_product_sort_indexes,
+    _migrate_aging_index,
+    _migrate_unique_sku,
+    _migrate_tombstone_retention,
+]
+
+def get_schema_version():
+    """Returns the number of migrations applied to the database (PRAGMA user_version)."""
+    with connection() as conn:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def init_db():
+    """
+    Initializes the database.
+    Applies any pending migrations; each one runs in its own transaction together
+    with the user_version bump, so a failed step leaves the database at the previous version.
+    """
+    current = get_schema_version()
+    if current >= len(MIGRATIONS):
+        return
+    for version, migration in enumerate(MIGRATIONS[current:], start=current + 1):
+        # BEGIN IMMEDIATE: a second instance starting at the same time waits here
+        # and then sees the version this one wrote
+        with transaction(immediate=True) as conn:
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= version:
+                continue
+            migration(conn.cursor())
+            conn.execute(f"PRAGMA user_version = {version}")
 
 # --- Product CRUD Functions ---
 
 def add_product(name, product_type, stock, min_stock, cost, supplier=None, purchase_date=None, exit_date=None, sku=None, weight=0, stock_unit_type='units', additional_cost=0):
     """Adds a new product to inventory (with cost, supplier, dates, SKU, weight, stock unit type and additional cost)."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
     # Validate stock_unit_type
     if stock_unit_type not in ('units', 'grams'):
         stock_unit_type = 'units'
-    cursor.execute(
-        "INSERT INTO products (name, product_type, stock, min_stock, cost, supplier, purchase_date, exit_date, sku, weight, stock_unit_type, additional_cost) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-        (name, product_type, stock, min_stock, cost, supplier, purchase_date, exit_date, sku, weight, stock_unit_type, additional_cost)
-    )
-    conn.commit()
-    conn.close()
+    with transaction(tables=('products', 'stock_movements', 'bom_cost_cache')) as conn:
+        cursor = conn.execute(
+            "INSERT INTO products (name, product_type, stock, min_stock, cost, supplier, purchase_date, exit_date, sku, weight, stock_unit_type, additional_cost) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (name, product_type, stock, min_stock, cost, supplier, purchase_date, exit_date, sku, weight, stock_unit_type, additional_cost)
+        )
+        _record_movements(conn, [(cursor.lastrowid, float(stock or 0))], 'initial')
+        _refresh_bom_costs(conn, [cursor.lastrowid])
 
 def update_product_stock(product_id, quantity_change):
     """
     NEW! Adjusts a product's stock.
     Uses a relative change (e.g.: +5 or -3).
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "UPDATE products SET stock = stock + ? WHERE id = ?",
-        (quantity_change, product_id)
-    )
-    conn.commit()
-    conn.close()
+    with transaction(tables=('products', 'stock_movements')) as conn:
+        _apply_stock_changes(conn, [(product_id, float(quantity_change))], 'adjustment')
 
 
 def update_product(product_id, name, product_type, stock, min_stock, cost, supplier=None, purchase_date=None, exit_date=None, sku=None, weight=0, stock_unit_type='units', additional_cost=0):
     """Updates an existing product in the database (with cost, supplier, dates, SKU, weight, stock unit type and additional cost)."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
     # Validate stock_unit_type
     if stock_unit_type not in ('units', 'grams'):
         stock_unit_type = 'units'
-    cursor.execute(
-        "UPDATE products SET name = ?, product_type = ?, stock = ?, min_stock = ?, cost = ?, supplier = ?, purchase_date = ?, exit_date = ?, sku = ?, weight = ?, stock_unit_type = ?, additional_cost = ? WHERE id = ?",
-        (name, product_type, stock, min_stock, cost, supplier, purchase_date, exit_date, sku, weight, stock_unit_type, additional_cost, product_id)
-    )
-    conn.commit()
-    conn.close()
+    with transaction(tables=('products', 'stock_movements', 'bom_cost_cache')) as conn:
+        previous = conn.execute("SELECT stock FROM products WHERE id = ?", (product_id,)).fetchone()
+        conn.execute(
+            "UPDATE products SET name = ?, product_type = ?, stock = ?, min_stock = ?, cost = ?, supplier = ?, purchase_date = ?, exit_date = ?, sku = ?, weight = ?, stock_unit_type = ?, additional_cost = ? WHERE id = ?",
+            (name, product_type, stock, min_stock, cost, supplier, purchase_date, exit_date, sku, weight, stock_unit_type, additional_cost, product_id)
+        )
+        if previous:
+            # Editing the stock field is a manual adjustment: log the difference
+            _record_movements(conn, [(product_id, float(stock or 0) - previous['stock'])], 'adjustment')
+        # Cost, weight or unit changes ripple up to every assembly that uses this product
+        _refresh_bom_costs(conn, [product_id])
 
 def delete_product(product_id):
     """Deletes a product from the database."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    # Thanks to "ON DELETE CASCADE", this will also delete associated BOM entries.
-    cursor.execute("DELETE FROM products WHERE id = ?", (product_id,))
-    conn.commit()
-    conn.close()
+    with transaction(tables=('products', 'bill_of_materials', 'bom_cost_cache', 'stock_movements',
+                             'stock_snapshots', 'sales', 'production_orders')) as conn:
+        cursor = conn.execute("SELECT DISTINCT parent_product_id FROM bill_of_materials WHERE child_product_id = ?", (product_id,))
+        parent_ids = [row[0] for row in cursor.fetchall()]
+        # Thanks to "ON DELETE CASCADE", this will also delete associated BOM entries.
+        conn.execute("DELETE FROM products WHERE id = ?", (product_id,))
+        _refresh_bom_costs(conn, parent_ids)
 
-def get_product_by_id(product_id):
-    """Gets a single product by its ID."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, sku, name, product_type, stock, min_stock, cost, supplier, purchase_date, exit_date, weight, stock_unit_type, additional_cost FROM products WHERE id = ?", (product_id,))
-    product = dict(cursor.fetchone())
+def _product_row_to_dict(row):
+    """Converts a products row to a dict and adds the derived total_weight."""
+    product = dict(row)
     # Calculate total weight
     if product['stock_unit_type'] == 'grams':
         product['total_weight'] = product['stock']  # Already in grams
@@ -239,56 +962,437 @@ def get_product_by_id(product_id):
     # Ensure additional_cost exists
     if 'additional_cost' not in product or product['additional_cost'] is None:
         product['additional_cost'] = 0
-    conn.close()
     return product
 
+def get_product_by_id(product_id):
+    """Gets a single product by its ID."""
+    with connection() as conn:
+        row = conn.execute("SELECT id, sku, name, product_type, stock, min_stock, cost, supplier, purchase_date, exit_date, weight, stock_unit_type, additional_cost FROM products WHERE id = ?", (product_id,)).fetchone()
+    return _product_row_to_dict(row)
+
 def get_all_products():
     """Gets all products from inventory (with cost, supplier, dates, SKU, weight, stock unit type and additional cost)."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, sku, name, product_type, stock, min_stock, cost, supplier, purchase_date, exit_date, weight, stock_unit_type, additional_cost FROM products ORDER BY name ASC")
-    products = [dict(row) for row in cursor.fetchall()]
-    # Calculate total weight for each product
-    for product in products:
-        if product['stock_unit_type'] == 'grams':
-            product['total_weight'] = product['stock']  # Already in grams
-        else:
-            product['total_weight'] = product['stock'] * (product['weight'] or 0)  # units * weight
-        # Ensure additional_cost exists
-        if 'additional_cost' not in product or product['additional_cost'] is None:
-            product['additional_cost'] = 0
-    conn.close()
+    with connection() as conn:
+        cursor = conn.execute("SELECT id, sku, name, product_type, stock, min_stock, cost, supplier, purchase_date, exit_date, weight, stock_unit_type, additional_cost FROM products ORDER BY name ASC")
+        # Calculate total weight for each product
+        products = [_product_row_to_dict(row) for row in cursor.fetchall()]
     return products
 
 def get_products_by_type(product_type):
     """Gets products filtered by type (e.g.: 'final', 'hijo')."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, name FROM products WHERE product_type = ? ORDER BY name ASC", (product_type,))
-    products = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+    with connection() as conn:
+        cursor = conn.execute("SELECT id, name FROM products WHERE product_type = ? ORDER BY name ASC", (product_type,))
+        products = [dict(row) for row in cursor.fetchall()]
     return products
 
+# --- Bulk Product Import ---
+
+PRODUCT_IMPORT_COLUMNS = ('sku', 'name', 'product_type', 'stock', 'min_stock', 'cost', 'supplier',
+                          'purchase_date', 'exit_date', 'weight', 'stock_unit_type', 'additional_cost')
+_NUMERIC_PRODUCT_COLUMNS = ('stock', 'min_stock', 'cost', 'weight', 'additional_cost')
+# Values given to new products for blank cells (matched products keep what they have)
+_PRODUCT_IMPORT_DEFAULTS = {column: 0 for column in _NUMERIC_PRODUCT_COLUMNS}
+_PRODUCT_IMPORT_DEFAULTS['stock_unit_type'] = "'units'"
+PRODUCT_TYPES = ('final', 'hijo', 'padre', 'otro')
+
+def _clean_product_record(record, columns):
+    """
+    Validates one import record and returns {column: value} for `columns` (raises ValueError).
+    Blank cells become None.
+    """
+    values = {}
+    for column in columns:
+        value = record.get(column)
+        if isinstance(value, str):
+            value = value.strip()
+        if value in (None, '') and column not in ('name', 'product_type'):
+            values[column] = None
+            continue
+        if column in _NUMERIC_PRODUCT_COLUMNS:
+            value = float(value)
+        elif column == 'name':
+            if not value:
+                raise ValueError("name is required")
+        elif column == 'product_type':
+            if value not in PRODUCT_TYPES:
+                raise ValueError(f"product_type must be one of {', '.join(PRODUCT_TYPES)}")
+        elif column == 'stock_unit_type':
+            if value not in ('units', 'grams'):
+                value = 'units'
+        values[column] = value
+    return values
+
+def upsert_products(records, columns, chunk_size=1000, progress_callback=None):
+    """
+    Inserts or updates products from an iterable of dicts, consumed lazily in chunks.
+    Rows match existing products by sku first, then by name; matched rows are updated
+    in place, so product ids (and the BOM rows and sales that reference them) survive.
+    Only `columns` are written, and a blank cell leaves a matched product's value as it is
+    (new products get the column default). Runs in a single transaction; progress_callback(processed)
+    is called after each chunk. Invalid rows are skipped and reported in 'errors'.
+    """
+    columns = [column for column in PRODUCT_IMPORT_COLUMNS if column in columns]
+    if 'name' not in columns or 'product_type' not in columns:
+        raise ValueError("The import needs at least the 'name' and 'product_type' columns")
+    updates = [column for column in columns if column not in ('sku', 'name')]
+    # Named parameters let the update see the raw cell: NULL (blank) keeps the stored value
+    set_clause = ', '.join(f"{column} = COALESCE(:{column}, {column})" for column in updates)
+    on_sku_conflict = set_clause + ", name = excluded.name" if 'sku' in columns else ''
+    on_name_conflict = set_clause + (", sku = COALESCE(:sku, sku)" if 'sku' in columns else '')
+    insert_values = ', '.join(
+        f"COALESCE(:{column}, {_PRODUCT_IMPORT_DEFAULTS[column]})" if column in _PRODUCT_IMPORT_DEFAULTS else f":{column}"
+        for column in columns
+    )
+    sql = (
+        f"INSERT INTO products ({', '.join(columns)}) VALUES ({insert_values}) "
+        + (f"ON CONFLICT(sku) WHERE sku IS NOT NULL DO UPDATE SET {on_sku_conflict} " if 'sku' in columns else '')
+        + f"ON CONFLICT(name) DO UPDATE SET {on_name_conflict}"
+    )
+
+    processed = 0
+    imported = 0
+    errors = []
+    records = iter(records)
+    with transaction(immediate=True, tables=('products', 'stock_movements', 'bom_cost_cache')) as conn:
+        before = conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+        stock_before = dict(conn.execute("SELECT id, stock FROM products").fetchall()) if 'stock' in columns else {}
+        while True:
+            chunk = list(itertools.islice(records, chunk_size))
+            if not chunk:
+                break
+            rows = []
+            for offset, record in enumerate(chunk):
+                try:
+                    rows.append((processed + offset + 1, _clean_product_record(record, columns)))
+                except (TypeError, ValueError) as e:
+                    errors.append({'row': processed + offset + 1, 'message': str(e)})
+            try:
+                with transaction():
+                    conn.executemany(sql, [values for _, values in rows])
+                imported += len(rows)
+            except sqlite3.IntegrityError:
+                # Some row clashes (e.g. a SKU owned by another product): retry one by one
+                for row_number, values in rows:
+                    try:
+                        with transaction():
+                            conn.execute(sql, values)
+                        imported += 1
+                    except sqlite3.IntegrityError as e:
+                        errors.append({'row': row_number, 'message': str(e)})
+            processed += len(chunk)
+            if progress_callback:
+                progress_callback(processed)
+        inserted = conn.execute("SELECT COUNT(*) FROM products").fetchone()[0] - before
+        if 'stock' in columns:
+            # Log the stock each imported row set (new products start from zero)
+            _record_movements(conn, [
+                (product_id, stock - stock_before.get(product_id, 0))
+                for product_id, stock in conn.execute("SELECT id, stock FROM products")
+            ], 'import')
+        if set(columns) & {'cost', 'weight', 'stock_unit_type', 'additional_cost'}:
+            # Costs may have changed anywhere in the catalog: one topological pass
+            _rebuild_bom_cost_cache(conn)
+        else:
+            # Costs are untouched; new products are in no BOM yet, so they are costed as leaves
+            conn.execute("""
+                INSERT OR IGNORE INTO bom_cost_cache (product_id, materials_cost, calculated_cost, component_unit_cost)
+                SELECT id, 0, COALESCE(additional_cost, 0),
+                       CASE WHEN stock_unit_type = 'grams' AND weight > 0 THEN COALESCE(cost, 0) / weight
+                            ELSE COALESCE(cost, 0) END
+                FROM products
+            """)
+
+    return {
+        'success': True,
+        'message': f'{imported} products imported ({inserted} new, {imported - inserted} updated), {len(errors)} rows skipped.',
+        'processed': processed,
+        'inserted': inserted,
+        'updated': imported - inserted,
+        'errors': errors
+    }
+
+def import_products_csv(source, chunk_size=1000, progress_callback=None):
+    """
+    Imports products from a CSV file (path or open text file) with a header row naming
+    product columns (name, product_type, sku, stock, min_stock, cost, supplier, ...).
+    See upsert_products() for matching and transaction behaviour.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, newline='', encoding='utf-8-sig') as f:
+            return import_products_csv(f, chunk_size, progress_callback)
+    reader = csv.reader(source)
+    header = [column.strip().lower() for column in next(reader, [])]
+    records = (dict(zip(header, row)) for row in reader if any(cell.strip() for cell in row))
+    return upsert_products(records, header, chunk_size, progress_callback)
+
+# --- Keyset Pagination ---
+# Listing functions return one page plus an opaque cursor for the next one.
+# Pages continue from the last row's sort key, e.g. (name, id) > (?, ?), so every page
+# costs the same regardless of how deep the user has scrolled (unlike OFFSET).
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+def _encode_cursor(sort, descending, values):
+    payload = json.dumps({'s': sort, 'd': bool(descending), 'v': values}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+def _decode_cursor(token, sort, descending):
+    """Decodes a cursor token, rejecting tokens from another sort order."""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+        values = payload['v']
+    except (ValueError, KeyError, TypeError, AttributeError):
+        raise ValueError("Invalid pagination cursor")
+    if payload.get('s') != sort or payload.get('d') != bool(descending):
+        raise ValueError("Pagination cursor does not match the requested sort order")
+    return values
+
+def _like_pattern(text):
+    """Builds a LIKE '%text%' pattern with wildcards escaped (use with ESCAPE '\\')."""
+    escaped = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"%{escaped}%"
+
+def _fetch_page(table, columns, conditions, params, sort_columns, sort, descending=False,
+                limit=PAGE_SIZE, cursor=None, include_total=False, row_to_dict=dict):
+    """
+    Runs a keyset-paginated SELECT over `table`.
+    sort_columns must end with a unique column (id) so the order is total.
+    Returns {'items', 'next_cursor', 'total'}; total is only counted when requested.
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    page_conditions = list(conditions)
+    page_params = list(params)
+    if cursor:
+        values = _decode_cursor(cursor, sort, descending)
+        if len(values) != len(sort_columns):
+            raise ValueError("Invalid pagination cursor")
+        placeholders = ', '.join('?' for _ in sort_columns)
+        page_conditions.append(f"({', '.join(sort_columns)}) {'<' if descending else '>'} ({placeholders})")
+        page_params.extend(values)
+    direction = 'DESC' if descending else 'ASC'
+    order_by = ', '.join(f"{column} {direction}" for column in sort_columns)
+
+    with connection() as conn:
+        rows = conn.execute(
+            f"SELECT {columns} FROM {table} WHERE {' AND '.join(page_conditions) or '1 = 1'} "
+            f"ORDER BY {order_by} LIMIT ?",
+            page_params + [limit + 1]
+        ).fetchall()
+        total = None
+        if include_total:
+            total = conn.execute(
+                f"SELECT COUNT(*) FROM {table} WHERE {' AND '.join(conditions) or '1 = 1'}", params
+            ).fetchone()[0]
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = None
+    if has_more:
+        next_cursor = _encode_cursor(sort, descending, [rows[-1][column] for column in sort_columns])
+    return {'items': [row_to_dict(row) for row in rows], 'next_cursor': next_cursor, 'total': total}
+
+def _sort_columns(sort, allowed):
+    if sort not in allowed:
+        raise ValueError(f"Unsupported sort '{sort}'. Use one of: {', '.join(allowed)}")
+    return allowed[sort]
+
+SEARCH_LIMIT = 20
+
+def _fts_query(text):
+    """Turns user input into an FTS5 query: every word must match, as a prefix."""
+    words = re.findall(r'\w+', text)
+    return ' '.join('"' + word + '"*' for word in words)
+
+def search_products(query, limit=SEARCH_LIMIT):
+    """
+    Searches products by name, SKU and supplier.
+    An exact SKU match comes first (unique index lookup); the rest are prefix matches
+    on every word, ranked by bm25 with name weighted over SKU over supplier. Uses the
+    products_fts index when available and LIKE otherwise.
+    """
+    query = (query or '').strip()
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    if not query:
+        return []
+    columns = "p.id, p.sku, p.name, p.product_type, p.stock, p.min_stock, p.cost, p.supplier, p.purchase_date, p.exit_date, p.weight, p.stock_unit_type, p.additional_cost"
+    with connection() as conn:
+        rows = conn.execute(f"SELECT {columns} FROM products p WHERE p.sku = ?", (query,)).fetchall()
+        exact_id = rows[0]['id'] if rows else -1
+        has_fts = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products_fts'").fetchone()
+        match = _fts_query(query)
+        if has_fts and match:
+            rows += conn.execute(f"""
+                SELECT {columns}
+                FROM products_fts
+                JOIN products p ON p.id = products_fts.rowid
+                WHERE products_fts MATCH ? AND p.id != ?
+                ORDER BY bm25(products_fts, 10.0, 5.0, 1.0)
+                LIMIT ?
+            """, (match, exact_id, limit)).fetchall()
+        elif not has_fts:
+            pattern = _like_pattern(query)
+            rows += conn.execute(f"""
+                SELECT {columns} FROM products p
+                WHERE (p.name LIKE ? ESCAPE '\\' OR p.sku LIKE ? ESCAPE '\\' OR p.supplier LIKE ? ESCAPE '\\')
+                  AND p.id != ?
+                ORDER BY p.name ASC
+                LIMIT ?
+            """, (pattern, pattern, pattern, exact_id, limit)).fetchall()
+    return [_product_row_to_dict(row) for row in rows[:limit]]
+
+PRODUCT_SORTS = {'name': ['name', 'id'], 'stock': ['stock', 'id'], 'cost': ['cost', 'id']}
+
+def get_products_page(search=None, product_type=None, sort='name', descending=False,
+                      limit=PAGE_SIZE, cursor=None, include_total=False):
+    """
+    Gets one page of products, filtered by text (name, SKU, supplier) and type.
+    Pass the returned next_cursor back to get the following page.
+    """
+    conditions, params = [], []
+    if search:
+        conditions.append("(name LIKE ? ESCAPE '\\' OR sku LIKE ? ESCAPE '\\' OR supplier LIKE ? ESCAPE '\\')")
+        params.extend([_like_pattern(search)] * 3)
+    if product_type:
+        conditions.append("product_type = ?")
+        params.append(product_type)
+    return _fetch_page(
+        'products',
+        "id, sku, name, product_type, stock, min_stock, cost, supplier, purchase_date, exit_date, weight, stock_unit_type, additional_cost",
+        conditions, params, _sort_columns(sort, PRODUCT_SORTS), sort, descending,
+        limit, cursor, include_total, row_to_dict=_product_row_to_dict
+    )
+
 # --- BOM (Bill of Materials) Functions ---
 
 def add_bom_entry(parent_product_id, child_product_id, quantity):
-    """Adds a component (child) to a bill of materials (parent)."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO bill_of_materials (parent_product_id, child_product_id, quantity) VALUES (?, ?, ?)",
-        (parent_product_id, child_product_id, quantity)
-    )
-    conn.commit()
-    conn.close()
+    """
+    Adds a component (child) to a bill of materials (parent).
+    Raises ValueError if the child already contains the parent (that would create a cycle).
+    """
+    with transaction(tables=('bill_of_materials', 'bom_cost_cache')) as conn:
+        cursor = conn.execute("""
+            WITH RECURSIVE descendants(product_id) AS (
+                SELECT ?
+                UNION
+                SELECT bom.child_product_id
+                FROM descendants JOIN bill_of_materials bom ON bom.parent_product_id = descendants.product_id
+            )
+            SELECT 1 FROM descendants WHERE product_id = ?
+        """, (child_product_id, parent_product_id))
+        if cursor.fetchone():
+            raise ValueError("This component contains the product itself; adding it would create a cycle in the BOM.")
+        conn.execute(
+            "INSERT INTO bill_of_materials (parent_product_id, child_product_id, quantity) VALUES (?, ?, ?)",
+            (parent_product_id, child_product_id, quantity)
+        )
+        _refresh_bom_costs(conn, [parent_product_id])
+
+# Deepest BOM level explode_bom() follows; deeper branches are reported as truncated
+BOM_MAX_DEPTH = 25
+
+def _component_unit_cost(cost, unit_type, weight):
+    """Cost of one stock unit of a component (per gram for 'grams' products with a unit weight)."""
+    cost = cost or 0
+    if unit_type == 'grams' and (weight or 0) > 0:
+        # Cost is per unit but stock is in grams: convert to cost per gram
+        return cost / weight
+    return cost
+
+def explode_bom(product_id, quantity=1, max_depth=BOM_MAX_DEPTH):
+    """
+    Explodes the complete multi-level BOM of a product in a single recursive query.
+    Returns the gross quantity of every leaf component (a product without its own BOM)
+    needed for `quantity` units of the product, in the component's stock unit, plus
+    the sub-assemblies crossed on the way. A branch that loops back onto its own path
+    is cut and listed in 'cycles'; branches deeper than max_depth set 'truncated'.
+    Returns None if the product does not exist.
+    """
+    with connection() as conn:
+        root = conn.execute("SELECT id, name, stock_unit_type FROM products WHERE id = ?", (product_id,)).fetchone()
+        if not root:
+            return None
+        cursor = conn.execute("""
+            WITH RECURSIVE tree(product_id, quantity, depth, path, is_cycle) AS (
+                SELECT ?, ?, 0, ',' || ? || ',', 0
+                UNION ALL
+                SELECT
+                    bom.child_product_id,
+                    tree.quantity * bom.quantity,
+                    tree.depth + 1,
+                    tree.path || bom.child_product_id || ',',
+                    instr(tree.path, ',' || bom.child_product_id || ',') > 0
+                FROM tree
+                JOIN bill_of_materials bom ON bom.parent_product_id = tree.product_id
+                WHERE tree.is_cycle = 0 AND tree.depth < ?
+            )
+            SELECT
+                tree.product_id, tree.quantity, tree.depth, tree.is_cycle,
+                EXISTS (SELECT 1 FROM bill_of_materials b WHERE b.parent_product_id = tree.product_id) AS has_bom,
+                p.name, p.sku, p.stock, p.cost, p.additional_cost, p.stock_unit_type, p.weight
+            FROM tree
+            JOIN products p ON p.id = tree.product_id
+            WHERE tree.depth > 0
+        """, (product_id, quantity, product_id, max_depth))
+        rows = cursor.fetchall()
+
+    components = {}
+    subassemblies = {}
+    cycles = set()
+    truncated = False
+    for row in rows:
+        if row['is_cycle']:
+            cycles.add(row['product_id'])
+            continue
+        if row['has_bom']:
+            if row['depth'] >= max_depth:
+                truncated = True
+            entry = subassemblies.setdefault(row['product_id'], {
+                'product_id': row['product_id'],
+                'name': row['name'],
+                'required_quantity': 0,
+                'additional_cost': row['additional_cost'] or 0,
+            })
+            entry['required_quantity'] += row['quantity']
+            continue
+        unit_type = row['stock_unit_type'] or 'units'
+        entry = components.setdefault(row['product_id'], {
+            'product_id': row['product_id'],
+            'name': row['name'],
+            'sku': row['sku'],
+            'stock': row['stock'],
+            'unit_type': unit_type,
+            'weight': row['weight'] or 0,
+            'cost': row['cost'] or 0,
+            'unit_cost': _component_unit_cost(row['cost'], unit_type, row['weight']),
+            'required_quantity': 0,
+            'depth': row['depth'],
+        })
+        entry['required_quantity'] += row['quantity']
+        entry['depth'] = min(entry['depth'], row['depth'])
+
+    for entry in components.values():
+        # Normalize to grams so unit- and gram-measured components can be compared
+        if entry['unit_type'] == 'grams':
+            entry['required_in_grams'] = entry['required_quantity']
+        else:
+            entry['required_in_grams'] = entry['required_quantity'] * entry['weight']
+
+    return {
+        'product_id': product_id,
+        'product_name': root['name'],
+        'quantity': quantity,
+        'components': sorted(components.values(), key=lambda c: (c['depth'], c['name'])),
+        'subassemblies': sorted(subassemblies.values(), key=lambda s: s['name']),
+        'cycles': sorted(cycles),
+        'truncated': truncated,
+    }
 
 def get_bom_for_product(parent_product_id):
     """
     Gets the bill of materials (BOM) for a parent/final product.
     Uses a JOIN to get child product names.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
     query = """
     SELECT 
         bom.id as bom_id, 
@@ -299,47 +1403,87 @@ def get_bom_for_product(parent_product_id):
     JOIN products AS p ON bom.child_product_id = p.id
     WHERE bom.parent_product_id = ?
     """
-    cursor.execute(query, (parent_product_id,))
-    bom_items = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+    with connection() as conn:
+        cursor = conn.execute(query, (parent_product_id,))
+        bom_items = [dict(row) for row in cursor.fetchall()]
+    return bom_items
+
+def get_full_bom(max_depth=BOM_MAX_DEPTH):
+    """
+    Gets every BOM entry in one query, with the parent and child names and SKUs and the
+    entry's level: 1 for the components of top-level products (those used in no other
+    BOM), 2 for the components of their sub-assemblies, and so on. A sub-assembly used
+    at several depths is listed at its deepest one. Entries only reachable through a
+    cycle have no level (None). Ordered by level, parent name and child name.
+    """
+    query = """
+    WITH RECURSIVE levels(product_id, level) AS (
+        SELECT DISTINCT parent_product_id, 1
+        FROM bill_of_materials
+        WHERE parent_product_id NOT IN (SELECT child_product_id FROM bill_of_materials)
+        UNION
+        SELECT bom.child_product_id, levels.level + 1
+        FROM levels
+        JOIN bill_of_materials bom ON bom.parent_product_id = levels.product_id
+        WHERE levels.level < ?
+    ),
+    parent_levels AS (
+        SELECT product_id, MAX(level) as level FROM levels GROUP BY product_id
+    )
+    SELECT 
+        bom.id as bom_id,
+        parent_levels.level,
+        parent.id as parent_product_id,
+        parent.sku as parent_sku,
+        parent.name as parent_product_name,
+        child.id as child_product_id,
+        child.sku as child_sku,
+        child.name as child_product_name,
+        bom.quantity
+    FROM bill_of_materials AS bom
+    JOIN products AS parent ON bom.parent_product_id = parent.id
+    JOIN products AS child ON bom.child_product_id = child.id
+    LEFT JOIN parent_levels ON parent_levels.product_id = bom.parent_product_id
+    ORDER BY parent_levels.level IS NULL, parent_levels.level, parent.name, child.name
+    """
+    with connection() as conn:
+        cursor = conn.execute(query, (max_depth,))
+        bom_items = [dict(row) for row in cursor.fetchall()]
     return bom_items
 
 def calculate_bom_cost(product_id):
     """
-    Calculates the unit cost of a product based on its BOM (Bill of Materials).
+    Calculates the unit cost of a product based on its BOM (Bill of Materials), across all levels.
+    Totals come from the rolled-up cost cache; the breakdown lists the direct components,
+    each costed per stock unit (per gram for 'grams' products, rolled up for sub-assemblies).
     Returns the calculated cost, breakdown by component and additional cost.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Get the parent product
-    cursor.execute("SELECT id, name, cost, additional_cost FROM products WHERE id = ?", (product_id,))
-    parent = cursor.fetchone()
-    if not parent:
-        conn.close()
-        return None
-    
-    parent = dict(parent)
+    with connection() as conn:
+        parent = conn.execute("""
+            SELECT p.id, p.name, p.cost, p.additional_cost, c.materials_cost, c.calculated_cost
+            FROM products p
+            LEFT JOIN bom_cost_cache c ON c.product_id = p.id
+            WHERE p.id = ?
+        """, (product_id,)).fetchone()
+        if not parent:
+            return None
+        parent = dict(parent)
+        cursor = conn.execute("""
+            SELECT 
+                bom.quantity as required_quantity,
+                p.name as child_name,
+                p.cost as child_cost,
+                p.stock_unit_type as child_stock_unit_type,
+                p.weight as child_weight,
+                c.component_unit_cost
+            FROM bill_of_materials bom
+            JOIN products p ON bom.child_product_id = p.id
+            LEFT JOIN bom_cost_cache c ON c.product_id = p.id
+            WHERE bom.parent_product_id = ?
+        """, (product_id,))
+        components = [dict(row) for row in cursor.fetchall()]
     additional_cost = parent.get('additional_cost', 0) or 0
     
-    # Get all BOM components with their costs
-    cursor.execute("""
-        SELECT 
-            bom.id as bom_id,
-            bom.quantity as required_quantity,
-            p.id as child_id,
-            p.name as child_name,
-            p.cost as child_cost,
-            p.stock_unit_type as child_stock_unit_type,
-            p.weight as child_weight
-        FROM bill_of_materials bom
-        JOIN products p ON bom.child_product_id = p.id
-        WHERE bom.parent_product_id = ?
-    """, (product_id,))
-    
-    components = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    
     if not components:
         return {
             'product_id': product_id,
@@ -351,42 +1495,23 @@ def calculate_bom_cost(product_id):
             'message': 'This product has no components defined in the BOM. Only additional cost applied.'
         }
     
-    # Calculate total materials cost
-    total_materials_cost = 0
     component_breakdown = []
-    
     for comp in components:
-        child_cost = comp['child_cost'] or 0
-        required_qty = comp['required_quantity']
-        child_unit_type = comp['child_stock_unit_type'] or 'units'
-        child_weight = comp['child_weight'] or 0
-        
-        # Calculate component cost
-        # If component is measured in units, cost is direct
-        # If measured in grams, we need to consider cost per gram
-        if child_unit_type == 'units':
-            component_cost = child_cost * required_qty
-        else:  # grams
-            # If cost is per unit but stock is in grams, we need to convert
-            # We assume cost is per unit, so we calculate cost per gram
-            if child_weight > 0:
-                cost_per_gram = child_cost / child_weight
-                component_cost = cost_per_gram * required_qty
-            else:
-                # If no weight defined, we assume cost is already per gram
-                component_cost = child_cost * required_qty
-        
-        total_materials_cost += component_cost
-        
+        unit_cost = comp['component_unit_cost']
+        if unit_cost is None:
+            unit_cost = _component_unit_cost(comp['child_cost'], comp['child_stock_unit_type'], comp['child_weight'])
         component_breakdown.append({
             'component_name': comp['child_name'],
-            'required_quantity': required_qty,
-            'unit_type': child_unit_type,
-            'unit_cost': child_cost,
-            'total_cost': component_cost
+            'required_quantity': comp['required_quantity'],
+            'unit_type': comp['child_stock_unit_type'] or 'units',
+            'unit_cost': unit_cost,
+            'total_cost': unit_cost * comp['required_quantity']
         })
     
     # Total cost = materials cost + additional cost
+    total_materials_cost = parent['materials_cost']
+    if total_materials_cost is None:
+        total_materials_cost = sum(comp['total_cost'] for comp in component_breakdown)
     calculated_cost = total_materials_cost + additional_cost
     
     return {
@@ -402,50 +1527,277 @@ def calculate_bom_cost(product_id):
 
 def delete_bom_entry(bom_id):
     """Deletes a bill of materials entry by its ID."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM bill_of_materials WHERE id = ?", (bom_id,))
-    conn.commit()
-    conn.close()
+    with transaction(tables=('bill_of_materials', 'bom_cost_cache')) as conn:
+        row = conn.execute("SELECT parent_product_id FROM bill_of_materials WHERE id = ?", (bom_id,)).fetchone()
+        conn.execute("DELETE FROM bill_of_materials WHERE id = ?", (bom_id,))
+        if row:
+            _refresh_bom_costs(conn, [row['parent_product_id']])
+
+# --- BOM Cost Cache ---
+# bom_cost_cache holds each product's rolled-up cost so reads are a primary-key lookup:
+#   materials_cost      = sum(quantity * component_unit_cost of each direct child)
+#   calculated_cost     = materials_cost + additional_cost
+#   component_unit_cost = what one stock unit costs when used as a component
+#                         (calculated_cost for assemblies, the normalized own cost for leaves)
+# A change only recomputes the changed product and its ancestors, children first.
+
+def _store_bom_costs(conn, product_ids, products, children, computed):
+    """Computes cache rows for product_ids (in order) from the given snapshot and writes them."""
+    rows = []
+    for product_id in product_ids:
+        product = products[product_id]
+        additional_cost = product['additional_cost'] or 0
+        if children.get(product_id):
+            materials_cost = 0
+            for child_id, quantity in children[product_id]:
+                if child_id in computed:
+                    materials_cost += quantity * computed[child_id]
+                else:
+                    child = products[child_id]
+                    materials_cost += quantity * _component_unit_cost(child['cost'], child['stock_unit_type'], child['weight'])
+            calculated_cost = materials_cost + additional_cost
+            component_unit_cost = calculated_cost
+        else:
+            materials_cost = 0
+            calculated_cost = additional_cost
+            component_unit_cost = _component_unit_cost(product['cost'], product['stock_unit_type'], product['weight'])
+        computed[product_id] = component_unit_cost
+        rows.append((product_id, materials_cost, calculated_cost, component_unit_cost))
+    conn.executemany(
+        "INSERT OR REPLACE INTO bom_cost_cache (product_id, materials_cost, calculated_cost, component_unit_cost) VALUES (?, ?, ?, ?)",
+        rows
+    )
+
+def _refresh_bom_costs(conn, product_ids):
+    """Recomputes the cached cost of product_ids and all their ancestors, in topological order."""
+    if not product_ids:
+        return
+    # Every ancestor with the length of its longest path from a changed product:
+    # ordering by that length guarantees children are recomputed before parents.
+    cursor = conn.execute("""
+        WITH RECURSIVE up(product_id, level) AS (
+            SELECT value, 0 FROM json_each(?)
+            UNION
+            SELECT bom.parent_product_id, up.level + 1
+            FROM up JOIN bill_of_materials bom ON bom.child_product_id = up.product_id
+            WHERE up.level < ?
+        )
+        SELECT up.product_id, MAX(up.level) AS level
+        FROM up JOIN products p ON p.id = up.product_id
+        GROUP BY up.product_id
+        ORDER BY level
+    """, (json.dumps(list(product_ids)), BOM_MAX_DEPTH))
+    ordered = [row['product_id'] for row in cursor.fetchall()]
+    if not ordered:
+        return
+    affected = json.dumps(ordered)
+
+    # Snapshot of the affected products, their direct children and the children's cached costs
+    products = {}
+    children = {}
+    computed = {}
+    cursor = conn.execute("""
+        SELECT p.id, p.cost, p.additional_cost, p.stock_unit_type, p.weight
+        FROM products p
+        WHERE p.id IN (SELECT value FROM json_each(?))
+           OR p.id IN (SELECT child_product_id FROM bill_of_materials
+                       WHERE parent_product_id IN (SELECT value FROM json_each(?)))
+    """, (affected, affected))
+    for row in cursor.fetchall():
+        products[row['id']] = row
+    cursor = conn.execute("""
+        SELECT bom.parent_product_id, bom.child_product_id, bom.quantity, c.component_unit_cost
+        FROM bill_of_materials bom
+        LEFT JOIN bom_cost_cache c ON c.product_id = bom.child_product_id
+        WHERE bom.parent_product_id IN (SELECT value FROM json_each(?))
+    """, (affected,))
+    for row in cursor.fetchall():
+        children.setdefault(row['parent_product_id'], []).append((row['child_product_id'], row['quantity']))
+        if row['component_unit_cost'] is not None:
+            computed[row['child_product_id']] = row['component_unit_cost']
+    _store_bom_costs(conn, ordered, products, children, computed)
+
+def _rebuild_bom_cost_cache(conn):
+    """Recomputes the whole cache: leaves first, then every assembly once its children are done."""
+    products = {row['id']: row for row in conn.execute(
+        "SELECT id, cost, additional_cost, stock_unit_type, weight FROM products")}
+    children = {}
+    parents = {}
+    for row in conn.execute("SELECT parent_product_id, child_product_id, quantity FROM bill_of_materials"):
+        if row['parent_product_id'] in products and row['child_product_id'] in products:
+            children.setdefault(row['parent_product_id'], []).append((row['child_product_id'], row['quantity']))
+            parents.setdefault(row['child_product_id'], []).append(row['parent_product_id'])
+
+    pending = {product_id: len({child for child, _ in children.get(product_id, [])}) for product_id in products}
+    ready = [product_id for product_id, count in pending.items() if count == 0]
+    ordered = []
+    while ready:
+        product_id = ready.pop()
+        ordered.append(product_id)
+        for parent_id in set(parents.get(product_id, [])):
+            pending[parent_id] -= 1
+            if pending[parent_id] == 0:
+                ready.append(parent_id)
+    # Products caught in a BOM cycle never become ready; cost them last from what is known
+    ordered.extend(product_id for product_id, count in pending.items() if count > 0)
+
+    conn.execute("DELETE FROM bom_cost_cache")
+    _store_bom_costs(conn, ordered, products, children, {})
+
+def rebuild_bom_cost_cache():
+    """Recomputes every cached BOM cost (after bulk imports or external edits)."""
+    with transaction(immediate=True, tables=('bom_cost_cache',)) as conn:
+        _rebuild_bom_cost_cache(conn)
+
+def get_calculated_cost(product_id):
+    """Returns the cached rolled-up unit cost of a product (None if the product does not exist)."""
+    with connection() as conn:
+        row = conn.execute("SELECT calculated_cost FROM bom_cost_cache WHERE product_id = ?", (product_id,)).fetchone()
+    return row['calculated_cost'] if row else None
+
+# --- Production Planning ---
+# Building a product takes each sub-assembly from stock first and only builds the
+# shortfall from its own components (recursively), so sub-assemblies produced earlier
+# are used instead of consuming their materials a second time. Leaves are always taken
+# from stock. Plans run in memory on the product's BOM subtree.
+
+# Relative slack for float comparisons of stock against requirements
+_PLAN_EPSILON = 1e-9
+# Upper bound for can_produce when no stocked component limits production (e.g. only cycles)
+_PLAN_MAX_QUANTITY = 10 ** 12
+
+def _load_bom_subtree(conn, product_id):
+    """
+    Loads the BOM below product_id in one query: (children, products) where
+    children = {parent_id: [(child_id, quantity), ...]} and products = {id: row}.
+    """
+    cursor = conn.execute("""
+        WITH RECURSIVE subtree(product_id) AS (
+            SELECT ?
+            UNION
+            SELECT bom.child_product_id
+            FROM subtree JOIN bill_of_materials bom ON bom.parent_product_id = subtree.product_id
+        )
+        SELECT p.id, p.name, p.sku, p.product_type, p.stock, p.cost, p.additional_cost,
+               p.stock_unit_type, p.weight, c.component_unit_cost
+        FROM subtree
+        JOIN products p ON p.id = subtree.product_id
+        LEFT JOIN bom_cost_cache c ON c.product_id = p.id
+    """, (product_id,))
+    products = {row['id']: row for row in cursor.fetchall()}
+    children = {}
+    for row in conn.execute(
+            "SELECT parent_product_id, child_product_id, quantity FROM bill_of_materials "
+            "WHERE parent_product_id IN (SELECT value FROM json_each(?))", (json.dumps(list(products)),)):
+        if row['child_product_id'] in products:
+            children.setdefault(row['parent_product_id'], []).append((row['child_product_id'], row['quantity']))
+    return children, products
+
+def _production_plan(children, stock, product_id, quantity):
+    """
+    Plans building `quantity` of product_id from the stock levels in `stock` ({id: stock}).
+    Returns (consumed, built, shortages): quantities taken from stock per product
+    (leaves and sub-assemblies), sub-assembly quantities built along the way, and the
+    leaves whose requirement exceeds their stock (id -> missing quantity). The product's
+    own stock is not used. A branch that loops back onto its own path contributes
+    nothing, like in explode_bom().
+    """
+    consumed = {}
+    built = {}
+    in_progress = set()
+
+    def build(parent_id, parent_quantity, depth):
+        if parent_id in in_progress or depth >= BOM_MAX_DEPTH:
+            return
+        in_progress.add(parent_id)
+        for child_id, per_unit in children[parent_id]:
+            needed = parent_quantity * per_unit
+            if child_id in children:
+                # What is left of the sub-assembly's stock after earlier branches took theirs
+                used = min(needed, max(stock.get(child_id, 0) - consumed.get(child_id, 0), 0))
+                if used > 0:
+                    consumed[child_id] = consumed.get(child_id, 0) + used
+                if needed - used > 0:
+                    built[child_id] = built.get(child_id, 0) + needed - used
+                    build(child_id, needed - used, depth + 1)
+            else:
+                consumed[child_id] = consumed.get(child_id, 0) + needed
+        in_progress.discard(parent_id)
+
+    if product_id in children:
+        build(product_id, quantity, 0)
+    shortages = {
+        leaf_id: consumed[leaf_id] - max(stock.get(leaf_id, 0), 0)
+        for leaf_id in consumed
+        if leaf_id not in children and consumed[leaf_id] > max(stock.get(leaf_id, 0), 0) * (1 + _PLAN_EPSILON) + _PLAN_EPSILON
+    }
+    return consumed, built, shortages
+
+def _max_producible(children, stock, product_id, integral=True):
+    """
+    Returns (can_produce, limiting leaf id) for product_id: the largest quantity whose
+    plan has no shortages (whole units when integral, otherwise continuous), and the
+    leaf that runs out first just above it (None if nothing limits it).
+    """
+    # Gross leaf requirements per unit (no sub-assembly stock used) give a quantity that is
+    # always feasible, since taking sub-assemblies from stock only saves leaves; it is the
+    # answer when no sub-assembly below the product has stock
+    consumed, built, _ = _production_plan(children, {}, product_id, 1)
+    gross = {leaf_id: required for leaf_id, required in consumed.items() if leaf_id not in children and required > 0}
+    if not gross:
+        return _PLAN_MAX_QUANTITY, None
+    ratios = {leaf_id: max(stock.get(leaf_id, 0), 0) / required for leaf_id, required in gross.items()}
+    low = min(ratios.values())
+    if integral:
+        low = int(low)
+    if not any(stock.get(subassembly_id, 0) > 0 for subassembly_id in built):
+        return low, min(ratios, key=ratios.get)
+
+    def shortages(quantity):
+        return _production_plan(children, stock, product_id, quantity)[2]
+
+    # Gallop up from the gross bound to a failing quantity, then bisect below it
+    step = 1 if integral else max(low, 1) * 0.01
+    while True:
+        missing = shortages(low + step)
+        if missing:
+            high = low + step
+            break
+        low += step
+        step *= 2
+        if low > _PLAN_MAX_QUANTITY:
+            return _PLAN_MAX_QUANTITY, None
+    for _ in range(60):
+        if high - low <= (1 if integral else high * _PLAN_EPSILON):
+            break
+        middle = (low + high) // 2 if integral else (low + high) / 2
+        middle_missing = shortages(middle)
+        if middle_missing:
+            high, missing = middle, middle_missing
+        else:
+            low = middle
+    # The limiting leaf is the one missing the largest share of its requirement
+    limiting_id = max(missing, key=lambda leaf_id: missing[leaf_id] / max(stock.get(leaf_id, 0) + missing[leaf_id], _PLAN_EPSILON))
+    return low, limiting_id
 
 def calculate_mrp_production(product_id):
     """
     Calculates how many products can be manufactured based on BOM and current inventory.
-    Handles conversions between discrete and continuous units (grams).
-    Returns a dictionary with calculation information.
+    Sub-assemblies in stock are used first and only the shortfall is built from their
+    components (see Production Planning); 'components' lists the gross leaf quantities
+    of one unit from the full multi-level explosion, and 'subassemblies' the stock on
+    hand of every sub-assembly crossed. Quantities are in each component's stock
+    unit (units or grams). Returns a dictionary with calculation information.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Get the parent product with its unit type
-    cursor.execute("SELECT id, name, stock, stock_unit_type FROM products WHERE id = ?", (product_id,))
-    parent = cursor.fetchone()
-    if not parent:
-        conn.close()
-        return None
-    
-    parent = dict(parent)
+    with read_snapshot() as conn:
+        parent = conn.execute("SELECT id, name, stock, stock_unit_type FROM products WHERE id = ?", (product_id,)).fetchone()
+        if not parent:
+            return None
+        parent = dict(parent)
+        explosion = explode_bom(product_id)
+        children, products = _load_bom_subtree(conn, product_id)
     
-    # Get all BOM components (children) with unit information
-    cursor.execute("""
-        SELECT 
-            bom.id as bom_id,
-            bom.quantity as required_quantity,
-            p.id as child_id,
-            p.name as child_name,
-            p.stock as child_stock,
-            p.stock_unit_type as child_stock_unit_type,
-            p.weight as child_weight,
-            p.sku as child_sku
-        FROM bill_of_materials bom
-        JOIN products p ON bom.child_product_id = p.id
-        WHERE bom.parent_product_id = ?
-    """, (product_id,))
-    
-    components = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    
-    if not components:
+    if not explosion['components']:
         return {
             'product_id': product_id,
             'product_name': parent['name'],
@@ -454,221 +1806,793 @@ def calculate_mrp_production(product_id):
             'message': 'This product has no components defined in the BOM. Current stock available.'
         }
     
-    # Calculate how many can be produced based on the most limiting component
-    # Considering conversions between units and grams
-    max_production = None
-    limiting_component = None
+    components = []
+    for leaf in explosion['components']:
+        child_stock = leaf['stock']
+        child_unit_type = leaf['unit_type']
+        required_qty = leaf['required_quantity']
+        components.append({
+            'child_id': leaf['product_id'],
+            'child_name': leaf['name'],
+            'child_sku': leaf['sku'],
+            'child_stock': child_stock,
+            'child_stock_unit_type': child_unit_type,
+            'child_weight': leaf['weight'],
+            'required_quantity': required_qty,
+            'depth': leaf['depth'],
+            # Conversion information
+            'available_in_grams': child_stock if child_unit_type == 'grams' else (child_stock * leaf['weight']),
+            'required_in_grams': leaf['required_in_grams'],
+            'conversion_note': f"Stock: {child_stock} {child_unit_type}, Required: {required_qty} {child_unit_type}"
+        })
+    subassemblies = [
+        dict(subassembly, stock=products[subassembly['product_id']]['stock'])
+        for subassembly in explosion['subassemblies']
+    ]
     
-    for comp in components:
-        child_stock = comp['child_stock']
-        child_unit_type = comp['child_stock_unit_type'] or 'units'
-        child_weight = comp['child_weight'] or 0
-        required_qty = comp['required_quantity']
-        
-        # Convert available stock to grams if necessary
-        # required_quantity is always interpreted in the same unit as child_stock_unit_type
-        # If parent requires in units and child is in grams, we need to convert
-        
-        # Case 1: Both in units - direct calculation
-        if child_unit_type == 'units':
-            available_units = child_stock
-            possible_production = available_units / required_qty if required_qty > 0 else 0
-        # Case 2: Child in grams, requirement in grams - direct calculation
-        elif child_unit_type == 'grams':
-            available_grams = child_stock
-            # If required_quantity is in grams, direct calculation
-            possible_production = available_grams / required_qty if required_qty > 0 else 0
+    # Round down (can't produce fractions of discrete units)
+    # But allow decimals if parent product is measured in grams
+    stock = {component_id: row['stock'] for component_id, row in products.items()}
+    max_production, limiting_id = _max_producible(children, stock, product_id, parent.get('stock_unit_type') != 'grams')
+    limiting_component = next((comp for comp in components if comp['child_id'] == limiting_id), None)
+    
+    return {
+        'product_id': product_id,
+        'product_name': parent['name'],
+        'current_stock': parent['stock'],
+        'can_produce': max_production,
+        'components': components,
+        'subassemblies': subassemblies,
+        'limiting_component': limiting_component,
+        'cycles': explosion['cycles'],
+        'message': f'You can produce {max_production} {"units" if parent.get("stock_unit_type") != "grams" else "grams"} of {parent["name"]} with current inventory.'
+    }
+
+MRP_PRODUCT_TYPES = ('final', 'padre')
+
+def _leaf_requirements_resolver(children):
+    """
+    Returns leaf_requirements(product_id): the gross leaf quantities for one unit of a
+    product, given children = {parent_id: [(child_id, quantity), ...]} loaded in memory.
+    Results are memoized, so every sub-assembly is resolved once however many parents use it.
+    """
+    requirements = {}
+    in_progress = set()
+
+    def leaf_requirements(product_id, depth=0):
+        if product_id in requirements:
+            return requirements[product_id]
+        if product_id not in children:
+            return {product_id: 1}
+        if product_id in in_progress or depth >= BOM_MAX_DEPTH:
+            # Cycle or runaway depth: this branch contributes nothing (see explode_bom)
+            return {}
+        in_progress.add(product_id)
+        totals = {}
+        for child_id, quantity in children[product_id]:
+            for leaf_id, leaf_quantity in leaf_requirements(child_id, depth + 1).items():
+                totals[leaf_id] = totals.get(leaf_id, 0) + quantity * leaf_quantity
+        in_progress.discard(product_id)
+        requirements[product_id] = totals
+        return totals
+
+    return leaf_requirements
+
+def calculate_mrp_catalog(product_type=None):
+    """
+    Calculates how many units of every buildable product can be produced with current
+    inventory, in one pass: products and the BOM are loaded once and every product is
+    planned in memory (sub-assembly stock first, see Production Planning).
+    product_type limits the report to one type; by default 'final' and 'padre' products
+    are included. Each entry has the same can_produce/limiting_component meaning as
+    calculate_mrp_production.
+    """
+    with connection() as conn:
+        products = {row['id']: row for row in conn.execute(
+            "SELECT id, name, sku, product_type, stock, stock_unit_type, weight FROM products")}
+        children = {}
+        for row in conn.execute("SELECT parent_product_id, child_product_id, quantity FROM bill_of_materials"):
+            if row['child_product_id'] in products:
+                children.setdefault(row['parent_product_id'], []).append((row['child_product_id'], row['quantity']))
+
+    leaf_requirements = _leaf_requirements_resolver(children)
+    stock = {product_id: row['stock'] for product_id, row in products.items()}
+    types = (product_type,) if product_type else MRP_PRODUCT_TYPES
+    report = []
+    for product in sorted(products.values(), key=lambda row: row['name']):
+        if product['product_type'] not in types:
+            continue
+        limiting_component = None
+        if product['id'] in children:
+            requirements = leaf_requirements(product['id'])
+            can_produce = 0
+            if requirements:
+                # Same planning (sub-assembly stock first) and rounding as calculate_mrp_production
+                can_produce, limiting_id = _max_producible(children, stock, product['id'],
+                                                           product['stock_unit_type'] != 'grams')
+                if limiting_id is not None:
+                    leaf = products[limiting_id]
+                    limiting_component = {
+                        'child_id': limiting_id,
+                        'child_name': leaf['name'],
+                        'child_sku': leaf['sku'],
+                        'child_stock': leaf['stock'],
+                        'child_stock_unit_type': leaf['stock_unit_type'],
+                        'required_quantity': requirements.get(limiting_id, 0)
+                    }
+            component_count = len(requirements)
+        else:
+            can_produce = product['stock']
+            component_count = 0
+        report.append({
+            'product_id': product['id'],
+            'product_name': product['name'],
+            'sku': product['sku'],
+            'product_type': product['product_type'],
+            'current_stock': product['stock'],
+            'stock_unit_type': product['stock_unit_type'],
+            'can_produce': can_produce,
+            'component_count': component_count,
+            'limiting_component': limiting_component
+        })
+    return report
+
+# --- Production Orders ---
+# Every production run is an order: it is checked and applied under the write lock
+# (BEGIN IMMEDIATE), each component is decremented with a conditional `stock >= ?`
+# update so stock can never go negative, and the outcome is recorded in production_orders.
+
+def _validate_production_order(conn, order):
+    """Returns (product_id, product_name, quantity, error) for one queued order."""
+    product_id = order.get('product_id')
+    product_row = conn.execute("SELECT name FROM products WHERE id = ?", (product_id,)).fetchone()
+    if not product_row:
+        return product_id, None, None, f'Product {product_id} not found.'
+    try:
+        quantity = float(order.get('quantity'))
+    except (TypeError, ValueError):
+        return product_id, product_row['name'], None, 'Quantity must be a number.'
+    if quantity <= 0:
+        return product_id, product_row['name'], quantity, 'Quantity must be greater than zero.'
+    if quantity == int(quantity):
+        quantity = int(quantity)
+    return product_id, product_row['name'], quantity, None
+
+def _apply_production_order(conn, product_id, product_name, quantity):
+    """
+    Applies one validated order inside the caller's transaction. Returns (success, message, materials_cost, stock changes).
+    Sub-assemblies in stock are used first and only the shortfall is built from their
+    components; every product taken from stock is decremented. materials_cost values
+    what was taken from stock at its cached component cost, plus the additional cost of
+    the sub-assemblies built along the way.
+    A failed order leaves stock untouched: its changes are rolled back to a savepoint.
+    """
+    children, products = _load_bom_subtree(conn, product_id)
+    if not children.get(product_id):
+        return False, 'This product has no components defined in the BOM.', None, []
+    stock = {component_id: row['stock'] for component_id, row in products.items()}
+    consumed, built, shortages = _production_plan(children, stock, product_id, quantity)
+    if shortages:
+        # Consistent with the stock we are about to change because we hold the write lock
+        can_produce, _ = _max_producible(children, stock, product_id, products[product_id]['stock_unit_type'] != 'grams')
+        return False, f'Not enough components. Only {can_produce} units can be produced.', None, []
+
+    changes = [(component_id, -used) for component_id, used in consumed.items()] + [(product_id, quantity)]
+    try:
+        with transaction() as savepoint:
+            for component_id, used in consumed.items():
+                cursor = savepoint.execute(
+                    "UPDATE products SET stock = stock - ? WHERE id = ? AND stock >= ?",
+                    (used, component_id, used * (1 - _PLAN_EPSILON) - _PLAN_EPSILON)
+                )
+                if cursor.rowcount == 0:
+                    raise ValueError(products[component_id]['name'])
+            savepoint.execute("UPDATE products SET stock = stock + ? WHERE id = ?", (quantity, product_id))
+    except ValueError as e:
+        return False, f'Not enough stock of {e}.', None, []
+
+    materials_cost = 0
+    for component_id, used in consumed.items():
+        row = products[component_id]
+        unit_cost = row['component_unit_cost']
+        if unit_cost is None:
+            unit_cost = _component_unit_cost(row['cost'], row['stock_unit_type'], row['weight'])
+        materials_cost += used * unit_cost
+    for component_id, built_quantity in built.items():
+        materials_cost += built_quantity * (products[component_id]['additional_cost'] or 0)
+    return True, f'Production executed: {quantity} units of {product_name} produced.', materials_cost, changes
+
+def _record_production_order(conn, product_id, product_name, quantity, success, message, materials_cost):
+    cursor = conn.execute(
+        """INSERT INTO production_orders (product_id, product_name, quantity, status, message, materials_cost)
+           VALUES (?, ?, ?, ?, ?, ?)""",
+        (product_id, product_name, quantity, 'completed' if success else 'failed', message, materials_cost)
+    )
+    return cursor.lastrowid
+
+def execute_production_batch(orders, stop_on_error=False):
+    """
+    Executes a queue of production orders ({'product_id', 'quantity'}) in one write transaction.
+    Orders run in sequence, so later orders see the stock left by earlier ones. Every order is
+    logged in production_orders, including those rejected by validation; a failed order is
+    skipped, and with stop_on_error=True the remaining orders are not attempted. If an
+    unexpected error rolls the transaction back, nothing is applied and 'results' is empty.
+    Returns a summary with a result per order.
+    """
+    results = []
+    try:
+        with transaction(immediate=True, tables=('products', 'stock_movements', 'production_orders')) as conn:
+            for index, order in enumerate(orders):
+                product_id, product_name, quantity, error = _validate_production_order(conn, order)
+                if error:
+                    # Logged as failed; an unknown product is recorded without a product id
+                    success, message = False, error
+                    order_id = _record_production_order(conn, product_id if product_name else None, product_name,
+                                                        quantity, success, message, None)
+                    quantity = order.get('quantity')
+                else:
+                    success, message, materials_cost, changes = _apply_production_order(conn, product_id, product_name, quantity)
+                    order_id = _record_production_order(conn, product_id, product_name, quantity, success, message, materials_cost)
+                    _record_movements(conn, changes, 'production', order_id)
+                results.append({
+                    'index': index,
+                    'order_id': order_id,
+                    'product_id': product_id,
+                    'quantity': quantity,
+                    'success': success,
+                    'message': message
+                })
+                if stop_on_error and not success:
+                    break
+    except Exception as e:
+        # The whole transaction rolled back: no order ran and none was logged
+        return {'success': False, 'message': f'Error executing production: {str(e)}', 'completed': 0, 'failed': len(orders), 'results': []}
+
+    completed = sum(1 for result in results if result['success'])
+    failed = len(results) - completed
+    return {
+        'success': failed == 0 and len(results) == len(orders),
+        'message': f'{completed} production orders executed, {failed} failed.',
+        'completed': completed,
+        'failed': failed,
+        'results': results
+    }
+
+def execute_production(product_id, quantity):
+    """
+    Executes production of a product: reduces component stock and increases final product stock.
+    Returns a dictionary with success and message.
+    """
+    result = execute_production_batch([{'product_id': product_id, 'quantity': quantity}])
+    if not result['results']:
+        return {'success': False, 'message': result['message']}
+    order = result['results'][0]
+    return {'success': order['success'], 'message': order['message'], 'order_id': order['order_id']}
+
+PRODUCTION_ORDER_SORTS = {'date': ['created_at', 'id']}
+
+def get_production_orders(product_id=None, status=None, start=None, end=None, descending=True,
+                          limit=PAGE_SIZE, cursor=None, include_total=False):
+    """Gets one page of production orders, newest first, filtered by product, status and [start, end) dates."""
+    conditions, params = [], []
+    if product_id is not None:
+        conditions.append("product_id = ?")
+        params.append(product_id)
+    if status:
+        conditions.append("status = ?")
+        params.append(status)
+    where, range_params = _date_range_clause('created_at', _normalize_date(start), _normalize_date(end))
+    conditions.append(where)
+    params.extend(range_params)
+    return _fetch_page(
+        'production_orders', "id, product_id, product_name, quantity, status, message, materials_cost, created_at",
+        conditions, params, _sort_columns('date', PRODUCTION_ORDER_SORTS), 'date', descending, limit, cursor, include_total
+    )
+
+# --- Stock Movement Ledger ---
+# Every stock change is also appended to stock_movements (signed quantity, reason,
+# reference id, effective time), so for every product stock = SUM(quantity) of its
+# movements. movement_at is the effective time: a sale moves stock at the sale date,
+# so backdated or edited sales land where they belong in the history.
+# stock_snapshots holds the stock at the end of each month (and any other day taken),
+# so a point-in-time query reads one snapshot plus the movements since it. Inserting a
+# movement dated on or before a snapshot adds its quantity to that product's snapshots
+# from then on (trigger), so they stay exact and keep the unit cost they were taken with.
+
+MOVEMENT_REASONS = ('opening', 'initial', 'adjustment', 'sale', 'sale_reversal', 'production', 'import')
+
+def _record_movements(conn, changes, reason, reference_id=None, movement_at=None):
+    """Appends one movement per (product_id, quantity) change; zero changes are skipped."""
+    conn.executemany(
+        "INSERT INTO stock_movements (product_id, quantity, reason, reference_id, movement_at) "
+        "VALUES (?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP))",
+        [(product_id, quantity, reason, reference_id, movement_at)
+         for product_id, quantity in changes if quantity]
+    )
+
+def _apply_stock_changes(conn, changes, reason, reference_id=None, movement_at=None):
+    """Adds each signed (product_id, quantity) change to stock and records it in the ledger."""
+    conn.executemany("UPDATE products SET stock = stock + ? WHERE id = ?",
+                     [(quantity, product_id) for product_id, quantity in changes])
+    _record_movements(conn, changes, reason, reference_id, movement_at)
+
+def _record_sale_movements(conn, where, params, reason='sale', sign=-1):
+    """Records the stock movement of the sales matching `where`, effective at each sale's date."""
+    conn.execute(f"""
+        INSERT INTO stock_movements (product_id, quantity, reason, reference_id, movement_at)
+        SELECT product_id, ? * quantity, ?, id, COALESCE(date, CURRENT_TIMESTAMP)
+        FROM sales
+        WHERE {where} AND product_id IS NOT NULL AND quantity != 0
+    """, (sign, reason, *params))
+
+def _month_end(day):
+    """Last day of the month containing `day` (a date)."""
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+
+def take_stock_snapshots(day):
+    """
+    Stores the stock of every product at the end of `day` ('YYYY-MM-DD' or a date), UTC.
+    Existing snapshots for that day are kept. Each product starts from its latest
+    earlier snapshot and adds only the movements after it.
+    """
+    day = _normalize_date(day)[:10]
+    with transaction(immediate=True, tables=('stock_snapshots',)) as conn:
+        conn.execute("""
+            INSERT OR IGNORE INTO stock_snapshots (product_id, snapshot_date, stock, unit_cost)
+            SELECT p.id, :day,
+                   COALESCE(prev.stock, 0) + COALESCE((
+                       SELECT SUM(m.quantity) FROM stock_movements m
+                       WHERE m.product_id = p.id
+                         AND m.movement_at >= COALESCE(date(prev.snapshot_date, '+1 day'), '')
+                         AND m.movement_at < date(:day, '+1 day')
+                   ), 0),
+                   p.cost
+            FROM products p
+            LEFT JOIN stock_snapshots prev ON prev.product_id = p.id AND prev.snapshot_date = (
+                SELECT MAX(snapshot_date) FROM stock_snapshots
+                WHERE product_id = p.id AND snapshot_date < :day
+            )
+            WHERE EXISTS (SELECT 1 FROM stock_movements m WHERE m.product_id = p.id AND m.movement_at < date(:day, '+1 day'))
+        """, {'day': day})
+
+def take_month_end_snapshots():
+    """
+    Snapshots the last completed month if it is missing (called at startup). Earlier
+    months are not backfilled: the only cost known is today's, which would misvalue
+    them. Those days are read from an earlier snapshot (or the ledger) instead.
+    Returns the number of snapshot days taken (0 or 1).
+    """
+    last_complete = datetime.now(timezone.utc).date().replace(day=1) - timedelta(days=1)
+    day = last_complete.isoformat()
+    with connection() as conn:
+        missing = conn.execute("""
+            SELECT 1 FROM products p
+            WHERE NOT EXISTS (SELECT 1 FROM stock_snapshots s WHERE s.product_id = p.id AND s.snapshot_date = :day)
+              AND EXISTS (SELECT 1 FROM stock_movements m
+                          WHERE m.product_id = p.id AND m.movement_at < date(:day, '+1 day'))
+            LIMIT 1
+        """, {'day': day}).fetchone()
+    if not missing:
+        return 0
+    take_stock_snapshots(day)
+    return 1
+
+def get_stock_on(day, product_id=None):
+    """
+    Gets the stock of every product (or one) at the end of `day` (UTC), with its
+    valuation at the snapshot's unit cost (current cost when no snapshot is used).
+    Reads the latest snapshot on or before the day plus the movements after it.
+    """
+    day = _normalize_date(day)[:10]
+    product_filter = "WHERE p.id = :product_id" if product_id is not None else ""
+    with connection() as conn:
+        cursor = conn.execute(f"""
+            WITH base AS (
+                SELECT p.id, p.name, p.sku, p.product_type, p.stock_unit_type, p.cost,
+                       (SELECT MAX(snapshot_date) FROM stock_snapshots
+                        WHERE product_id = p.id AND snapshot_date <= :day) AS snapshot_date
+                FROM products p
+                {product_filter}
+            )
+            SELECT b.id AS product_id, b.name, b.sku, b.product_type, b.stock_unit_type,
+                   COALESCE(s.stock, 0) + COALESCE((
+                       SELECT SUM(m.quantity) FROM stock_movements m
+                       WHERE m.product_id = b.id
+                         AND m.movement_at >= COALESCE(date(b.snapshot_date, '+1 day'), '')
+                         AND m.movement_at < date(:day, '+1 day')
+                   ), 0) AS stock,
+                   COALESCE(s.unit_cost, b.cost, 0) AS unit_cost,
+                   b.snapshot_date
+            FROM base b
+            LEFT JOIN stock_snapshots s ON s.product_id = b.id AND s.snapshot_date = b.snapshot_date
+            ORDER BY b.name ASC
+        """, {'day': day, 'product_id': product_id})
+        stock = []
+        for row in cursor.fetchall():
+            item = dict(row)
+            item['value'] = item['stock'] * item['unit_cost']
+            stock.append(item)
+    return stock
+
+def get_inventory_valuation_on(day):
+    """Gets the inventory valuation by category (product_type) at the end of `day`."""
+    categories = {}
+    for item in get_stock_on(day):
+        category = categories.setdefault(item['product_type'], {
+            'product_type': item['product_type'], 'product_count': 0, 'total_value': 0, 'total_quantity': 0
+        })
+        category['product_count'] += 1
+        category['total_value'] += item['value']
+        category['total_quantity'] += item['stock']
+    return sorted(categories.values(), key=lambda category: category['total_value'], reverse=True)
+
+def get_month_end_inventory(year, month):
+    """Gets stock and valuation per product at the end of a month, with the total value."""
+    day = _month_end(date_type(int(year), int(month), 1))
+    items = get_stock_on(day)
+    return {
+        'date': day.isoformat(),
+        'items': items,
+        'total_value': sum(item['value'] for item in items)
+    }
+
+MOVEMENT_SORTS = {'date': ['movement_at', 'id']}
+
+def get_stock_movements(product_id=None, reason=None, start=None, end=None, descending=True,
+                        limit=PAGE_SIZE, cursor=None, include_total=False):
+    """Gets one page of stock movements, filtered by product, reason and [start, end) effective dates."""
+    conditions, params = [], []
+    if product_id is not None:
+        conditions.append("product_id = ?")
+        params.append(product_id)
+    if reason:
+        conditions.append("reason = ?")
+        params.append(reason)
+    where, range_params = _date_range_clause('movement_at', _normalize_date(start), _normalize_date(end))
+    conditions.append(where)
+    params.extend(range_params)
+    return _fetch_page(
+        'stock_movements', "id, product_id, quantity, reason, reference_id, movement_at, recorded_at",
+        conditions, params, _sort_columns('date', MOVEMENT_SORTS), 'date', descending, limit, cursor, include_total
+    )
+
+# --- Delta Sync ---
+# Tracked tables carry a row_version stamped by triggers from the sync_state counter;
+# deletes leave a tombstone with the version they happened at. A client keeps the
+# token of its last sync and asks only for what changed after it. Tombstones are kept
+# SYNC_TOMBSTONE_RETENTION_DAYS; a client whose token predates the pruned ones gets a
+# full snapshot again.
+
+SYNC_TOMBSTONE_RETENTION_DAYS = 90
+
+SYNC_TABLES = {
+    'products': "id, sku, name, product_type, stock, min_stock, cost, supplier, purchase_date, exit_date, weight, stock_unit_type, additional_cost",
+    'sales': "id, product_id, product_name, quantity, unit_price, total_amount, date",
+    'revenue': "id, description, amount, date",
+    'costs': "id, description, amount, category, date",
+    'bill_of_materials': "id, parent_product_id, child_product_id, quantity",
+}
+
+def get_changes_since(table, token=None):
+    """
+    Gets the rows of a tracked table changed after `token`.
+    Returns {'table', 'full', 'rows', 'deleted', 'token'}: apply 'deleted' (ids) first,
+    then upsert 'rows' by id, and pass 'token' to the next call. Without a token, with
+    one this database never issued, or with one older than the pruned tombstones, 'full'
+    is True and 'rows' is the whole table: the client must replace its copy with it.
+    """
+    if table not in SYNC_TABLES:
+        raise ValueError(f"Unsupported table '{table}'. Use one of: {', '.join(SYNC_TABLES)}")
+    row_to_dict = _product_row_to_dict if table == 'products' else dict
+    with read_snapshot() as conn:
+        current, pruned = conn.execute("SELECT version, pruned_version FROM sync_state WHERE id = 1").fetchone()
+        try:
+            token = int(token) if token is not None else None
+        except (TypeError, ValueError):
+            token = None
+        # Deletes up to `pruned` have lost their tombstones: an older token would miss them
+        full = token is None or token < pruned or token > current
+        if full:
+            cursor = conn.execute(f"SELECT {SYNC_TABLES[table]} FROM {table} ORDER BY id")
+            deleted = []
         else:
-            # Fallback
-            possible_production = child_stock / required_qty if required_qty > 0 else 0
-        
-        # Add conversion information to component
-        comp['available_in_grams'] = child_stock if child_unit_type == 'grams' else (child_stock * child_weight)
-        comp['required_in_grams'] = required_qty if child_unit_type == 'grams' else (required_qty * child_weight)
-        comp['conversion_note'] = f"Stock: {child_stock} {child_unit_type}, Required: {required_qty} {child_unit_type}"
-        
-        if max_production is None or possible_production < max_production:
-            max_production = possible_production
-            limiting_component = comp
-    
-    # Round down (can't produce fractions of discrete units)
-    # But allow decimals if parent product is measured in grams
-    if parent.get('stock_unit_type') == 'grams':
-        max_production = max_production if max_production else 0
+            cursor = conn.execute(
+                f"SELECT {SYNC_TABLES[table]} FROM {table} WHERE row_version > ? ORDER BY row_version", (token,))
+            deleted = [row[0] for row in conn.execute(
+                "SELECT DISTINCT row_id FROM sync_tombstones WHERE table_name = ? AND row_version > ?", (table, token))]
+        rows = [row_to_dict(row) for row in cursor.fetchall()]
+    return {'table': table, 'full': full, 'rows': rows, 'deleted': deleted, 'token': str(current)}
+
+def prune_sync_tombstones(retention_days=SYNC_TOMBSTONE_RETENTION_DAYS):
+    """
+    Deletes the sync tombstones older than retention_days (called at startup) and
+    raises sync_state.pruned_version to the newest version deleted. Returns how many
+    tombstones were deleted.
+    """
+    cutoff = f"-{int(retention_days)} days"
+    with transaction(immediate=True, tables=('sync_tombstones', 'sync_state')) as conn:
+        newest = conn.execute("SELECT MAX(row_version) FROM sync_tombstones WHERE deleted_at < datetime('now', ?)",
+                              (cutoff,)).fetchone()[0]
+        if newest is None:
+            return 0
+        conn.execute("UPDATE sync_state SET pruned_version = MAX(pruned_version, ?) WHERE id = 1", (newest,))
+        return conn.execute("DELETE FROM sync_tombstones WHERE row_version <= ?", (newest,)).rowcount
+
+# --- Export Iterators ---
+# Generators over whole tables for the file exports: rows are plain tuples in the
+# documented column order, fetched EXPORT_CHUNK_SIZE at a time, so memory does not grow
+# with the table. The pooled connection is held until the generator is exhausted or
+# closed; consume it in the thread that created it (wrap several in read_snapshot()
+# to read them all from the same state).
+
+EXPORT_CHUNK_SIZE = 5000
+
+def _iter_rows(query, params=(), chunk_size=EXPORT_CHUNK_SIZE):
+    """Yields the rows of `query` as tuples, fetching chunk_size rows at a time."""
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield from rows
+
+def iter_products(chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yields every product by name: (id, sku, name, product_type, stock, min_stock, cost,
+    supplier, purchase_date, exit_date, total_value), with '' for missing text and 0 for
+    a missing cost.
+    """
+    return _iter_rows("""
+        SELECT id, COALESCE(sku, ''), name, product_type, stock, min_stock, COALESCE(cost, 0),
+               COALESCE(supplier, ''), COALESCE(purchase_date, ''), COALESCE(exit_date, ''),
+               stock * COALESCE(cost, 0)
+        FROM products
+        ORDER BY name ASC
+    """, chunk_size=chunk_size)
+
+def iter_sales(chunk_size=EXPORT_CHUNK_SIZE):
+    """Yields every sale, newest first: (id, product_name, quantity, unit_price, total_amount, date)."""
+    return _iter_rows("SELECT id, product_name, quantity, unit_price, total_amount, date FROM sales ORDER BY date DESC",
+                      chunk_size=chunk_size)
+
+def iter_revenue(chunk_size=EXPORT_CHUNK_SIZE):
+    """Yields every revenue entry, newest first: (id, description, amount, date)."""
+    return _iter_rows("SELECT id, description, amount, date FROM revenue ORDER BY date DESC", chunk_size=chunk_size)
+
+def iter_costs(chunk_size=EXPORT_CHUNK_SIZE):
+    """Yields every cost entry, newest first: (id, description, amount, category, date)."""
+    return _iter_rows("SELECT id, description, amount, COALESCE(category, 'Others'), date FROM costs ORDER BY date DESC",
+                      chunk_size=chunk_size)
+
+# --- Date Range Helpers ---
+# Dates are stored as ISO-8601 text ('YYYY-MM-DD HH:MM:SS' from CURRENT_TIMESTAMP, or
+# whatever the UI sends, e.g. 'YYYY-MM-DD'/'YYYY-MM-DDTHH:MM'). Comparing against
+# 'YYYY-MM-DD' bounds is correct for all of them and lets SQLite use the date indexes,
+# unlike strftime(...) = strftime(...) which forces a full scan.
+
+def _normalize_date(value):
+    """Converts a date/datetime bound to ISO text; strings are passed through."""
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, date_type):
+        return value.isoformat()
+    return value or None
+
+def _period_bounds(period='month', start=None, end=None):
+    """
+    Returns half-open [start, end) bounds for a query.
+    Explicit start/end win (either may be None for an open side); otherwise the bounds
+    cover the current 'day', 'week' (Monday-based), 'month' or 'year', in UTC like
+    CURRENT_TIMESTAMP. Any other period means no bounds.
+    """
+    if start or end:
+        return _normalize_date(start), _normalize_date(end)
+    today = datetime.now(timezone.utc).date()
+    if period == 'day':
+        first = today
+        after = today + timedelta(days=1)
+    elif period == 'week':
+        first = today - timedelta(days=today.weekday())
+        after = first + timedelta(days=7)
+    elif period == 'month':
+        first = today.replace(day=1)
+        after = (first + timedelta(days=32)).replace(day=1)
+    elif period == 'year':
+        first = today.replace(month=1, day=1)
+        after = first.replace(year=first.year + 1)
     else:
-        max_production = int(max_production) if max_production else 0
-    
-    return {
-        'product_id': product_id,
-        'product_name': parent['name'],
-        'current_stock': parent['stock'],
-        'can_produce': max_production,
-        'components': components,
-        'limiting_component': limiting_component,
-        'message': f'You can produce {max_production} {"units" if parent.get("stock_unit_type") != "grams" else "grams"} of {parent["name"]} with current inventory.'
-    }
+        return None, None
+    return first.isoformat(), after.isoformat()
 
-def execute_production(product_id, quantity):
+def _date_range_clause(column, start, end):
+    """Builds the SQL condition and parameters for `start <= column < end` (None = open)."""
+    conditions = []
+    params = []
+    if start:
+        conditions.append(f"{column} >= ?")
+        params.append(start)
+    if end:
+        conditions.append(f"{column} < ?")
+        params.append(end)
+    return (' AND '.join(conditions) or '1 = 1'), params
+
+# --- Daily Rollups ---
+# (rollup table, source table, key columns, additive value columns, columns whose update moves a row)
+_DAY = ('day', "substr({row}.date, 1, 10)")
+ROLLUPS = [
+    ('daily_revenue', 'revenue', [_DAY],
+     [('total_amount', '{row}.amount'), ('entry_count', '1')], ['amount', 'date']),
+    ('daily_costs', 'costs', [_DAY],
+     [('total_amount', '{row}.amount'), ('entry_count', '1')], ['amount', 'date']),
+    ('daily_cost_categories', 'costs', [_DAY, ('category', "COALESCE({row}.category, 'Others')")],
+     [('total_amount', '{row}.amount'), ('entry_count', '1')], ['amount', 'date', 'category']),
+    ('daily_sales', 'sales', [_DAY],
+     [('quantity', '{row}.quantity'), ('total_amount', '{row}.total_amount'), ('entry_count', '1')],
+     ['quantity', 'total_amount', 'date']),
+]
+
+# Per product and day, for sales velocity, as first created by _migrate_daily_product_sales
+PRODUCT_ROLLUPS = [
+    ('daily_product_sales', 'sales', [('product_id', 'COALESCE({row}.product_id, 0)'), _DAY],
+     [('quantity', '{row}.quantity'), ('total_amount', '{row}.total_amount'), ('entry_count', '1')],
+     ['product_id', 'quantity', 'total_amount', 'date']),
+]
+
+# Current per-product sales rollups (_migrate_product_sales_stats): the daily one gains the
+# cost of goods sold, and product_sales_stats keeps the all-time totals of every product
+_PRODUCT_KEY = ('product_id', 'COALESCE({row}.product_id, 0)')
+_PRODUCT_SALES_VALUES = [('quantity', '{row}.quantity'), ('total_amount', '{row}.total_amount'),
+                         ('cost_of_goods', '{row}.quantity * COALESCE({row}.unit_cost, 0)'), ('entry_count', '1')]
+PRODUCT_SALES_ROLLUPS = [
+    ('daily_product_sales', 'sales', [_PRODUCT_KEY, _DAY], _PRODUCT_SALES_VALUES,
+     ['product_id', 'quantity', 'total_amount', 'unit_cost', 'date']),
+    ('product_sales_stats', 'sales', [_PRODUCT_KEY], _PRODUCT_SALES_VALUES,
+     ['product_id', 'quantity', 'total_amount', 'unit_cost']),
+]
+
+def _rebuild_rollups(cursor, rollups=ROLLUPS):
+    """Recomputes the given rollup tables from the raw rows."""
+    for rollup, source, keys, values, _ in rollups:
+        key_columns = [column for column, _ in keys]
+        value_columns = [column for column, _ in values]
+        key_exprs = [expr.format(row=source) for _, expr in keys]
+        cursor.execute(f"DELETE FROM {rollup}")
+        cursor.execute(
+            f"INSERT INTO {rollup} ({', '.join(key_columns + value_columns)}) "
+            f"SELECT {', '.join(key_exprs)}, "
+            + ', '.join(f"SUM({expr.format(row=source)})" for _, expr in values)
+            + f" FROM {source} GROUP BY {', '.join(key_exprs)}"
+        )
+
+def rebuild_rollups():
     """
-    Executes production of a product: reduces component stock and increases final product stock.
-    Returns a dictionary with success and message.
+    Reconstructs the rollup tables (daily and per product) from the raw revenue, costs and sales rows.
+    Only needed after editing the database outside the application (triggers keep them current).
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    try:
-        # Get product name
-        cursor.execute("SELECT name FROM products WHERE id = ?", (product_id,))
-        product_row = cursor.fetchone()
-        if not product_row:
-            conn.close()
-            return {'success': False, 'message': 'Product not found.'}
-        product_name = product_row['name']
-        
-        # Verify that the requested quantity can be produced
-        mrp_result = calculate_mrp_production(product_id)
-        if not mrp_result or mrp_result['can_produce'] < quantity:
-            conn.close()
-            return {'success': False, 'message': f'Not enough components. Only {mrp_result["can_produce"] if mrp_result else 0} units can be produced.'}
-        
-        # Get BOM components
-        cursor.execute("""
-            SELECT 
-                bom.child_product_id,
-                bom.quantity as required_quantity
-            FROM bill_of_materials bom
-            WHERE bom.parent_product_id = ?
-        """, (product_id,))
-        
-        components = [dict(row) for row in cursor.fetchall()]
-        
-        if not components:
-            conn.close()
-            return {'success': False, 'message': 'This product has no components defined in the BOM.'}
-        
-        # Reduce stock of each component
-        for comp in components:
-            child_id = comp['child_product_id']
-            required_qty = comp['required_quantity'] * quantity
-            cursor.execute("UPDATE products SET stock = stock - ? WHERE id = ?", (required_qty, child_id))
-        
-        # Increase final product stock
-        cursor.execute("UPDATE products SET stock = stock + ? WHERE id = ?", (quantity, product_id))
-        
-        conn.commit()
-        conn.close()
-        return {'success': True, 'message': f'Production executed: {quantity} units of {product_name} produced.'}
-    except Exception as e:
-        conn.rollback()
-        conn.close()
-        return {'success': False, 'message': f'Error executing production: {str(e)}'}
+    with transaction(immediate=True, tables=('daily_revenue', 'daily_costs', 'daily_cost_categories', 'daily_sales',
+                                             'daily_product_sales', 'product_sales_stats')) as conn:
+        _rebuild_rollups(conn.cursor(), ROLLUPS + PRODUCT_SALES_ROLLUPS)
+
+def _day_bounds(start, end):
+    """Truncates [start, end) bounds to the 'YYYY-MM-DD' granularity of the rollup tables."""
+    return (start[:10] if start else None), (end[:10] if end else None)
 
 # --- Finance Functions ---
 
 def add_revenue(description, amount, date=None):
     """Adds a revenue entry."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    if date:
-        cursor.execute("INSERT INTO revenue (description, amount, date) VALUES (?, ?, ?)", (description, amount, date))
-    else:
-        cursor.execute("INSERT INTO revenue (description, amount) VALUES (?, ?)", (description, amount))
-    conn.commit()
-    conn.close()
+    with transaction(tables=('revenue',)) as conn:
+        if date:
+            conn.execute("INSERT INTO revenue (description, amount, date) VALUES (?, ?, ?)", (description, amount, date))
+        else:
+            conn.execute("INSERT INTO revenue (description, amount) VALUES (?, ?)", (description, amount))
 
 def add_cost(description, amount, date=None, category='Others'):
     """Adds a cost entry."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    if date:
-        cursor.execute("INSERT INTO costs (description, amount, category, date) VALUES (?, ?, ?, ?)", (description, amount, category, date))
-    else:
-        cursor.execute("INSERT INTO costs (description, amount, category) VALUES (?, ?, ?)", (description, amount, category))
-    conn.commit()
-    conn.close()
+    with transaction(tables=('costs',)) as conn:
+        if date:
+            conn.execute("INSERT INTO costs (description, amount, category, date) VALUES (?, ?, ?, ?)", (description, amount, category, date))
+        else:
+            conn.execute("INSERT INTO costs (description, amount, category) VALUES (?, ?, ?)", (description, amount, category))
 
 def get_recent_revenue(limit=10):
     """Gets the most recent revenue entries."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, description, amount, date FROM revenue ORDER BY date DESC LIMIT ?", (limit,))
-    revenue_entries = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+    with connection() as conn:
+        cursor = conn.execute("SELECT id, description, amount, date FROM revenue ORDER BY date DESC LIMIT ?", (limit,))
+        revenue_entries = [dict(row) for row in cursor.fetchall()]
     return revenue_entries
 
 def get_all_revenue():
     """Gets all revenue entries."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, description, amount, date FROM revenue ORDER BY date DESC")
-    revenue_entries = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+    with connection() as conn:
+        cursor = conn.execute("SELECT id, description, amount, date FROM revenue ORDER BY date DESC")
+        revenue_entries = [dict(row) for row in cursor.fetchall()]
     return revenue_entries
 
 def get_recent_costs(limit=10):
     """Gets the most recent cost entries."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, description, amount, category, date FROM costs ORDER BY date DESC LIMIT ?", (limit,))
-    cost_entries = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+    with connection() as conn:
+        cursor = conn.execute("SELECT id, description, amount, category, date FROM costs ORDER BY date DESC LIMIT ?", (limit,))
+        cost_entries = [dict(row) for row in cursor.fetchall()]
     return cost_entries
 
 def get_all_costs():
     """Gets all cost entries."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, description, amount, category, date FROM costs ORDER BY date DESC")
-    cost_entries = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+    with connection() as conn:
+        cursor = conn.execute("SELECT id, description, amount, category, date FROM costs ORDER BY date DESC")
+        cost_entries = [dict(row) for row in cursor.fetchall()]
     return cost_entries
 
 def update_revenue(revenue_id, description, amount, date=None):
     """Updates a revenue entry."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    if date:
-        cursor.execute("UPDATE revenue SET description = ?, amount = ?, date = ? WHERE id = ?", (description, amount, date, revenue_id))
-    else:
-        cursor.execute("UPDATE revenue SET description = ?, amount = ? WHERE id = ?", (description, amount, revenue_id))
-    conn.commit()
-    conn.close()
+    with transaction(tables=('revenue',)) as conn:
+        if date:
+            conn.execute("UPDATE revenue SET description = ?, amount = ?, date = ? WHERE id = ?", (description, amount, date, revenue_id))
+        else:
+            conn.execute("UPDATE revenue SET description = ?, amount = ? WHERE id = ?", (description, amount, revenue_id))
 
 def update_cost(cost_id, description, amount, date=None, category='Others'):
     """Updates a cost entry."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    if date:
-        cursor.execute("UPDATE costs SET description = ?, amount = ?, category = ?, date = ? WHERE id = ?", (description, amount, category, date, cost_id))
-    else:
-        cursor.execute("UPDATE costs SET description = ?, amount = ?, category = ? WHERE id = ?", (description, amount, category, cost_id))
-    conn.commit()
-    conn.close()
+    with transaction(tables=('costs',)) as conn:
+        if date:
+            conn.execute("UPDATE costs SET description = ?, amount = ?, category = ?, date = ? WHERE id = ?", (description, amount, category, date, cost_id))
+        else:
+            conn.execute("UPDATE costs SET description = ?, amount = ?, category = ? WHERE id = ?", (description, amount, category, cost_id))
 
 def delete_revenue(revenue_id):
     """Deletes a revenue entry."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM revenue WHERE id = ?", (revenue_id,))
-    conn.commit()
-    conn.close()
+    with transaction(tables=('revenue',)) as conn:
+        conn.execute("DELETE FROM revenue WHERE id = ?", (revenue_id,))
 
 def delete_cost(cost_id):
     """Deletes a cost entry."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM costs WHERE id = ?", (cost_id,))
-    conn.commit()
-    conn.close()
+    with transaction(tables=('costs',)) as conn:
+        conn.execute("DELETE FROM costs WHERE id = ?", (cost_id,))
+
+FINANCE_SORTS = {'date': ['date', 'id'], 'amount': ['amount', 'id']}
+
+def get_revenue_page(search=None, start=None, end=None, sort='date', descending=True,
+                     limit=PAGE_SIZE, cursor=None, include_total=False):
+    """Gets one page of revenue entries, filtered by description text and [start, end) dates."""
+    conditions, params = [], []
+    if search:
+        conditions.append("description LIKE ? ESCAPE '\\'")
+        params.append(_like_pattern(search))
+    where, range_params = _date_range_clause('date', _normalize_date(start), _normalize_date(end))
+    conditions.append(where)
+    params.extend(range_params)
+    return _fetch_page(
+        'revenue', "id, description, amount, date", conditions, params,
+        _sort_columns(sort, FINANCE_SORTS), sort, descending, limit, cursor, include_total
+    )
+
+def get_costs_page(search=None, category=None, start=None, end=None, sort='date', descending=True,
+                   limit=PAGE_SIZE, cursor=None, include_total=False):
+    """Gets one page of cost entries, filtered by description text, category and [start, end) dates."""
+    conditions, params = [], []
+    if search:
+        conditions.append("description LIKE ? ESCAPE '\\'")
+        params.append(_like_pattern(search))
+    if category:
+        conditions.append("category = ?")
+        params.append(category)
+    where, range_params = _date_range_clause('date', _normalize_date(start), _normalize_date(end))
+    conditions.append(where)
+    params.extend(range_params)
+    return _fetch_page(
+        'costs', "id, description, amount, category, date", conditions, params,
+        _sort_columns(sort, FINANCE_SORTS), sort, descending, limit, cursor, include_total
+    )
 
-def get_financial_summary(period='month'):
+def get_financial_summary(period='month', start=None, end=None):
     """
     Gets a summary of revenue, costs and profits by period.
     period can be: 'day', 'week', 'month', 'year'
+    start/end optionally restrict the history to [start, end), at day granularity.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
     # Determine date format according to period
     date_format_map = {
         'day': '%Y-%m-%d',
@@ -677,16 +2601,19 @@ def get_financial_summary(period='month'):
         'year': '%Y'
     }
     date_format = date_format_map.get(period, '%Y-%m')
+    # Only explicit bounds filter here: by default the chart covers the whole history
+    where, params = _date_range_clause('day', *_day_bounds(_normalize_date(start), _normalize_date(end)))
     
-    # Revenue query
-    cursor.execute(f"SELECT strftime('{date_format}', date) as period, SUM(amount) as total FROM revenue GROUP BY period ORDER BY period")
-    revenue_data = {row['period']: row['total'] for row in cursor.fetchall()}
-    
-    # Costs query
-    cursor.execute(f"SELECT strftime('{date_format}', date) as period, SUM(amount) as total FROM costs GROUP BY period ORDER BY period")
-    costs_data = {row['period']: row['total'] for row in cursor.fetchall()}
+    with connection() as conn:
+        cursor = conn.cursor()
 
-    conn.close()
+        # Revenue query (one rollup row per day)
+        cursor.execute(f"SELECT strftime('{date_format}', day) as period, SUM(total_amount) as total FROM daily_revenue WHERE {where} GROUP BY period ORDER BY period", params)
+        revenue_data = {row['period']: row['total'] for row in cursor.fetchall()}
+        
+        # Costs query
+        cursor.execute(f"SELECT strftime('{date_format}', day) as period, SUM(total_amount) as total FROM daily_costs WHERE {where} GROUP BY period ORDER BY period", params)
+        costs_data = {row['period']: row['total'] for row in cursor.fetchall()}
     
     # Combine data
     all_periods = sorted(list(set(revenue_data.keys()) | set(costs_data.keys())))
@@ -706,347 +2633,604 @@ def get_financial_summary(period='month'):
 
 def add_sale(product_id, product_name, quantity, unit_price, date=None):
     """Adds a sale to the history."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
     total_amount = float(quantity) * float(unit_price)
-    
-    # Update product stock
-    cursor.execute("UPDATE products SET stock = stock - ? WHERE id = ?", (quantity, product_id))
-    
-    # Register the sale
-    if date:
-        cursor.execute("INSERT INTO sales (product_id, product_name, quantity, unit_price, total_amount, date) VALUES (?, ?, ?, ?, ?, ?)",
-                      (product_id, product_name, quantity, unit_price, total_amount, date))
-    else:
-        cursor.execute("INSERT INTO sales (product_id, product_name, quantity, unit_price, total_amount) VALUES (?, ?, ?, ?, ?)",
-                      (product_id, product_name, quantity, unit_price, total_amount))
-    
-    # Also register in revenue
-    if date:
-        cursor.execute("INSERT INTO revenue (description, amount, date) VALUES (?, ?, ?)",
-                      (f"Sale: {product_name} x{quantity}", total_amount, date))
-    else:
-        cursor.execute("INSERT INTO revenue (description, amount) VALUES (?, ?)",
-                      (f"Sale: {product_name} x{quantity}", total_amount))
-    
-    conn.commit()
-    conn.close()
+    with transaction(tables=('sales', 'revenue', 'products', 'stock_movements')) as conn:
+        cursor = conn.cursor()
+        
+        # Update product stock
+        cursor.execute("UPDATE products SET stock = stock - ? WHERE id = ?", (quantity, product_id))
+        
+        # Register the sale
+        if date:
+            cursor.execute("INSERT INTO sales (product_id, product_name, quantity, unit_price, total_amount, date, unit_cost) VALUES (?, ?, ?, ?, ?, ?, (SELECT cost FROM products WHERE id = ?))",
+                          (product_id, product_name, quantity, unit_price, total_amount, date, product_id))
+        else:
+            cursor.execute("INSERT INTO sales (product_id, product_name, quantity, unit_price, total_amount, unit_cost) VALUES (?, ?, ?, ?, ?, (SELECT cost FROM products WHERE id = ?))",
+                          (product_id, product_name, quantity, unit_price, total_amount, product_id))
+        
+        sale_id = cursor.lastrowid
+        # Also register in revenue, linked to the sale (same amount and timestamp)
+        _insert_sale_revenue(cursor, sale_id, product_name, quantity)
+        _record_sale_movements(conn, "id = ?", (sale_id,))
 
-def add_multiple_sales(sales_list):
+def _insert_sale_revenue(cursor, sale_id, product_name, quantity):
+    """Inserts the revenue row for a sale, linked by revenue.sale_id."""
+    cursor.execute(
+        "INSERT INTO revenue (description, amount, date, sale_id) SELECT ?, total_amount, date, id FROM sales WHERE id = ?",
+        (f"Sale: {product_name} x{quantity}", sale_id)
+    )
+
+def add_multiple_sales(sales_list, all_or_nothing=False):
     """
-    Adds multiple sales to the history.
-    sales_list is a list of dictionaries with: product_id, product_name, quantity, unit_price, date (optional)
+    Adds multiple sales to the history in one set-based pass.
+    sales_list is a list of dictionaries with: product_id, product_name (optional, defaults to
+    the catalog name), quantity, unit_price, date (optional).
+    The whole batch is validated first. Invalid lines are skipped and reported in 'errors'
+    as {'index', 'message'}; with all_or_nothing=True any invalid line rejects the batch.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    try:
-        total_revenue = 0
-        for sale in sales_list:
-            product_id = sale['product_id']
-            product_name = sale['product_name']
+    # Validate and normalize every line before touching the database
+    lines = []
+    errors = []
+    for index, sale in enumerate(sales_list):
+        try:
+            product_id = int(sale['product_id'])
             quantity = float(sale['quantity'])
             unit_price = float(sale['unit_price'])
-            date = sale.get('date', None)
-            total_amount = quantity * unit_price
-            total_revenue += total_amount
-            
-            # Update product stock
-            cursor.execute("UPDATE products SET stock = stock - ? WHERE id = ?", (quantity, product_id))
-            
-            # Register the sale
-            if date:
-                cursor.execute("INSERT INTO sales (product_id, product_name, quantity, unit_price, total_amount, date) VALUES (?, ?, ?, ?, ?, ?)",
-                              (product_id, product_name, quantity, unit_price, total_amount, date))
-            else:
-                cursor.execute("INSERT INTO sales (product_id, product_name, quantity, unit_price, total_amount) VALUES (?, ?, ?, ?, ?)",
-                              (product_id, product_name, quantity, unit_price, total_amount))
-            
-            # Also register in revenue
-            if date:
-                cursor.execute("INSERT INTO revenue (description, amount, date) VALUES (?, ?, ?)",
-                              (f"Sale: {product_name} x{quantity}", total_amount, date))
-            else:
-                cursor.execute("INSERT INTO revenue (description, amount) VALUES (?, ?)",
-                              (f"Sale: {product_name} x{quantity}", total_amount))
-        
-        conn.commit()
-        conn.close()
-        return {'success': True, 'message': f'{len(sales_list)} sales registered successfully. Total: ${total_revenue:.2f}'}
+        except (KeyError, TypeError, ValueError) as e:
+            errors.append({'index': index, 'message': f'Invalid line: {e}'})
+            continue
+        if quantity <= 0:
+            errors.append({'index': index, 'message': 'Quantity must be greater than zero'})
+            continue
+        if unit_price < 0:
+            errors.append({'index': index, 'message': 'Unit price cannot be negative'})
+            continue
+        lines.append((index, product_id, sale.get('product_name'), quantity, unit_price, sale.get('date') or None))
+
+    try:
+        with transaction(immediate=True, tables=('sales', 'revenue', 'products', 'stock_movements')) as conn:
+            cursor = conn.cursor()
+
+            # One lookup for every product referenced by the batch
+            product_ids = sorted({line[1] for line in lines})
+            cursor.execute("SELECT id, name FROM products WHERE id IN (SELECT value FROM json_each(?))",
+                           (json.dumps(product_ids),))
+            catalog_names = {row['id']: row['name'] for row in cursor.fetchall()}
+            valid = []
+            for line in lines:
+                if line[1] in catalog_names:
+                    valid.append(line)
+                else:
+                    errors.append({'index': line[0], 'message': f'Product {line[1]} not found'})
+
+            if errors and all_or_nothing:
+                errors.sort(key=lambda error: error['index'])
+                return {'success': False, 'message': f'{len(errors)} invalid lines, no sales registered.',
+                        'inserted': 0, 'errors': errors}
+            if not valid:
+                return {'success': False, 'message': 'No valid sales to register.', 'inserted': 0, 'errors': errors}
+
+            # One stock UPDATE per distinct product
+            stock_deltas = {}
+            for _, product_id, _, quantity, _, _ in valid:
+                stock_deltas[product_id] = stock_deltas.get(product_id, 0) + quantity
+            cursor.executemany("UPDATE products SET stock = stock - ? WHERE id = ?",
+                               [(quantity, product_id) for product_id, quantity in stock_deltas.items()])
+
+            # Register the sales under explicit ids past the AUTOINCREMENT high-water mark,
+            # so the linked rows below refer to exactly these sales. Should any id be
+            # taken, the insert fails instead of linking someone else's rows.
+            last_id = cursor.execute("""
+                SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'sales'), 0),
+                           COALESCE((SELECT MAX(id) FROM sales), 0))
+            """).fetchone()[0]
+            sale_ids = list(range(last_id + 1, last_id + 1 + len(valid)))
+            cursor.executemany(
+                "INSERT INTO sales (id, product_id, product_name, quantity, unit_price, total_amount, date, unit_cost) "
+                "VALUES (?, ?, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), (SELECT cost FROM products WHERE id = ?))",
+                [(sale_id, product_id, product_name or catalog_names[product_id], quantity, unit_price, quantity * unit_price, date, product_id)
+                 for sale_id, (_, product_id, product_name, quantity, unit_price, date) in zip(sale_ids, valid)]
+            )
+
+            # Linked revenue rows, with descriptions formatted by SQLite in the same statement
+            new_sales = "id IN (SELECT value FROM json_each(?))"
+            cursor.execute(f"""
+                INSERT INTO revenue (description, amount, date, sale_id)
+                SELECT 'Sale: ' || product_name || ' x' || quantity, total_amount, date, id
+                FROM sales WHERE {new_sales}
+            """, (json.dumps(sale_ids),))
+            _record_sale_movements(conn, new_sales, (json.dumps(sale_ids),))
+            total_revenue = sum(quantity * unit_price for _, _, _, quantity, unit_price, _ in valid)
     except Exception as e:
-        conn.rollback()
-        conn.close()
-        return {'success': False, 'message': f'Error registering sales: {str(e)}'}
+        return {'success': False, 'message': f'Error registering sales: {str(e)}', 'inserted': 0, 'errors': errors}
+
+    errors.sort(key=lambda error: error['index'])
+    message = f'{len(valid)} sales registered successfully. Total: ${total_revenue:.2f}'
+    if errors:
+        message += f' ({len(errors)} lines skipped)'
+    return {'success': True, 'message': message, 'inserted': len(valid), 'errors': errors}
 
 def get_all_sales():
     """Gets all sales."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, product_id, product_name, quantity, unit_price, total_amount, date FROM sales ORDER BY date DESC")
-    sales = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+    with connection() as conn:
+        cursor = conn.execute("SELECT id, product_id, product_name, quantity, unit_price, total_amount, date FROM sales ORDER BY date DESC")
+        sales = [dict(row) for row in cursor.fetchall()]
     return sales
 
+SALES_SORTS = {'date': ['date', 'id'], 'total_amount': ['total_amount', 'id']}
+
+def get_sales_page(search=None, product_id=None, start=None, end=None, sort='date', descending=True,
+                   limit=PAGE_SIZE, cursor=None, include_total=False):
+    """Gets one page of sales, filtered by product name text, product and [start, end) dates."""
+    conditions, params = [], []
+    if search:
+        conditions.append("product_name LIKE ? ESCAPE '\\'")
+        params.append(_like_pattern(search))
+    if product_id:
+        conditions.append("product_id = ?")
+        params.append(product_id)
+    where, range_params = _date_range_clause('date', _normalize_date(start), _normalize_date(end))
+    conditions.append(where)
+    params.extend(range_params)
+    return _fetch_page(
+        'sales', "id, product_id, product_name, quantity, unit_price, total_amount, date", conditions, params,
+        _sort_columns(sort, SALES_SORTS), sort, descending, limit, cursor, include_total
+    )
+
 def get_recent_sales(limit=10):
     """Gets the most recent sales."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, product_id, product_name, quantity, unit_price, total_amount, date FROM sales ORDER BY date DESC LIMIT ?", (limit,))
-    sales = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+    with connection() as conn:
+        cursor = conn.execute("SELECT id, product_id, product_name, quantity, unit_price, total_amount, date FROM sales ORDER BY date DESC LIMIT ?", (limit,))
+        sales = [dict(row) for row in cursor.fetchall()]
     return sales
 
 def get_sale_by_id(sale_id):
     """Gets a sale by its ID."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, product_id, product_name, quantity, unit_price, total_amount, date FROM sales WHERE id = ?", (sale_id,))
-    sale = cursor.fetchone()
-    conn.close()
+    with connection() as conn:
+        sale = conn.execute("SELECT id, product_id, product_name, quantity, unit_price, total_amount, date FROM sales WHERE id = ?", (sale_id,)).fetchone()
     if sale:
         return dict(sale)
     return None
 
 def update_sale(sale_id, product_id, product_name, quantity, unit_price, date=None):
     """Updates an existing sale."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Get original sale
-    original_sale = get_sale_by_id(sale_id)
-    if not original_sale:
-        conn.close()
-        raise ValueError("Sale not found")
-    
-    # Calculate new total
-    new_total = float(quantity) * float(unit_price)
-    
-    # Adjust stock: restore original and apply new
-    quantity_diff = float(quantity) - original_sale['quantity']
-    cursor.execute("UPDATE products SET stock = stock - ? WHERE id = ?", (quantity_diff, product_id))
-    
-    # Update the sale
-    if date:
-        cursor.execute("""
-            UPDATE sales 
-            SET product_id = ?, product_name = ?, quantity = ?, unit_price = ?, total_amount = ?, date = ?
-            WHERE id = ?
-        """, (product_id, product_name, quantity, unit_price, new_total, date, sale_id))
-    else:
+    with transaction(tables=('sales', 'revenue', 'products', 'stock_movements')) as conn:
+        cursor = conn.cursor()
+        
+        # Get original sale (read through this transaction's connection)
+        original_sale = get_sale_by_id(sale_id)
+        if not original_sale:
+            raise ValueError("Sale not found")
+        
+        # Calculate new total
+        new_total = float(quantity) * float(unit_price)
+        
+        # Adjust stock: restore the original product and take the new quantity from the
+        # (possibly different) new product; the ledger gets a reversal and a new sale movement
+        if original_sale['product_id'] is not None:
+            cursor.execute("UPDATE products SET stock = stock + ? WHERE id = ?", (original_sale['quantity'], original_sale['product_id']))
+        cursor.execute("UPDATE products SET stock = stock - ? WHERE id = ?", (float(quantity), product_id))
+        _record_sale_movements(conn, "id = ?", (sale_id,), 'sale_reversal', 1)
+        
+        # Update the sale; it keeps the unit cost it was sold at unless the product changes
+        unit_cost = "unit_cost = CASE WHEN product_id IS ? THEN unit_cost ELSE (SELECT cost FROM products WHERE id = ?) END"
+        if date:
+            cursor.execute(f"""
+                UPDATE sales 
+                SET product_id = ?, product_name = ?, quantity = ?, unit_price = ?, total_amount = ?, date = ?, {unit_cost}
+                WHERE id = ?
+            """, (product_id, product_name, quantity, unit_price, new_total, date, product_id, product_id, sale_id))
+        else:
+            cursor.execute(f"""
+                UPDATE sales 
+                SET product_id = ?, product_name = ?, quantity = ?, unit_price = ?, total_amount = ?, {unit_cost}
+                WHERE id = ?
+            """, (product_id, product_name, quantity, unit_price, new_total, product_id, product_id, sale_id))
+        _record_sale_movements(conn, "id = ?", (sale_id,))
+        
+        # Update the linked revenue entry (amount and date follow the sale)
+        revenue_description = f"Sale: {product_name} x{quantity}"
         cursor.execute("""
-            UPDATE sales 
-            SET product_id = ?, product_name = ?, quantity = ?, unit_price = ?, total_amount = ?
-            WHERE id = ?
-        """, (product_id, product_name, quantity, unit_price, new_total, sale_id))
-    
-    # Update associated revenue (search by similar description and date)
-    revenue_description = f"Sale: {product_name} x{quantity}"
-    cursor.execute("""
-        UPDATE revenue 
-        SET description = ?, amount = ?
-        WHERE description LIKE ? AND date = (
-            SELECT date FROM sales WHERE id = ?
-        )
-        LIMIT 1
-    """, (revenue_description, new_total, f"Sale: {original_sale['product_name']} x%", sale_id))
-    
-    conn.commit()
-    conn.close()
+            UPDATE revenue 
+            SET description = ?, amount = ?, date = (SELECT date FROM sales WHERE id = ?)
+            WHERE sale_id = ?
+        """, (revenue_description, new_total, sale_id, sale_id))
 
 def delete_sale(sale_id):
     """Deletes a sale and its associated revenue."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    # Get sale data before deleting
-    cursor.execute("SELECT product_id, quantity, total_amount, product_name, date FROM sales WHERE id = ?", (sale_id,))
-    sale = cursor.fetchone()
-    if sale:
-        # Restore stock
-        cursor.execute("UPDATE products SET stock = stock + ? WHERE id = ?", (sale['quantity'], sale['product_id']))
-        # Delete associated revenue (search by similar description and date)
-        cursor.execute("""
-            DELETE FROM revenue 
-            WHERE description LIKE ? 
-            AND amount = ?
-            AND date = ?
-        """, (f"Sale: {sale['product_name']} x%", sale['total_amount'], sale['date']))
-    cursor.execute("DELETE FROM sales WHERE id = ?", (sale_id,))
-    conn.commit()
-    conn.close()
+    with transaction(tables=('sales', 'revenue', 'products', 'stock_movements')) as conn:
+        cursor = conn.cursor()
+        # Get sale data before deleting
+        cursor.execute("SELECT product_id, quantity FROM sales WHERE id = ?", (sale_id,))
+        sale = cursor.fetchone()
+        if sale:
+            # Restore stock
+            cursor.execute("UPDATE products SET stock = stock + ? WHERE id = ?", (sale['quantity'], sale['product_id']))
+            _record_sale_movements(conn, "id = ?", (sale_id,), 'sale_reversal', 1)
+            # Delete the linked revenue entry
+            cursor.execute("DELETE FROM revenue WHERE sale_id = ?", (sale_id,))
+        cursor.execute("DELETE FROM sales WHERE id = ?", (sale_id,))
 
-def get_sales_by_period(period='month'):
+def get_sales_by_period(period='month', start=None, end=None):
     """
     Gets sales filtered by period.
-    period can be: 'day', 'week', 'month', 'year'
+    period can be: 'day', 'week', 'month', 'year' (anything else returns all sales).
+    start/end select an arbitrary [start, end) range instead.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    if period == 'day':
-        cursor.execute("""
-            SELECT id, product_id, product_name, quantity, unit_price, total_amount, date
-            FROM sales
-            WHERE strftime('%Y-%m-%d', date) = strftime('%Y-%m-%d', 'now')
-            ORDER BY date DESC
-        """)
-    elif period == 'week':
-        cursor.execute("""
-            SELECT id, product_id, product_name, quantity, unit_price, total_amount, date
-            FROM sales
-            WHERE strftime('%Y-W%W', date) = strftime('%Y-W%W', 'now')
-            ORDER BY date DESC
-        """)
-    elif period == 'month':
-        cursor.execute("""
-            SELECT id, product_id, product_name, quantity, unit_price, total_amount, date
-            FROM sales
-            WHERE strftime('%Y-%m', date) = strftime('%Y-%m', 'now')
-            ORDER BY date DESC
-        """)
-    elif period == 'year':
-        cursor.execute("""
+    where, params = _date_range_clause('date', *_period_bounds(period, start, end))
+    with connection() as conn:
+        cursor = conn.execute(f"""
             SELECT id, product_id, product_name, quantity, unit_price, total_amount, date
             FROM sales
-            WHERE strftime('%Y', date) = strftime('%Y', 'now')
+            WHERE {where}
             ORDER BY date DESC
-        """)
-    else:
-        cursor.execute("SELECT id, product_id, product_name, quantity, unit_price, total_amount, date FROM sales ORDER BY date DESC")
-    
-    sales = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+        """, params)
+        sales = [dict(row) for row in cursor.fetchall()]
     return sales
 
+# --- Reorder Suggestions ---
+# Demand comes from daily_product_sales (kept current by triggers), so a velocity window
+# reads at most one row per product and day. Products with a BOM are replenished by
+# production. Requirements are netted level by level, parents before children: an
+# assembly's planned production is demand on its direct components, which first cover
+# it from their own stock (sub-assemblies included), and only the rest goes further down.
+
+VELOCITY_WINDOWS = (7, 30, 90)
+
+def get_reorder_suggestions(window_days=30, lead_time_days=7, safety_days=7, cover_days=30, limit=50):
+    """
+    Gets the ranked list of products to reorder (purchase) or produce.
+    velocity = units sold per day over the last window_days (all VELOCITY_WINDOWS are
+    reported too); days_of_cover = stock / (own + BOM-implied daily demand).
+    A product is suggested when its stock is at or below its reorder point,
+    max(min_stock, velocity * (lead_time_days + safety_days)); the suggested quantity
+    brings it up to max(min_stock, velocity * (lead_time_days + safety_days + cover_days)),
+    plus, for components, what the suggested production of their parents consumes.
+    Most urgent (lowest days of cover) first.
+    """
+    windows = sorted(set(VELOCITY_WINDOWS) | {int(window_days)})
+    today = datetime.now(timezone.utc).date()
+    since = {window: (today - timedelta(days=window - 1)).isoformat() for window in windows}
+    window_sums = ', '.join(
+        f"SUM(CASE WHEN day >= '{since[window]}' THEN quantity ELSE 0 END) AS sold_{window}" for window in windows)
+    with connection() as conn:
+        products = {}
+        for row in conn.execute(f"""
+            SELECT p.id, p.name, p.sku, p.product_type, p.stock, p.min_stock, p.stock_unit_type,
+                   COALESCE(c.component_unit_cost, p.cost, 0) AS unit_cost, s.*
+            FROM products p
+            LEFT JOIN bom_cost_cache c ON c.product_id = p.id
+            LEFT JOIN (
+                SELECT product_id AS sold_product_id, {window_sums}
+                FROM daily_product_sales
+                WHERE day >= ?
+                GROUP BY product_id
+            ) s ON s.sold_product_id = p.id
+            WHERE p.product_type != 'otro'
+        """, (since[windows[-1]],)):
+            product = dict(row)
+            product['velocities'] = {window: (product.pop(f'sold_{window}') or 0) / window for window in windows}
+            product.pop('sold_product_id')
+            products[product['id']] = product
+        children = {}
+        for row in conn.execute("SELECT parent_product_id, child_product_id, quantity FROM bill_of_materials"):
+            if row['child_product_id'] in products:
+                children.setdefault(row['parent_product_id'], []).append((row['child_product_id'], row['quantity']))
+
+    reorder_days = lead_time_days + safety_days
+    target_days = reorder_days + cover_days
+
+    def plan(product, extra_requirement=0):
+        velocity = product['velocities'][int(window_days)]
+        reorder_point = max(product['min_stock'] or 0, velocity * reorder_days)
+        target = max(product['min_stock'] or 0, velocity * target_days) + extra_requirement
+        needed = target - product['stock']
+        if product['stock'] > reorder_point + extra_requirement or needed <= 0:
+            return 0, reorder_point
+        if product['stock_unit_type'] != 'grams':
+            needed = math.ceil(needed)
+        return needed, reorder_point
+
+    # Parents before children: a product is planned once every assembly using it is
+    # (products caught in a BOM cycle never get there and are planned last)
+    parents_left = {}
+    for parent_id, parts in children.items():
+        if parent_id in products:
+            for child_id, _ in parts:
+                parents_left[child_id] = parents_left.get(child_id, 0) + 1
+    ready = [product_id for product_id in products if not parents_left.get(product_id)]
+    order = []
+    while ready:
+        product_id = ready.pop()
+        order.append(product_id)
+        for child_id, _ in children.get(product_id, ()):
+            parents_left[child_id] -= 1
+            if not parents_left[child_id]:
+                ready.append(child_id)
+    planned = set(order)
+    order += [product_id for product_id in products if product_id not in planned]
+
+    suggestions = []
+    dependent_velocity = {}
+    component_requirement = {}
+    for product_id in order:
+        product = products[product_id]
+        quantity, reorder_point = plan(product, component_requirement.get(product_id, 0))
+        if product_id in children:
+            # Net production (after this product's own stock) is demand on its direct components
+            demand = product['velocities'][int(window_days)] + dependent_velocity.get(product_id, 0)
+            for child_id, child_quantity in children[product_id]:
+                dependent_velocity[child_id] = dependent_velocity.get(child_id, 0) + demand * child_quantity
+                component_requirement[child_id] = component_requirement.get(child_id, 0) + quantity * child_quantity
+        if quantity:
+            suggestions.append((product, 'produce' if product_id in children else 'purchase', quantity, reorder_point))
+
+    result = []
+    for product, action, quantity, reorder_point in suggestions:
+        velocity = product['velocities'][int(window_days)]
+        daily_demand = velocity + dependent_velocity.get(product['id'], 0)
+        result.append({
+            'product_id': product['id'],
+            'product_name': product['name'],
+            'sku': product['sku'],
+            'product_type': product['product_type'],
+            'stock_unit_type': product['stock_unit_type'],
+            'stock': product['stock'],
+            'min_stock': product['min_stock'],
+            'action': action,
+            'velocity': velocity,
+            'velocities': product['velocities'],
+            'dependent_velocity': dependent_velocity.get(product['id'], 0),
+            'days_of_cover': product['stock'] / daily_demand if daily_demand > 0 else None,
+            'reorder_point': reorder_point,
+            'component_requirement': component_requirement.get(product['id'], 0),
+            'suggested_quantity': quantity,
+            'estimated_cost': quantity * product['unit_cost']
+        })
+    # Most urgent first: no cover left, then fewest days of cover, then largest orders
+    result.sort(key=lambda item: (item['days_of_cover'] if item['days_of_cover'] is not None else float('inf'),
+                                  -item['estimated_cost']))
+    return result[:limit] if limit else result
+
 # --- Business Intelligence Functions ---
 
+TOP_PRODUCT_METRICS = {
+    'quantity': 'total_quantity',
+    'revenue': 'total_revenue',
+    'profit': 'total_profit',
+}
+
+def get_top_products(metric='quantity', limit=5, period=None, start=None, end=None):
+    """
+    Gets the top products by 'quantity' sold, 'revenue' or 'profit' (revenue minus the
+    cost of goods at the unit cost each sale was made at). All time by default, read from
+    product_sales_stats; a period ('day', 'week', 'month', 'year') or start/end range
+    sums daily_product_sales instead. Sales of deleted products are ranked under the
+    name they were sold as (product_id None), summed from the sales themselves.
+    """
+    if metric not in TOP_PRODUCT_METRICS:
+        raise ValueError(f"Unknown metric {metric}. Use one of: {', '.join(TOP_PRODUCT_METRICS)}")
+    columns = """
+        p.name as product_name, s.product_id, {quantity} as total_quantity, {amount} as total_revenue,
+        {cost} as total_cost, {amount} - {cost} as total_profit, p.cost as unit_cost
+    """
+    bounds = _day_bounds(*_period_bounds(period, start, end)) if period or start or end else (None, None)
+    with connection() as conn:
+        if period or start or end:
+            where, params = _date_range_clause('s.day', *bounds)
+            cursor = conn.execute(f"""
+                SELECT {columns.format(quantity='SUM(s.quantity)', amount='SUM(s.total_amount)', cost='SUM(s.cost_of_goods)')}
+                FROM daily_product_sales s
+                JOIN products p ON p.id = s.product_id
+                WHERE {where}
+                GROUP BY s.product_id
+                ORDER BY {TOP_PRODUCT_METRICS[metric]} DESC
+                LIMIT ?
+            """, (*params, limit))
+        else:
+            # Sorted on the same expression as the metric's index on product_sales_stats
+            sort = {'quantity': 's.quantity', 'revenue': 's.total_amount', 'profit': 's.total_amount - s.cost_of_goods'}[metric]
+            cursor = conn.execute(f"""
+                SELECT {columns.format(quantity='s.quantity', amount='s.total_amount', cost='s.cost_of_goods')}
+                FROM product_sales_stats s
+                JOIN products p ON p.id = s.product_id
+                ORDER BY {sort} DESC
+                LIMIT ?
+            """, (limit,))
+        products = [dict(row) for row in cursor.fetchall()]
+        # The rollups pool deleted products under product_id 0; their sales (product_id
+        # NULL, read through idx_sales_product_date) are grouped by name instead
+        where, params = _date_range_clause('date', *bounds)
+        products += [dict(row) for row in conn.execute(f"""
+            SELECT product_name, NULL as product_id, SUM(quantity) as total_quantity,
+                   SUM(total_amount) as total_revenue, SUM(quantity * COALESCE(unit_cost, 0)) as total_cost,
+                   SUM(total_amount) - SUM(quantity * COALESCE(unit_cost, 0)) as total_profit, NULL as unit_cost
+            FROM sales
+            WHERE product_id IS NULL AND {where}
+            GROUP BY product_name
+            ORDER BY {TOP_PRODUCT_METRICS[metric]} DESC
+            LIMIT ?
+        """, (*params, limit))]
+    products.sort(key=lambda product: product[TOP_PRODUCT_METRICS[metric]], reverse=True)
+    return products[:limit]
+
 def get_top_products_by_sales(limit=5):
     """Gets the top products by sales quantity."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT product_name, SUM(quantity) as total_quantity, SUM(total_amount) as total_revenue
-        FROM sales
-        GROUP BY product_name
-        ORDER BY total_quantity DESC
-        LIMIT ?
-    """, (limit,))
-    products = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return products
+    return get_top_products('quantity', limit)
 
 def get_top_products_by_profitability(limit=5):
-    """Gets the top products by profitability (margin * quantity sold)."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT 
-            s.product_name,
-            s.product_id,
-            SUM(s.quantity) as total_quantity,
-            SUM(s.total_amount) as total_revenue,
-            p.cost as unit_cost,
-            SUM((s.unit_price - COALESCE(p.cost, 0)) * s.quantity) as total_profit
-        FROM sales s
-        LEFT JOIN products p ON s.product_id = p.id
-        GROUP BY s.product_name, s.product_id, p.cost
-        ORDER BY total_profit DESC
-        LIMIT ?
-    """, (limit,))
-    products = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return products
+    """Gets the top products by profitability (revenue minus cost of goods sold)."""
+    return get_top_products('profit', limit)
 
 def get_cost_breakdown_by_category():
     """Gets the cost breakdown by category."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT category, SUM(amount) as total
-        FROM costs
-        GROUP BY category
-        ORDER BY total DESC
-    """)
-    breakdown = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+    with connection() as conn:
+        cursor = conn.execute("""
+            SELECT category, SUM(total_amount) as total
+            FROM daily_cost_categories
+            GROUP BY category
+            ORDER BY total DESC
+        """)
+        breakdown = [dict(row) for row in cursor.fetchall()]
     return breakdown
 
 def get_products_without_movement(days=30):
-    """Gets products without movement in the last N days."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT p.id, p.name, p.product_type, p.stock, p.cost, p.stock * p.cost as total_value
-        FROM products p
-        WHERE p.id NOT IN (
-            SELECT DISTINCT product_id 
-            FROM sales 
-            WHERE date >= datetime('now', '-' || ? || ' days')
-        )
-        AND p.product_type IN ('final', 'padre')
-        ORDER BY p.name
-    """, (days,))
-    products = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+    """
+    Gets the products to sell ('final', 'padre') not sold in the last N days (or never),
+    from the maintained products.last_sold_at (indexed), longest unsold first.
+    """
+    with connection() as conn:
+        cursor = conn.execute("""
+            SELECT p.id, p.name, p.product_type, p.stock, p.cost, p.stock * p.cost as total_value, p.last_sold_at
+            FROM products p
+            WHERE (p.last_sold_at IS NULL OR p.last_sold_at < datetime('now', '-' || ? || ' days'))
+            AND p.product_type IN ('final', 'padre')
+            ORDER BY p.last_sold_at IS NOT NULL, p.last_sold_at, p.name
+        """, (days,))
+        products = [dict(row) for row in cursor.fetchall()]
     return products
 
+AGING_BUCKETS = (30, 60, 90, 180)
+
+def get_inventory_aging(buckets=AGING_BUCKETS, dead_stock_limit=50):
+    """
+    Gets the inventory aging report for the products in stock: product count, stock and
+    tied-up value (stock * cost) by days since their last movement, in the buckets
+    0-30, 30-60, 60-90, 90-180 and 180+ (for the default boundaries), plus 'never'
+    for products that have not moved since before last_moved_at was tracked (dated by
+    their purchase or creation date instead). dead_stock lists the most valuable
+    products of the oldest bucket.
+    """
+    boundaries = sorted({int(days) for days in buckets if int(days) > 0})
+    if not boundaries:
+        raise ValueError("At least one positive bucket boundary is required")
+    lows = [0] + boundaries
+    labels = [f"{low}-{high}" for low, high in zip(lows, boundaries)] + [f"{boundaries[-1]}+"]
+    # One range per bucket over idx_products_in_stock_moved (index only, no table reads);
+    # bucket i moved before the lower boundary and on or after the upper one
+    ranges = ["last_moved_at IS NULL"]
+    for low, high in zip(lows, boundaries + [None]):
+        bounds = []
+        if high is not None:
+            bounds.append(f"last_moved_at >= datetime('now', '-{high} days')")
+        if low > 0:
+            bounds.append(f"last_moved_at < datetime('now', '-{low} days')")
+        ranges.append(" AND ".join(bounds))
+    with read_snapshot() as conn:
+        rows = conn.execute(" UNION ALL ".join(f"""
+            SELECT {index} as bucket,
+                   COUNT(*) as product_count,
+                   COALESCE(SUM(stock), 0) as total_stock,
+                   ROUND(COALESCE(SUM(stock * cost), 0), 2) as total_value
+            FROM products
+            WHERE stock > 0 AND {condition}
+        """ for index, condition in enumerate(ranges, start=-1))).fetchall()
+        dead_stock = [dict(row) for row in conn.execute(f"""
+            SELECT id, sku, name, product_type, stock, cost, ROUND(stock * cost, 2) as total_value,
+                   last_moved_at, last_sold_at,
+                   CAST(julianday('now') - julianday(COALESCE(last_moved_at, purchase_date, created_at)) AS INTEGER) as idle_days
+            FROM (SELECT * FROM products WHERE stock > 0 AND {ranges[0]}
+                  UNION ALL
+                  SELECT * FROM products WHERE stock > 0 AND {ranges[-1]})
+            ORDER BY stock * cost DESC
+            LIMIT ?
+        """, (dead_stock_limit,)).fetchall()]
+    totals = {row['bucket']: row for row in rows}
+    report = []
+    for index, label in list(enumerate(labels)) + [(-1, 'never')]:
+        row = totals.get(index)
+        report.append({
+            'bucket': label,
+            'min_days': lows[index] if index >= 0 else None,
+            'max_days': boundaries[index] if 0 <= index < len(boundaries) else None,
+            'product_count': row['product_count'] if row else 0,
+            'total_stock': row['total_stock'] if row else 0,
+            'total_value': row['total_value'] if row else 0
+        })
+    return {
+        'buckets': report,
+        'total_value': round(sum(bucket['total_value'] for bucket in report), 2),
+        'dead_stock_days': boundaries[-1],
+        'dead_stock': dead_stock
+    }
+
+def get_inventory_kpis():
+    """
+    Gets the dashboard inventory KPIs in one aggregate query: total stock, number of
+    products below their minimum stock (counted from the low-stock partial index)
+    and total inventory value.
+    """
+    with connection() as conn:
+        row = conn.execute("""
+            SELECT 
+                COALESCE(SUM(stock), 0) as total_stock_items,
+                (SELECT COUNT(*) FROM products WHERE stock < min_stock) as stock_alerts_count,
+                ROUND(COALESCE(SUM(stock * cost), 0), 2) as total_inventory_value
+            FROM products
+        """).fetchone()
+    return dict(row)
+
 def get_inventory_valuation_by_category():
     """Gets inventory valuation by category (product_type)."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT 
-            product_type, 
-            COUNT(*) as product_count,
-            SUM(stock * cost) as total_value,
-            SUM(stock) as total_quantity
-        FROM products
-        GROUP BY product_type
-        ORDER BY total_value DESC
-    """)
-    valuation = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+    with connection() as conn:
+        cursor = conn.execute("""
+            SELECT 
+                product_type, 
+                COUNT(*) as product_count,
+                SUM(stock * cost) as total_value,
+                SUM(stock) as total_quantity
+            FROM products
+            GROUP BY product_type
+            ORDER BY total_value DESC
+        """)
+        valuation = [dict(row) for row in cursor.fetchall()]
     return valuation
 
-def get_financial_metrics_current_month():
-    """Gets financial metrics for the current month."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Sales for the month
-    cursor.execute("""
-        SELECT 
-            COUNT(*) as sales_count,
-            SUM(total_amount) as total_sales,
-            AVG(total_amount) as avg_ticket
-        FROM sales
-        WHERE strftime('%Y-%m', date) = strftime('%Y-%m', 'now')
-    """)
-    sales_metrics = dict(cursor.fetchone() or {})
-    
-    # Revenue for the month
-    cursor.execute("""
-        SELECT SUM(amount) as total_revenue
-        FROM revenue
-        WHERE strftime('%Y-%m', date) = strftime('%Y-%m', 'now')
-    """)
-    revenue_result = cursor.fetchone()
-    total_revenue = revenue_result['total_revenue'] if revenue_result and revenue_result['total_revenue'] else 0
-    
-    # Costs for the month
-    cursor.execute("""
-        SELECT SUM(amount) as total_costs
-        FROM costs
-        WHERE strftime('%Y-%m', date) = strftime('%Y-%m', 'now')
-    """)
-    costs_result = cursor.fetchone()
-    total_costs = costs_result['total_costs'] if costs_result and costs_result['total_costs'] else 0
+def get_financial_metrics(period='month', start=None, end=None):
+    """
+    Gets financial metrics (sales, revenue, costs, profit) for a period.
+    period can be: 'day', 'week', 'month', 'year'; start/end select an arbitrary
+    [start, end) range at day granularity. Reads the daily rollups.
+    """
+    where, params = _date_range_clause('day', *_day_bounds(*_period_bounds(period, start, end)))
+    with connection() as conn:
+        cursor = conn.cursor()
+        
+        # Sales for the period
+        cursor.execute(f"""
+            SELECT 
+                SUM(entry_count) as sales_count,
+                SUM(total_amount) as total_sales
+            FROM daily_sales
+            WHERE {where}
+        """, params)
+        sales_metrics = dict(cursor.fetchone() or {})
+        sales_count = sales_metrics.get('sales_count') or 0
+        if sales_count:
+            sales_metrics['avg_ticket'] = (sales_metrics['total_sales'] or 0) / sales_count
+        
+        # Revenue for the period
+        cursor.execute(f"""
+            SELECT SUM(total_amount) as total_revenue
+            FROM daily_revenue
+            WHERE {where}
+        """, params)
+        revenue_result = cursor.fetchone()
+        total_revenue = revenue_result['total_revenue'] if revenue_result and revenue_result['total_revenue'] else 0
+        
+        # Costs for the period
+        cursor.execute(f"""
+            SELECT SUM(total_amount) as total_costs
+            FROM daily_costs
+            WHERE {where}
+        """, params)
+        costs_result = cursor.fetchone()
+        total_costs = costs_result['total_costs'] if costs_result and costs_result['total_costs'] else 0
     
     # Calculate profit margin
     profit = total_revenue - total_costs
     profit_margin = (profit / total_revenue * 100) if total_revenue > 0 else 0
     
-    conn.close()
-    
     return {
         'sales_count': sales_metrics.get('sales_count', 0) or 0,
         'total_sales': sales_metrics.get('total_sales', 0) or 0,
@@ -1055,4 +3239,38 @@ def get_financial_metrics_current_month():
         'total_costs': total_costs,
         'profit': profit,
         'profit_margin': round(profit_margin, 2)
-    }
\ No newline at end of file
+    }
+
+_bi_dashboard_cache = None
+_bi_dashboard_lock = threading.Lock()
+
+def get_bi_dashboard():
+    """
+    Gets the whole BI dashboard bundle (top products, cost breakdown, products without
+    movement, inventory valuation, current month metrics) from one read snapshot, so all
+    the numbers describe the same state. The bundle is cached until the next write
+    (or the next UTC day, since its windows are relative to today).
+    """
+    global _bi_dashboard_cache
+    # Read the version before the snapshot starts: if a write lands in between, the
+    # bundle is newer than its key and is simply recomputed on the next call
+    key = (get_write_version(), datetime.now(timezone.utc).date())
+    cached = _bi_dashboard_cache
+    if cached and cached[0] == key:
+        return cached[1]
+    with read_snapshot():
+        bundle = {
+            'top_sales': get_top_products_by_sales(5),
+            'top_profitability': get_top_products_by_profitability(5),
+            'cost_breakdown': get_cost_breakdown_by_category(),
+            'products_no_movement': get_products_without_movement(30),
+            'inventory_valuation': get_inventory_valuation_by_category(),
+            'financial_metrics': get_financial_metrics_current_month()
+        }
+    with _bi_dashboard_lock:
+        _bi_dashboard_cache = (key, bundle)
+    return bundle
+
+def get_financial_metrics_current_month():
+    """Gets financial metrics for the current month."""
+    return get_financial_metrics('month')
@@ -1,4 +1,5 @@
 import openpyxl
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font, PatternFill, Alignment
 from openpyxl.utils import get_column_letter
 from datetime import datetime
@@ -27,10 +28,35 @@ def get_export_directory():
         # For Windows/Linux or normal execution, use current directory
         return os.getcwd()
 
+HEADER_FILL = PatternFill(start_color="4285f4", end_color="4285f4", fill_type="solid")
+HEADER_FONT = Font(bold=True, color="FFFFFF")
+
+def _write_only_sheet(wb, title, headers, width, rows):
+    """
+    Adds a write-only sheet: column widths, the styled header row, then `rows`
+    (an iterable, consumed lazily and written straight to disk).
+    """
+    sheet = wb.create_sheet(title)
+    for col in range(1, len(headers) + 1):
+        sheet.column_dimensions[get_column_letter(col)].width = width
+    header_cells = []
+    for header in headers:
+        cell = WriteOnlyCell(sheet, value=header)
+        cell.fill = HEADER_FILL
+        cell.font = HEADER_FONT
+        cell.alignment = Alignment(horizontal="center")
+        header_cells.append(cell)
+    sheet.append(header_cells)
+    for row in rows:
+        sheet.append(row)
+    return sheet
+
 def export_to_excel(filepath=None):
     """
     Exports all database data to an Excel file.
     Creates multiple sheets: Inventory, Sales, Revenue, Costs, BOM
+    The workbook is written in write-only mode from streamed rows, so memory stays
+    flat however many rows are exported; all sheets come from one read snapshot.
     """
     if filepath is None:
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -43,144 +69,33 @@ def export_to_excel(filepath=None):
             export_dir = get_export_directory()
             filepath = os.path.join(export_dir, os.path.basename(filepath))
     
-    wb = openpyxl.Workbook()
-    
-    # Remove default sheet
-    if 'Sheet' in wb.sheetnames:
-        wb.remove(wb['Sheet'])
-    
-    # 1. Inventory Sheet
-    sheet_inventory = wb.create_sheet("Inventory")
-    products = database.get_all_products()
-    
-    headers_inv = ['ID', 'SKU', 'Name', 'Type', 'Stock', 'Min Stock', 'Unit Cost', 
-                   'Supplier', 'Purchase Date', 'Exit Date', 'Total Value']
-    sheet_inventory.append(headers_inv)
-    
-    # Header style
-    header_fill = PatternFill(start_color="4285f4", end_color="4285f4", fill_type="solid")
-    header_font = Font(bold=True, color="FFFFFF")
-    
-    for cell in sheet_inventory[1]:
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = Alignment(horizontal="center")
-    
-    for p in products:
-        total_value = p['stock'] * (p['cost'] or 0)
-        sheet_inventory.append([
-            p['id'],
-            p.get('sku', '') or '',
-            p['name'],
-            p['product_type'],
-            p['stock'],
-            p['min_stock'],
-            p['cost'] or 0,
-            p['supplier'] or '',
-            p['purchase_date'] or '',
-            p['exit_date'] or '',
-            total_value
-        ])
-    
-    # Adjust column width
-    for col in range(1, len(headers_inv) + 1):
-        sheet_inventory.column_dimensions[get_column_letter(col)].width = 15
-    
-    # 2. Sales Sheet
-    sheet_sales = wb.create_sheet("Sales")
-    sales = database.get_all_sales()
-    
-    headers_sales = ['ID', 'Product', 'Quantity', 'Unit Price', 'Total', 'Date']
-    sheet_sales.append(headers_sales)
+    # Write-only workbooks start without sheets
+    wb = openpyxl.Workbook(write_only=True)
     
-    for cell in sheet_sales[1]:
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = Alignment(horizontal="center")
-    
-    for s in sales:
-        sheet_sales.append([
-            s['id'],
-            s['product_name'],
-            s['quantity'],
-            s['unit_price'],
-            s['total_amount'],
-            s['date']
-        ])
-    
-    for col in range(1, len(headers_sales) + 1):
-        sheet_sales.column_dimensions[get_column_letter(col)].width = 18
-    
-    # 3. Revenue Sheet
-    sheet_revenue = wb.create_sheet("Revenue")
-    revenue = database.get_all_revenue()
-    
-    headers_revenue = ['ID', 'Description', 'Amount', 'Date']
-    sheet_revenue.append(headers_revenue)
-    
-    for cell in sheet_revenue[1]:
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = Alignment(horizontal="center")
-    
-    for r in revenue:
-        sheet_revenue.append([
-            r['id'],
-            r['description'],
-            r['amount'],
-            r['date']
-        ])
-    
-    for col in range(1, len(headers_revenue) + 1):
-        sheet_revenue.column_dimensions[get_column_letter(col)].width = 20
-    
-    # 4. Costs Sheet
-    sheet_costs = wb.create_sheet("Costs")
-    costs = database.get_all_costs()
-    
-    headers_costs = ['ID', 'Description', 'Amount', 'Category', 'Date']
-    sheet_costs.append(headers_costs)
-    
-    for cell in sheet_costs[1]:
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = Alignment(horizontal="center")
-    
-    for c in costs:
-        sheet_costs.append([
-            c['id'],
-            c['description'],
-            c['amount'],
-            c.get('category', 'Others'),
-            c['date']
-        ])
-    
-    for col in range(1, len(headers_costs) + 1):
-        sheet_costs.column_dimensions[get_column_letter(col)].width = 20
-    
-    # 5. BOM Sheet
-    sheet_bom = wb.create_sheet("BOM")
-    products = database.get_all_products()
-    
-    headers_bom = ['Parent Product', 'Child Component', 'Quantity']
-    sheet_bom.append(headers_bom)
-    
-    for cell in sheet_bom[1]:
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = Alignment(horizontal="center")
-    
-    for p in products:
-        bom_items = database.get_bom_for_product(p['id'])
-        for bom in bom_items:
-            sheet_bom.append([
-                p['name'],
-                bom['child_product_name'],
-                bom['quantity']
-            ])
-    
-    for col in range(1, len(headers_bom) + 1):
-        sheet_bom.column_dimensions[get_column_letter(col)].width = 25
+    with database.read_snapshot():
+        # 1. Inventory Sheet
+        _write_only_sheet(wb, "Inventory", ['ID', 'SKU', 'Name', 'Type', 'Stock', 'Min Stock', 'Unit Cost',
+                                            'Supplier', 'Purchase Date', 'Exit Date', 'Total Value'],
+                          15, database.iter_products())
+        
+        # 2. Sales Sheet
+        _write_only_sheet(wb, "Sales", ['ID', 'Product', 'Quantity', 'Unit Price', 'Total', 'Date'],
+                          18, database.iter_sales())
+        
+        # 3. Revenue Sheet
+        _write_only_sheet(wb, "Revenue", ['ID', 'Description', 'Amount', 'Date'], 20, database.iter_revenue())
+        
+        # 4. Costs Sheet
+        _write_only_sheet(wb, "Costs", ['ID', 'Description', 'Amount', 'Category', 'Date'], 20, database.iter_costs())
+        
+        # 5. BOM Sheet (whole multi-level BOM in one query, top level first)
+        bom_rows = (
+            [bom['level'], bom['parent_sku'] or '', bom['parent_product_name'],
+             bom['child_sku'] or '', bom['child_product_name'], bom['quantity']]
+            for bom in database.get_full_bom()
+        )
+        _write_only_sheet(wb, "BOM", ['Level', 'Parent SKU', 'Parent Product', 'Child SKU', 'Child Component',
+                                      'Quantity'], 25, bom_rows)
     
     # Save file
     wb.save(filepath)
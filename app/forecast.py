@@ -0,0 +1,166 @@
+import json
+import threading
+from datetime import datetime, timedelta, timezone
+import numpy as np
+from app import database
+
+"""
+Per-product demand forecasting from the daily sales rollup (daily_product_sales).
+
+The whole history is loaded in one query into a products x days matrix and every
+model is fitted for all products at once: the only Python loop runs over days, each
+step updating every product (and every candidate smoothing factor) together.
+Two models compete per product on in-sample one-step error:
+  - simple exponential smoothing (SES), smoothing factor picked from SES_ALPHAS
+  - weekly seasonal naive (next Monday sells like last Monday)
+The fitted state is cached until sales change (or the day rolls over); product names
+are read per call, so editing products or moving stock does not refit.
+"""
+
+HISTORY_DAYS = 3 * 365
+SEASON_LENGTH = 7
+SES_ALPHAS = np.array([0.05, 0.1, 0.2, 0.3, 0.5, 0.8])
+Z_SCORES = {0.8: 1.2816, 0.9: 1.6449, 0.95: 1.96, 0.99: 2.5758}
+
+_fit_cache = None
+_fit_lock = threading.Lock()
+
+def _load_history(start, end):
+    """Returns (product ids, products x days quantity matrix) for [start, end)."""
+    with database.connection() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = None  # plain tuples: much faster to turn into an array
+        cursor.execute("""
+            SELECT product_id, CAST(julianday(day) - julianday(?) AS INTEGER), quantity
+            FROM daily_product_sales
+            WHERE day >= ? AND day < ? AND product_id != 0
+        """, (start.isoformat(), start.isoformat(), end.isoformat()))
+        rows = np.array(cursor.fetchall(), dtype=float).reshape(-1, 3)
+    days = (end - start).days
+    product_ids, rows_index = np.unique(rows[:, 0].astype(np.int64), return_inverse=True)
+    series = np.zeros((len(product_ids), days))
+    np.add.at(series, (rows_index, rows[:, 1].astype(np.int64)), rows[:, 2])
+    return product_ids, series
+
+def _fit(series):
+    """
+    Fits SES (for every alpha) and seasonal naive to every row of `series` at once.
+    Each product's history starts at its first sale. Returns a dict of per-product arrays.
+    """
+    products, days = series.shape
+    first_sale = np.where(series.any(axis=1), (series != 0).argmax(axis=1), days)
+
+    # SES: levels[a, p] after each day, one-step errors accumulated from the day after the first sale
+    levels = np.zeros((len(SES_ALPHAS), products))
+    ses_abs = np.zeros((len(SES_ALPHAS), products))
+    ses_sq = np.zeros((len(SES_ALPHAS), products))
+    alphas = SES_ALPHAS[:, None]
+    for day in range(days):
+        observed = series[:, day]
+        started = day > first_sale
+        error = np.where(started, observed - levels, 0.0)
+        ses_abs += np.abs(error)
+        ses_sq += error * error
+        levels = np.where(day == first_sale, observed, np.where(started, levels + alphas * error, levels))
+
+    fitted_days = np.maximum(days - 1 - first_sale, 0)
+    best = ses_abs.argmin(axis=0)
+    columns = np.arange(products)
+    ses_mae = ses_abs[best, columns] / np.maximum(fitted_days, 1)
+    ses_sigma = np.sqrt(ses_sq[best, columns] / np.maximum(fitted_days, 1))
+
+    # Seasonal naive: error of "same weekday last week", from one season after the first sale
+    seasonal_error = series[:, SEASON_LENGTH:] - series[:, :-SEASON_LENGTH]
+    seasonal_started = np.arange(SEASON_LENGTH, days)[None, :] >= (first_sale + SEASON_LENGTH)[:, None]
+    seasonal_error = np.where(seasonal_started, seasonal_error, 0.0)
+    seasonal_days = np.maximum(days - SEASON_LENGTH - first_sale, 0)
+    seasonal_mae = np.abs(seasonal_error).sum(axis=1) / np.maximum(seasonal_days, 1)
+    seasonal_sigma = np.sqrt((seasonal_error ** 2).sum(axis=1) / np.maximum(seasonal_days, 1))
+
+    # Seasonal naive needs at least two full seasons of history to be judged fairly
+    use_seasonal = (seasonal_days >= 2 * SEASON_LENGTH) & (seasonal_mae < ses_mae)
+    return {
+        'use_seasonal': use_seasonal,
+        'alpha': SES_ALPHAS[best],
+        'level': levels[best, columns],
+        'last_season': series[:, -SEASON_LENGTH:],
+        'sigma': np.where(use_seasonal, seasonal_sigma, ses_sigma),
+        'history_days': days - first_sale
+    }
+
+def _get_fit():
+    """Returns the cached (product ids, fit), refitting when sales changed or the day rolled over."""
+    global _fit_cache
+    today = datetime.now(timezone.utc).date()
+    # Full days only: today's partial sales would drag every forecast down
+    key = (database.get_table_versions(('daily_product_sales',)), today)
+    cached = _fit_cache
+    if cached and cached[0] == key:
+        return cached[1]
+    with _fit_lock:
+        cached = _fit_cache
+        if cached and cached[0] == key:
+            return cached[1]
+        product_ids, series = _load_history(today - timedelta(days=HISTORY_DAYS), today)
+        fit = _fit(series) if len(product_ids) else None
+        result = (product_ids, fit)
+        _fit_cache = (key, result)
+        return result
+
+def forecast_demand(horizon_days=30, product_ids=None, confidence=0.95, include_daily=False):
+    """
+    Forecasts the demand of the next horizon_days (starting today, UTC) for every product
+    with sales history (or only product_ids). Each entry has the model used, the total
+    forecast with a [lower, upper] interval at the given confidence (0.8, 0.9, 0.95 or
+    0.99), and the daily forecasts when include_daily is set. Largest demand first.
+    Intervals treat daily errors as independent, so they are an approximation.
+    """
+    horizon_days = max(1, int(horizon_days))
+    if confidence not in Z_SCORES:
+        raise ValueError(f"Unsupported confidence {confidence}. Use one of: {', '.join(map(str, Z_SCORES))}")
+    ids, fit = _get_fit()
+    if fit is None:
+        return []
+    rows = np.arange(len(ids))
+    if product_ids is not None:
+        rows = rows[np.isin(ids, np.asarray(list(product_ids), dtype=np.int64))]
+    with database.connection() as conn:
+        names = dict(conn.execute("SELECT id, name FROM products WHERE id IN (SELECT value FROM json_each(?))",
+                                  (json.dumps(ids[rows].tolist()),)).fetchall())
+    rows = rows[np.isin(ids[rows], list(names))]  # skip deleted products
+
+    steps = np.arange(horizon_days)
+    # Seasonal naive repeats the last week; today is the day after the last column
+    seasonal = fit['last_season'][rows][:, steps % SEASON_LENGTH]
+    ses = np.repeat(fit['level'][rows][:, None], horizon_days, axis=1)
+    use_seasonal = fit['use_seasonal'][rows]
+    daily = np.maximum(np.where(use_seasonal[:, None], seasonal, ses), 0.0)
+
+    # Variance of the h-step error: SES grows by alpha^2 per step, seasonal naive per season
+    alpha = fit['alpha'][rows][:, None]
+    ses_growth = 1 + steps[None, :] * alpha ** 2
+    seasonal_growth = np.broadcast_to(1 + steps // SEASON_LENGTH, ses_growth.shape)
+    growth = np.where(use_seasonal[:, None], seasonal_growth, ses_growth)
+    sigma = fit['sigma'][rows]
+    total = daily.sum(axis=1)
+    spread = Z_SCORES[confidence] * sigma * np.sqrt(growth.sum(axis=1))
+
+    forecasts = []
+    for index, row in enumerate(rows):
+        product_id = int(ids[row])
+        entry = {
+            'product_id': product_id,
+            'product_name': names.get(product_id),
+            'model': 'seasonal_naive' if use_seasonal[index] else 'ses',
+            'alpha': None if use_seasonal[index] else float(fit['alpha'][row]),
+            'history_days': int(fit['history_days'][row]),
+            'horizon_days': horizon_days,
+            'forecast': float(total[index]),
+            'lower': float(max(total[index] - spread[index], 0.0)),
+            'upper': float(total[index] + spread[index])
+        }
+        if include_daily:
+            entry['daily'] = daily[index].tolist()
+        forecasts.append(entry)
+    forecasts.sort(key=lambda entry: entry['forecast'], reverse=True)
+    return forecasts
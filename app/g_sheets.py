@@ -70,19 +70,10 @@ def export_all_data():
         # 2. Exportar BOM (Lista de Materiales)
         bom_sheet = workbook.worksheet('BOM') # Asume hoja 'BOM'
         
-        # Necesitamos los nombres, no solo los IDs
-        all_products = {p['id']: p['name'] for p in products_data}
-        conn = database.get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT parent_product_id, child_product_id, quantity FROM bill_of_materials")
-        bom_data = cursor.fetchall()
-        conn.close()
-
+        # Necesitamos los nombres, no solo los IDs (una sola consulta con padre e hijo)
         export_data_bom = [['Producto Padre (Nombre)', 'Insumo Hijo (Nombre)', 'Cantidad']]
-        for bom_entry in bom_data:
-            parent_name = all_products.get(bom_entry['parent_product_id'], 'ID Desconocido')
-            child_name = all_products.get(bom_entry['child_product_id'], 'ID Desconocido')
-            export_data_bom.append([parent_name, child_name, bom_entry['quantity']])
+        for bom_entry in database.get_full_bom():
+            export_data_bom.append([bom_entry['parent_product_name'], bom_entry['child_product_name'], bom_entry['quantity']])
         
         bom_sheet.clear()
         bom_sheet.update(export_data_bom, 'A1')
@@ -105,7 +96,9 @@ def export_all_data():
 def import_all_data():
     """
     Importa datos desde Google Sheets a la base de datos local.
-    Esta es una operación destructiva (borra y reemplaza).
+    Los productos se actualizan o insertan por nombre (no se borran): los IDs, el BOM
+    y las ventas existentes se conservan, y una celda vacía no sobrescribe el valor guardado.
+    La tabla BOM sí se reemplaza con la de la hoja.
     """
     gc = get_gspread_client()
     if not gc:
@@ -119,28 +112,30 @@ def import_all_data():
         # get_all_records() convierte la hoja en una lista de diccionarios
         products_from_sheet = products_sheet.get_all_records()
         
-        conn = database.get_db_connection()
-        cursor = conn.cursor()
-        
-        # Limpiar la tabla local primero
-        cursor.execute("DELETE FROM products")
-        print("Tabla 'products' local limpiada.")
-
-        # Insertar los nuevos datos
+        # Actualizar o insertar por nombre (sin borrar la tabla), para que los IDs,
+        # el BOM y el historial de ventas de los productos existentes se conserven
         # ¡ACTUALIZADO! Añadido 'Costo'
-        for p in products_from_sheet:
-            cursor.execute(
-                "INSERT INTO products (name, product_type, stock, min_stock, cost) VALUES (?, ?, ?, ?, ?)",
-                (p['Nombre'], p['Tipo'], p['Stock'], p['Min_Stock'], p.get('Costo', 0)) # Usar .get() para retrocompatibilidad
-            )
-        conn.commit()
-        print(f"Importados {len(products_from_sheet)} productos desde Google Sheets.")
+        records = (
+            {
+                'name': p['Nombre'],
+                'product_type': p['Tipo'],
+                'stock': p['Stock'],
+                'min_stock': p['Min_Stock'],
+                'cost': p.get('Costo')  # Sin columna 'Costo' se conserva el costo guardado
+            }
+            for p in products_from_sheet
+        )
+        result = database.upsert_products(records, ('name', 'product_type', 'stock', 'min_stock', 'cost'))
+        print(f"Importados {len(products_from_sheet)} productos desde Google Sheets: {result['message']}")
         time.sleep(1)
 
         # 2. Importar BOM
         # (Esto debe hacerse DESPUÉS de importar productos para tener los IDs)
         
-        # Crear un mapa de Nombre -> ID de los productos que acabamos de insertar
+        conn = database.get_db_connection()
+        cursor = conn.cursor()
+
+        # Crear un mapa de Nombre -> ID de los productos que acabamos de importar
         cursor.execute("SELECT id, name FROM products")
         product_name_to_id = {row['name']: row['id'] for row in cursor.fetchall()}
 
@@ -164,10 +159,14 @@ def import_all_data():
                 print(f"Error al importar BOM: No se encontró el producto '{bom_entry['Producto Padre (Nombre)']}' o '{bom_entry['Insumo Hijo (Nombre)']}'")
         
         conn.commit()
+        database.mark_written(('bill_of_materials',))
         print(f"Importadas {len(bom_from_sheet)} entradas de BOM desde Google Sheets.")
         
         conn.close()
 
+        # Recalcular los costos de BOM acumulados con la nueva estructura
+        database.rebuild_bom_cost_cache()
+
         # 3. Importar Finanzas (Revenue y Costs)
         # ... (Lógica similar) ...
 
@@ -1,5 +1,6 @@
 import webview
 import threading
+import json
 import time
 import os
 import sys
@@ -7,6 +8,8 @@ import subprocess
 import platform
 from app import database
 from app import excel_export
+from app import forecast
+from app.cache import response_cache
 
 """
 This is the main file that launches the application.
@@ -14,18 +17,111 @@ Uses 'pywebview' to create a native desktop window
 that loads the frontend from the 'app/ui/' folder.
 """
 
+# Background jobs mark their thread so the event bus can tell their writes apart
+# from the ones the page made itself (and already refreshes after).
+_job_local = threading.local()
+
+class EventBus:
+    """
+    Push channel from Python to the page.
+    Database writes (via database.add_write_listener) and background jobs publish here
+    from any thread; events are coalesced and delivered as one JSON batch per frame
+    interval, dispatched in the page as a CustomEvent named 'erp:events'.
+    A burst of writes (e.g. a large bulk sale) becomes a single 'changes' entry.
+    """
+    FRAME_INTERVAL = 1 / 30  # seconds between dispatches
+
+    def __init__(self, frame_interval=FRAME_INTERVAL):
+        self.frame_interval = frame_interval
+        self._window = None
+        self._lock = threading.Lock()
+        self._timer = None
+        self._events = []
+        self._tables = set()
+        self._background_tables = set()
+        self._writes = 0
+        database.add_write_listener(self._on_write)
+
+    def attach(self, window):
+        self._window = window
+
+    def publish(self, event_type, **payload):
+        """Queues an event ({'type': event_type, **payload}) for the next dispatch."""
+        with self._lock:
+            self._events.append(dict(payload, type=event_type))
+            self._schedule()
+
+    def notify(self, message):
+        """Shows a notification in the page."""
+        self.publish('notification', message=message)
+
+    def _on_write(self, tables):
+        with self._lock:
+            self._tables.update(tables)
+            if getattr(_job_local, 'active', False):
+                self._background_tables.update(tables)
+            self._writes += 1
+            self._schedule()
+
+    def _schedule(self):
+        # Called with the lock held: one pending flush at a time
+        if self._timer is None:
+            self._timer = threading.Timer(self.frame_interval, self._flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _flush(self):
+        with self._lock:
+            self._timer = None
+            batch = {'events': self._events}
+            if self._writes:
+                batch['changes'] = {
+                    'tables': sorted(self._tables),
+                    'background_tables': sorted(self._background_tables),
+                    'writes': self._writes
+                }
+            self._events = []
+            self._tables = set()
+            self._background_tables = set()
+            self._writes = 0
+        if not self._window:
+            return
+        try:
+            self._window.evaluate_js(
+                f"window.dispatchEvent(new CustomEvent('erp:events', {{detail: {json.dumps(batch, default=str)}}}))"
+            )
+        except Exception as e:
+            print(f"Error dispatching events: {e}")
+
+    def close(self):
+        database.remove_write_listener(self._on_write)
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+
 # The API_BINDING is an object that allows JavaScript
 # to call Python functions.
 class Api:
-    def __init__(self):
+    def __init__(self, events=None):
         self._window = None
         self._last_excel_file = None
+        self._events = events or EventBus()
 
     def set_window(self, window):
         self._window = window
+        self._events.attach(window)
+
+    def _run_in_background(self, job):
+        """Runs job on a new thread; its writes are reported to the page as background changes."""
+        def _run():
+            _job_local.active = True
+            job()
+        threading.Thread(target=_run).start()
 
     # --- Inventory API ---
 
+    @response_cache.cached(tables=('products',))
     def load_products(self):
         """
         Called from JS when loading the page.
@@ -38,6 +134,28 @@ class Api:
         except Exception as e:
             return {'success': False, 'message': str(e)}
 
+    @response_cache.cached(tables=('products',))
+    def search_products(self, query, limit=20):
+        """Searches products by name, SKU or supplier (prefix matching, ranked)."""
+        print(f"[Python] search_products() called with: {query}")
+        try:
+            return {'success': True, 'data': database.search_products(query, limit)}
+        except Exception as e:
+            return {'success': False, 'message': str(e)}
+
+    @response_cache.cached(tables=('products',))
+    def load_products_page(self, search=None, product_type=None, sort='name', descending=False, limit=50, cursor=None, include_total=False):
+        """
+        Returns one screen of products, filtered and sorted in SQL.
+        Pass data['next_cursor'] back as 'cursor' to load the next page.
+        """
+        print(f"[Python] load_products_page() called with search: {search}, type: {product_type}, sort: {sort}")
+        try:
+            page = database.get_products_page(search, product_type, sort, descending, limit, cursor, include_total)
+            return {'success': True, 'data': page}
+        except Exception as e:
+            return {'success': False, 'message': str(e)}
+
     def add_product(self, name, product_type, stock, min_stock, cost, supplier=None, purchase_date=None, exit_date=None, sku=None, weight=0, stock_unit_type='units', additional_cost=0):
         """
         Called from JS when the user submits the form.
@@ -84,6 +202,43 @@ class Api:
             return {'success': False, 'message': str(e)}
 
 
+    def import_products_csv(self, filepath=None):
+        """
+        Imports/updates products from a CSV file in the background.
+        If filepath is not provided, asks the user to pick the file.
+        """
+        if filepath is None:
+            if not self._window:
+                return {'success': False, 'message': 'No file selected'}
+            selection = self._window.create_file_dialog(webview.OPEN_DIALOG, file_types=('CSV files (*.csv)',))
+            if not selection:
+                return {'success': False, 'message': 'No file selected'}
+            filepath = selection[0]
+        print(f"[Python] import_products_csv() called with: {filepath}")
+
+        processed_rows = [0]
+
+        def _progress(processed):
+            print(f"[Python] Product import: {processed} rows processed")
+            processed_rows[0] = processed
+            self._events.publish('import_progress', processed=processed, done=False)
+
+        def _import():
+            try:
+                result = database.import_products_csv(filepath, progress_callback=_progress)
+                print(f"[Python] Import completed: {result['message']}")
+                self._events.notify(result['message'])
+            except Exception as e:
+                print(f"Error importing products: {e}")
+                self._events.notify(f'Error importing products: {e}')
+            finally:
+                # Lets the page hide its progress indicator, whatever the outcome
+                self._events.publish('import_progress', processed=processed_rows[0], done=True)
+
+        self._run_in_background(_import)
+        return {'success': True, 'message': 'Import started...'}
+
+    @response_cache.cached(tables=('products',))
     def get_products_by_type(self, product_type):
         """Gets products filtered by type (for populating dropdowns)."""
         print(f"[Python] get_products_by_type({product_type}) called")
@@ -95,6 +250,7 @@ class Api:
 
     # --- BOM (Bill of Materials) API ---
 
+    @response_cache.cached(tables=('bill_of_materials', 'products'))
     def get_bom(self, parent_product_id):
         """Gets the bill of materials for a product."""
         print(f"[Python] get_bom({parent_product_id}) called")
@@ -122,6 +278,19 @@ class Api:
         except Exception as e:
             return {'success': False, 'message': str(e)}
     
+    @response_cache.cached(tables=('bill_of_materials', 'products'))
+    def explode_bom(self, product_id, quantity=1):
+        """Gets the gross leaf-component requirements of the full multi-level BOM."""
+        print(f"[Python] explode_bom() called for product ID {product_id}, quantity: {quantity}")
+        try:
+            result = database.explode_bom(product_id, float(quantity))
+            if result:
+                return {'success': True, 'data': result}
+            return {'success': False, 'message': 'Product not found'}
+        except Exception as e:
+            return {'success': False, 'message': str(e)}
+    
+    @response_cache.cached(tables=('bill_of_materials', 'products'))
     def calculate_mrp_production(self, product_id):
         """Calculates how many products can be manufactured based on BOM and inventory."""
         print(f"[Python] calculate_mrp_production() called for product ID {product_id}")
@@ -133,6 +302,15 @@ class Api:
         except Exception as e:
             return {'success': False, 'message': str(e)}
     
+    @response_cache.cached(tables=('bill_of_materials', 'products'))
+    def calculate_mrp_catalog(self, product_type=None):
+        """Calculates buildable quantities for the whole catalog in one pass."""
+        print(f"[Python] calculate_mrp_catalog() called (type: {product_type})")
+        try:
+            return {'success': True, 'data': database.calculate_mrp_catalog(product_type)}
+        except Exception as e:
+            return {'success': False, 'message': str(e)}
+
     def execute_production(self, product_id, quantity):
         """Executes production: reduces components and increases final product."""
         print(f"[Python] execute_production() called for product ID {product_id}, quantity: {quantity}")
@@ -141,7 +319,25 @@ class Api:
             return result
         except Exception as e:
             return {'success': False, 'message': str(e)}
+
+    def execute_production_batch(self, orders, stop_on_error=False):
+        """Executes a queue of production orders in one transaction."""
+        print(f"[Python] execute_production_batch() called with {len(orders)} orders")
+        try:
+            return database.execute_production_batch(orders, stop_on_error)
+        except Exception as e:
+            return {'success': False, 'message': str(e)}
+
+    @response_cache.cached(tables=('production_orders',))
+    def get_production_orders(self, product_id=None, status=None, limit=50, cursor=None):
+        """Gets one page of the production order log."""
+        print(f"[Python] get_production_orders() called (product: {product_id}, status: {status})")
+        try:
+            return {'success': True, 'data': database.get_production_orders(product_id, status, limit=limit, cursor=cursor)}
+        except Exception as e:
+            return {'success': False, 'message': str(e)}
     
+    @response_cache.cached(tables=('bom_cost_cache', 'bill_of_materials', 'products'))
     def calculate_bom_cost(self, product_id):
         """Calculates unit cost based on BOM."""
         print(f"[Python] calculate_bom_cost() called for product ID {product_id}")
@@ -153,6 +349,27 @@ class Api:
         except Exception as e:
             return {'success': False, 'message': str(e)}
 
+    @response_cache.cached(tables=('bom_cost_cache',))
+    def get_calculated_cost(self, product_id):
+        """Returns the cached rolled-up unit cost of a product."""
+        print(f"[Python] get_calculated_cost() called for product ID {product_id}")
+        try:
+            cost = database.get_calculated_cost(product_id)
+            if cost is None:
+                return {'success': False, 'message': 'Product not found'}
+            return {'success': True, 'data': cost}
+        except Exception as e:
+            return {'success': False, 'message': str(e)}
+
+    def rebuild_bom_cost_cache(self):
+        """Recomputes every cached BOM cost."""
+        print("[Python] rebuild_bom_cost_cache() called")
+        try:
+            database.rebuild_bom_cost_cache()
+            return {'success': True, 'message': 'BOM costs rebuilt'}
+        except Exception as e:
+            return {'success': False, 'message': str(e)}
+
     # --- Finance API ---
 
     def add_revenue_entry(self, description, amount, date=None):
@@ -173,6 +390,7 @@ class Api:
         except Exception as e:
             return {'success': False, 'message': str(e)}
 
+    @response_cache.cached(tables=('revenue', 'costs'))
     def get_recent_finances(self):
         """Gets recent finances for the Finance view."""
         print("[Python] get_recent_finances() called")
@@ -183,6 +401,7 @@ class Api:
         except Exception as e:
             return {'success': False, 'message': str(e)}
 
+    @response_cache.cached(tables=('revenue', 'costs'))
     def get_all_finances(self):
         """Gets all finances for editing."""
         print("[Python] get_all_finances() called")
@@ -193,6 +412,26 @@ class Api:
         except Exception as e:
             return {'success': False, 'message': str(e)}
 
+    @response_cache.cached(tables=('revenue',))
+    def get_revenue_page(self, search=None, start=None, end=None, sort='date', descending=True, limit=50, cursor=None, include_total=False):
+        """Returns one page of revenue entries (keyset-paginated, filtered in SQL)."""
+        print(f"[Python] get_revenue_page() called with search: {search}, start: {start}, end: {end}")
+        try:
+            page = database.get_revenue_page(search, start, end, sort, descending, limit, cursor, include_total)
+            return {'success': True, 'data': page}
+        except Exception as e:
+            return {'success': False, 'message': str(e)}
+
+    @response_cache.cached(tables=('costs',))
+    def get_costs_page(self, search=None, category=None, start=None, end=None, sort='date', descending=True, limit=50, cursor=None, include_total=False):
+        """Returns one page of cost entries (keyset-paginated, filtered in SQL)."""
+        print(f"[Python] get_costs_page() called with search: {search}, category: {category}, start: {start}, end: {end}")
+        try:
+            page = database.get_costs_page(search, category, start, end, sort, descending, limit, cursor, include_total)
+            return {'success': True, 'data': page}
+        except Exception as e:
+            return {'success': False, 'message': str(e)}
+
     def update_revenue_entry(self, revenue_id, description, amount, date=None):
         """Updates a revenue entry."""
         print(f"[Python] update_revenue_entry() called for ID {revenue_id}")
@@ -230,35 +469,32 @@ class Api:
             return {'success': False, 'message': str(e)}
 
 
+    def rebuild_rollups(self):
+        """Rebuilds the daily revenue/cost/sales rollups from the raw rows."""
+        print("[Python] rebuild_rollups() called")
+        try:
+            database.rebuild_rollups()
+            return {'success': True, 'message': 'Rollups rebuilt'}
+        except Exception as e:
+            return {'success': False, 'message': str(e)}
+
+
     # --- Dashboard API ---
 
-    def get_kpi_data(self, period='month'):
+    @response_cache.cached(tables=('daily_revenue', 'daily_costs', 'daily_cost_categories', 'daily_sales', 'products'), per_day=True)
+    def get_kpi_data(self, period='month', start=None, end=None):
         """
         This function now calculates all KPIs
         and gets real financial data with support for different periods.
+        start/end optionally restrict the financial history to [start, end).
         """
-        print(f"[Python] get_kpi_data() called with period: {period}")
+        print(f"[Python] get_kpi_data() called with period: {period}, start: {start}, end: {end}")
         try:
             # 1. Get financial data (Real!) with configurable period
-            financial_summary = database.get_financial_summary(period)
+            financial_summary = database.get_financial_summary(period, start, end)
             
-            # 2. Get inventory data and calculate KPIs
-            products = database.get_all_products()
-            total_stock_items = 0
-            stock_alerts_count = 0
-            total_inventory_value = 0
-            
-            for p in products:
-                total_stock_items += p['stock']
-                if p['stock'] < p['min_stock']:
-                    stock_alerts_count += 1
-                total_inventory_value += p['stock'] * p['cost'] # New KPI!
-
-            inventory_kpis = {
-                'total_stock_items': total_stock_items,
-                'stock_alerts_count': stock_alerts_count,
-                'total_inventory_value': round(total_inventory_value, 2) # Round to 2 decimals
-            }
+            # 2. Inventory KPIs, aggregated in SQL
+            inventory_kpis = database.get_inventory_kpis()
 
             return {
                 'success': True,
@@ -283,15 +519,19 @@ class Api:
         except Exception as e:
             return {'success': False, 'message': str(e)}
     
-    def add_multiple_sales(self, sales_list):
-        """Adds multiple sales to the history."""
-        print(f"[Python] add_multiple_sales: {len(sales_list)} sales")
+    def add_multiple_sales(self, sales_list, all_or_nothing=False):
+        """
+        Adds multiple sales to the history.
+        Invalid lines are skipped and listed in 'errors' unless all_or_nothing is set.
+        """
+        print(f"[Python] add_multiple_sales: {len(sales_list)} sales, all_or_nothing: {all_or_nothing}")
         try:
-            result = database.add_multiple_sales(sales_list)
+            result = database.add_multiple_sales(sales_list, bool(all_or_nothing))
             return result
         except Exception as e:
             return {'success': False, 'message': str(e)}
     
+    @response_cache.cached(tables=('sales',))
     def get_all_sales(self):
         """Gets all sales."""
         print("[Python] get_all_sales() called")
@@ -301,6 +541,17 @@ class Api:
         except Exception as e:
             return {'success': False, 'message': str(e)}
     
+    @response_cache.cached(tables=('sales',))
+    def get_sales_page(self, search=None, product_id=None, start=None, end=None, sort='date', descending=True, limit=50, cursor=None, include_total=False):
+        """Returns one page of sales (keyset-paginated, filtered in SQL)."""
+        print(f"[Python] get_sales_page() called with search: {search}, product: {product_id}, start: {start}, end: {end}")
+        try:
+            page = database.get_sales_page(search, product_id, start, end, sort, descending, limit, cursor, include_total)
+            return {'success': True, 'data': page}
+        except Exception as e:
+            return {'success': False, 'message': str(e)}
+    
+    @response_cache.cached(tables=('sales',))
     def get_recent_sales(self, limit=10):
         """Gets the most recent sales."""
         print(f"[Python] get_recent_sales() called with limit: {limit}")
@@ -310,6 +561,7 @@ class Api:
         except Exception as e:
             return {'success': False, 'message': str(e)}
     
+    @response_cache.cached(tables=('sales',))
     def get_sale_by_id(self, sale_id):
         """Gets a sale by its ID."""
         print(f"[Python] get_sale_by_id() called for ID {sale_id}")
@@ -339,17 +591,29 @@ class Api:
         except Exception as e:
             return {'success': False, 'message': str(e)}
     
-    def get_sales_by_period(self, period='month'):
-        """Gets sales filtered by period."""
-        print(f"[Python] get_sales_by_period() called with period: {period}")
+    @response_cache.cached(tables=('sales',), per_day=True)
+    def get_sales_by_period(self, period='month', start=None, end=None):
+        """Gets sales filtered by period, or by an explicit [start, end) date range."""
+        print(f"[Python] get_sales_by_period() called with period: {period}, start: {start}, end: {end}")
         try:
-            sales = database.get_sales_by_period(period)
+            sales = database.get_sales_by_period(period, start, end)
             return {'success': True, 'data': sales}
         except Exception as e:
             return {'success': False, 'message': str(e)}
 
     # --- Business Intelligence API ---
     
+    @response_cache.cached(tables=('product_sales_stats', 'daily_product_sales', 'products'), per_day=True)
+    def get_top_products(self, metric='quantity', limit=5, period=None, start=None, end=None):
+        """Gets the top products by quantity, revenue or profit, all time or for a period."""
+        print(f"[Python] get_top_products() called (metric: {metric}, period: {period or 'all'})")
+        try:
+            products = database.get_top_products(metric, limit, period, start, end)
+            return {'success': True, 'data': products}
+        except Exception as e:
+            return {'success': False, 'message': str(e)}
+    
+    @response_cache.cached(tables=('product_sales_stats', 'products'))
     def get_top_products_by_sales(self, limit=5):
         """Gets the top products by sales."""
         print(f"[Python] get_top_products_by_sales() called with limit: {limit}")
@@ -359,6 +623,7 @@ class Api:
         except Exception as e:
             return {'success': False, 'message': str(e)}
     
+    @response_cache.cached(tables=('product_sales_stats', 'products'))
     def get_top_products_by_profitability(self, limit=5):
         """Gets the top products by profitability."""
         print(f"[Python] get_top_products_by_profitability() called with limit: {limit}")
@@ -368,6 +633,7 @@ class Api:
         except Exception as e:
             return {'success': False, 'message': str(e)}
     
+    @response_cache.cached(tables=('daily_cost_categories',))
     def get_cost_breakdown_by_category(self):
         """Gets the cost breakdown by category."""
         print("[Python] get_cost_breakdown_by_category() called")
@@ -377,6 +643,7 @@ class Api:
         except Exception as e:
             return {'success': False, 'message': str(e)}
     
+    @response_cache.cached(tables=('products',), per_day=True)
     def get_products_without_movement(self, days=30):
         """Gets products without movement."""
         print(f"[Python] get_products_without_movement() called with days: {days}")
@@ -386,6 +653,17 @@ class Api:
         except Exception as e:
             return {'success': False, 'message': str(e)}
     
+    @response_cache.cached(tables=('products',), per_day=True)
+    def get_inventory_aging(self, buckets=None, dead_stock_limit=50):
+        """Gets the inventory aging report (value tied up by days since last movement)."""
+        print("[Python] get_inventory_aging() called")
+        try:
+            aging = database.get_inventory_aging(buckets or database.AGING_BUCKETS, dead_stock_limit)
+            return {'success': True, 'data': aging}
+        except Exception as e:
+            return {'success': False, 'message': str(e)}
+    
+    @response_cache.cached(tables=('products',))
     def get_inventory_valuation_by_category(self):
         """Gets inventory valuation by category."""
         print("[Python] get_inventory_valuation_by_category() called")
@@ -394,7 +672,45 @@ class Api:
             return {'success': True, 'data': valuation}
         except Exception as e:
             return {'success': False, 'message': str(e)}
+
+    @response_cache.cached(tables=('products', 'stock_movements', 'stock_snapshots'))
+    def get_stock_on(self, day, product_id=None):
+        """Gets stock (and its valuation) per product at the end of a day."""
+        print(f"[Python] get_stock_on() called for {day} (product: {product_id})")
+        try:
+            return {'success': True, 'data': database.get_stock_on(day, product_id)}
+        except Exception as e:
+            return {'success': False, 'message': str(e)}
+
+    @response_cache.cached(tables=('products', 'stock_movements', 'stock_snapshots'))
+    def get_inventory_valuation_on(self, day):
+        """Gets inventory valuation by category at the end of a day."""
+        print(f"[Python] get_inventory_valuation_on() called for {day}")
+        try:
+            return {'success': True, 'data': database.get_inventory_valuation_on(day)}
+        except Exception as e:
+            return {'success': False, 'message': str(e)}
+
+    @response_cache.cached(tables=('products', 'stock_movements', 'stock_snapshots'))
+    def get_month_end_inventory(self, year, month):
+        """Gets the month-end inventory report."""
+        print(f"[Python] get_month_end_inventory() called for {year}-{month}")
+        try:
+            return {'success': True, 'data': database.get_month_end_inventory(year, month)}
+        except Exception as e:
+            return {'success': False, 'message': str(e)}
+
+    @response_cache.cached(tables=('stock_movements',))
+    def get_stock_movements(self, product_id=None, reason=None, start=None, end=None, limit=50, cursor=None):
+        """Gets one page of the stock movement ledger."""
+        print(f"[Python] get_stock_movements() called (product: {product_id}, reason: {reason})")
+        try:
+            page = database.get_stock_movements(product_id, reason, start, end, limit=limit, cursor=cursor)
+            return {'success': True, 'data': page}
+        except Exception as e:
+            return {'success': False, 'message': str(e)}
     
+    @response_cache.cached(tables=('daily_revenue', 'daily_costs', 'daily_cost_categories', 'daily_sales'), per_day=True)
     def get_financial_metrics_current_month(self):
         """Gets financial metrics for the current month."""
         print("[Python] get_financial_metrics_current_month() called")
@@ -404,28 +720,58 @@ class Api:
         except Exception as e:
             return {'success': False, 'message': str(e)}
     
+    @response_cache.cached(tables=('daily_revenue', 'daily_costs', 'daily_cost_categories', 'daily_sales'), per_day=True)
+    def get_financial_metrics(self, period='month', start=None, end=None):
+        """Gets financial metrics for a period, or for an explicit [start, end) date range."""
+        print(f"[Python] get_financial_metrics() called with period: {period}, start: {start}, end: {end}")
+        try:
+            metrics = database.get_financial_metrics(period, start, end)
+            return {'success': True, 'data': metrics}
+        except Exception as e:
+            return {'success': False, 'message': str(e)}
+    
     def get_bi_dashboard_data(self):
         """Gets all data for the BI dashboard."""
         print("[Python] get_bi_dashboard_data() called")
         try:
-            top_sales = database.get_top_products_by_sales(5)
-            top_profit = database.get_top_products_by_profitability(5)
-            cost_breakdown = database.get_cost_breakdown_by_category()
-            products_no_movement = database.get_products_without_movement(30)
-            inventory_valuation = database.get_inventory_valuation_by_category()
-            financial_metrics = database.get_financial_metrics_current_month()
-            
-            return {
-                'success': True,
-                'data': {
-                    'top_sales': top_sales,
-                    'top_profitability': top_profit,
-                    'cost_breakdown': cost_breakdown,
-                    'products_no_movement': products_no_movement,
-                    'inventory_valuation': inventory_valuation,
-                    'financial_metrics': financial_metrics
-                }
-            }
+            # One consistent snapshot, cached until the next write
+            return {'success': True, 'data': database.get_bi_dashboard()}
+        except Exception as e:
+            return {'success': False, 'message': str(e)}
+
+    @response_cache.cached(tables=('daily_product_sales', 'products', 'bill_of_materials', 'bom_cost_cache'), per_day=True)
+    def get_reorder_suggestions(self, window_days=30, lead_time_days=7, safety_days=7, cover_days=30, limit=50):
+        """Returns the ranked purchase/production suggestions based on sales velocity."""
+        print(f"[Python] get_reorder_suggestions() called (window: {window_days} days)")
+        try:
+            suggestions = database.get_reorder_suggestions(window_days, lead_time_days, safety_days, cover_days, limit)
+            return {'success': True, 'data': suggestions}
+        except Exception as e:
+            return {'success': False, 'message': str(e)}
+
+    @response_cache.cached(tables=('daily_product_sales', 'products'), per_day=True)
+    def get_demand_forecast(self, horizon_days=30, product_ids=None, confidence=0.95, include_daily=False):
+        """Returns the per-product demand forecast for the next horizon_days."""
+        print(f"[Python] get_demand_forecast() called (horizon: {horizon_days} days)")
+        try:
+            forecasts = forecast.forecast_demand(horizon_days, product_ids, confidence, include_daily)
+            return {'success': True, 'data': forecasts}
+        except Exception as e:
+            return {'success': False, 'message': str(e)}
+
+    def get_changes_since(self, table, token=None):
+        """Returns the rows of a table changed since a sync token (full snapshot without one)."""
+        print(f"[Python] get_changes_since() called for {table} since {token}")
+        try:
+            return {'success': True, 'data': database.get_changes_since(table, token)}
+        except Exception as e:
+            return {'success': False, 'message': str(e)}
+
+    def get_cache_stats(self):
+        """Returns the response cache counters."""
+        print("[Python] get_cache_stats() called")
+        try:
+            return {'success': True, 'data': response_cache.get_stats()}
         except Exception as e:
             return {'success': False, 'message': str(e)}
 
@@ -443,15 +789,12 @@ class Api:
                 abs_path = os.path.abspath(filepath)
                 self._last_excel_file = abs_path
                 print(f"[Python] Export completed: {abs_path}")
-                if self._window:
-                    self._window.evaluate_js(f"showNotification('Export completed: {abs_path}')")
+                self._events.notify(f'Export completed: {abs_path}')
             except Exception as e:
                 print(f"Error exporting: {e}")
-                if self._window:
-                    error_msg = str(e).replace("'", "\\'")
-                    self._window.evaluate_js(f"showNotification('Error exporting: {error_msg}')")
+                self._events.notify(f'Error exporting: {e}')
 
-        threading.Thread(target=_export).start()
+        self._run_in_background(_export)
         return {'success': True, 'message': 'Export started...'}
     
     def export_sales_report(self, period='month'):
@@ -466,15 +809,12 @@ class Api:
                 abs_path = os.path.abspath(filepath)
                 self._last_excel_file = abs_path
                 print(f"[Python] Sales report exported: {abs_path}")
-                if self._window:
-                    self._window.evaluate_js(f"showNotification('Report exported: {abs_path}')")
+                self._events.notify(f'Report exported: {abs_path}')
             except Exception as e:
                 print(f"Error exporting report: {e}")
-                if self._window:
-                    error_msg = str(e).replace("'", "\\'")
-                    self._window.evaluate_js(f"showNotification('Error exporting report: {error_msg}')")
+                self._events.notify(f'Error exporting report: {e}')
 
-        threading.Thread(target=_export).start()
+        self._run_in_background(_export)
         return {'success': True, 'message': 'Report export started...'}
     
     def open_excel_file(self, filepath=None):
@@ -530,6 +870,8 @@ def start_app():
         # Initialize the database on startup
         print("Starting database...")
         database.init_db()
+        database.take_month_end_snapshots()
+        database.prune_sync_tombstones()
         print("Database ready.")
 
         # Detect the correct path for UI files
@@ -579,7 +921,8 @@ def start_app():
         if not html_path.startswith('file://'):
             html_path = f"file://{html_path}"
 
-        api = Api()
+        events = EventBus()
+        api = Api(events)
         window = webview.create_window(
             'OpenERP',
             html_path,  # Loads the main HTML file with corrected path
@@ -591,6 +934,8 @@ def start_app():
         )
         api.set_window(window)
         webview.start(debug=False) # debug=False for production (doesn't open DevTools automatically)
+        events.close()
+        database.close_all_connections()
     except Exception as e:
         import traceback
         error_msg = f"Error starting application:\n{str(e)}\n\n{traceback.format_exc()}"
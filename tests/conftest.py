@@ -0,0 +1,73 @@
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import database
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """A freshly migrated database in a temporary directory."""
+    database.close_all_connections()
+    monkeypatch.setattr(database, 'DB_FILE', str(tmp_path / 'erp.db'))
+    database.init_db()
+    yield database
+    database.close_all_connections()
+
+
+LEGACY_SCHEMA = """
+CREATE TABLE products (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL UNIQUE,
+    product_type TEXT NOT NULL CHECK(product_type IN ('final', 'hijo', 'padre', 'otro')),
+    stock REAL NOT NULL DEFAULT 0,
+    min_stock REAL NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+ALTER TABLE products ADD COLUMN cost REAL NOT NULL DEFAULT 0;
+ALTER TABLE products ADD COLUMN sku TEXT;
+CREATE TABLE bill_of_materials (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    parent_product_id INTEGER NOT NULL,
+    child_product_id INTEGER NOT NULL,
+    quantity REAL NOT NULL DEFAULT 1,
+    FOREIGN KEY (parent_product_id) REFERENCES products(id) ON DELETE CASCADE,
+    FOREIGN KEY (child_product_id) REFERENCES products(id) ON DELETE CASCADE
+);
+CREATE TABLE revenue (id INTEGER PRIMARY KEY AUTOINCREMENT, description TEXT, amount REAL NOT NULL,
+                      date TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE costs (id INTEGER PRIMARY KEY AUTOINCREMENT, description TEXT, amount REAL NOT NULL,
+                    date TIMESTAMP DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE sales (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    product_id INTEGER NOT NULL,
+    product_name TEXT NOT NULL,
+    quantity REAL NOT NULL,
+    unit_price REAL NOT NULL,
+    total_amount REAL NOT NULL,
+    date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (product_id) REFERENCES products(id) ON DELETE SET NULL
+);
+"""
+
+
+@pytest.fixture
+def legacy_db(tmp_path, monkeypatch):
+    """Returns make(sql): writes a database in the pre-migration schema (foreign keys off) plus `sql`."""
+    database.close_all_connections()
+    path = tmp_path / 'erp.db'
+    monkeypatch.setattr(database, 'DB_FILE', str(path))
+
+    def make(sql):
+        conn = sqlite3.connect(path)
+        conn.executescript(LEGACY_SCHEMA + sql)
+        conn.close()
+        return database
+
+    yield make
+    database.close_all_connections()
+
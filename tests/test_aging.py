@@ -0,0 +1,36 @@
+import pytest
+
+
+@pytest.fixture
+def stocked(db):
+    """Products idle for 10, 45, 100 and 400 days, one never moved and one out of stock."""
+    for name, stock, cost in [('Fresh', 1, 1), ('Month', 2, 1), ('Quarter', 3, 1), ('Old', 4, 10),
+                              ('Legacy', 5, 1), ('Empty', 0, 1)]:
+        db.add_product(name, 'hijo', stock, 0, cost)
+    with db.transaction(tables=('products',)) as conn:
+        for product_id, days in [(1, 10), (2, 45), (3, 100), (4, 400), (6, 400)]:
+            conn.execute("UPDATE products SET last_moved_at = datetime('now', ?) WHERE id = ?",
+                         (f'-{days} days', product_id))
+        conn.execute("UPDATE products SET last_moved_at = NULL WHERE id = 5")
+    return db
+
+
+def test_products_land_in_their_bucket(stocked):
+    report = stocked.get_inventory_aging()
+    counts = {bucket['bucket']: (bucket['product_count'], bucket['total_stock']) for bucket in report['buckets']}
+    assert counts == {'0-30': (1, 1), '30-60': (1, 2), '60-90': (0, 0), '90-180': (1, 3),
+                      '180+': (1, 4), 'never': (1, 5)}
+    assert report['total_value'] == 1 + 2 + 3 + 40 + 5
+
+
+def test_dead_stock_is_the_oldest_bucket_by_value(stocked):
+    report = stocked.get_inventory_aging(buckets=(30, 90))
+    assert [item['name'] for item in report['dead_stock']] == ['Old', 'Legacy', 'Quarter']
+
+
+def test_buckets_are_index_range_reads(stocked):
+    with stocked.connection() as conn:
+        plan = ' '.join(row[-1] for row in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT COUNT(*), SUM(stock * cost) FROM products "
+            "WHERE stock > 0 AND last_moved_at >= datetime('now', '-60 days') AND last_moved_at < datetime('now', '-30 days')"))
+    assert 'COVERING INDEX idx_products_in_stock_moved' in plan
@@ -0,0 +1,60 @@
+import pytest
+
+from app.cache import ResponseCache
+
+
+class Api:
+    def __init__(self, db):
+        self.db = db
+        self.calls = 0
+
+    def products(self):
+        self.calls += 1
+        with self.db.connection() as conn:
+            stock = conn.execute("SELECT SUM(stock) FROM products").fetchone()[0]
+        return {'success': True, 'data': stock}
+
+    def failing(self):
+        self.calls += 1
+        return {'success': False}
+
+
+@pytest.fixture
+def api(db):
+    cache = ResponseCache()
+    Api.products = cache.cached(tables=('products',))(Api.products)
+    Api.failing = cache.cached(tables=('products',))(Api.failing)
+    yield Api(db)
+    Api.products = Api.products.__wrapped__
+    Api.failing = Api.failing.__wrapped__
+
+
+def test_hit_until_a_write_touches_the_table(api, db):
+    db.add_product('Bolt', 'hijo', 10, 0, 1)
+    assert api.products()['data'] == 10
+    assert api.products()['data'] == 10
+    assert api.calls == 1
+    db.update_product_stock(1, 5)
+    assert api.products()['data'] == 15
+    assert api.calls == 2
+
+
+def test_write_to_a_dependent_table_invalidates(api, db):
+    db.add_product('Bolt', 'hijo', 10, 0, 1)
+    api.products()
+    db.add_sale(1, 'Bolt', 4, 1)  # the sale also moves product stock
+    assert api.products()['data'] == 6
+
+
+def test_write_to_an_unrelated_table_keeps_entries(api, db):
+    db.add_product('Bolt', 'hijo', 10, 0, 1)
+    api.products()
+    db.add_cost('Rent', 100, category='Others')
+    api.products()
+    assert api.calls == 1
+
+
+def test_failures_are_not_cached(api):
+    api.failing()
+    api.failing()
+    assert api.calls == 2
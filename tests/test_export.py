@@ -0,0 +1,57 @@
+import openpyxl
+import pytest
+
+from app import excel_export
+
+
+@pytest.fixture
+def shop(db):
+    """Bike = Frame + 6 Bolts, Frame = 4 Bolts, plus two sales and a cost."""
+    db.add_product('Bolt', 'hijo', 40, 0, 0.5, sku='B-1')
+    db.add_product('Frame', 'padre', 2, 0, 0, sku='F-1')
+    db.add_product('Bike', 'final', 5, 0, 0)
+    db.add_bom_entry(2, 1, 4)
+    db.add_bom_entry(3, 2, 1)
+    db.add_bom_entry(3, 1, 6)
+    db.add_sale(3, 'Bike', 1, 100, '2024-03-01')
+    db.add_sale(3, 'Bike', 2, 100, '2024-03-02')
+    db.add_cost('Rent', 500, category='Rent')
+    return db
+
+
+def _bom_levels(db):
+    return [(item['level'], item['parent_product_name'], item['child_product_name']) for item in db.get_full_bom()]
+
+
+def test_full_bom_levels(shop):
+    assert _bom_levels(shop) == [(1, 'Bike', 'Bolt'), (1, 'Bike', 'Frame'), (2, 'Frame', 'Bolt')]
+    assert shop.get_full_bom()[2]['parent_sku'] == 'F-1'
+
+
+def test_full_bom_entries_only_reachable_through_a_cycle_have_no_level(shop):
+    shop.add_product('Gear', 'padre', 0, 0, 0)
+    shop.add_product('Chain', 'padre', 0, 0, 0)
+    with shop.transaction(tables=('bill_of_materials',)) as conn:
+        conn.execute("INSERT INTO bill_of_materials (parent_product_id, child_product_id, quantity) VALUES (4, 5, 1), (5, 4, 1)")
+    assert _bom_levels(shop)[-2:] == [(None, 'Chain', 'Gear'), (None, 'Gear', 'Chain')]
+
+
+def test_full_bom_of_an_empty_database(db):
+    assert db.get_full_bom() == []
+
+
+def test_excel_export_sheets(shop, tmp_path):
+    path = excel_export.export_to_excel(str(tmp_path / 'export.xlsx'))
+    workbook = openpyxl.load_workbook(path, read_only=True)
+    assert workbook.sheetnames == ['Inventory', 'Sales', 'Revenue', 'Costs', 'BOM']
+    sheets = {name: list(workbook[name].iter_rows(values_only=True)) for name in workbook.sheetnames}
+    assert sheets['Inventory'][0] == ('ID', 'SKU', 'Name', 'Type', 'Stock', 'Min Stock', 'Unit Cost',
+                                      'Supplier', 'Purchase Date', 'Exit Date', 'Total Value')
+    assert [len(rows) - 1 for rows in sheets.values()] == [3, 2, 2, 1, 3]
+    assert sheets['BOM'][0] == ('Level', 'Parent SKU', 'Parent Product', 'Child SKU', 'Child Component', 'Quantity')
+    assert sheets['BOM'][1:] == [(1, None, 'Bike', 'B-1', 'Bolt', 6), (1, None, 'Bike', 'F-1', 'Frame', 1),
+                                 (2, 'F-1', 'Frame', 'B-1', 'Bolt', 4)]
+    assert [row[1] for row in sheets['Sales'][1:]] == ['Bike', 'Bike']
+    workbook.close()
+    header = openpyxl.load_workbook(path)['BOM']['A1']
+    assert header.font.bold and header.fill.start_color.rgb.lower().endswith('4285f4')
@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app import forecast
+
+
+@pytest.fixture
+def sales(db, monkeypatch):
+    """Widget (id 1) sold 3 a day over the last 28 full days; _fit calls are counted."""
+    monkeypatch.setattr(forecast, '_fit_cache', None)
+    fits = []
+    fit = forecast._fit
+    monkeypatch.setattr(forecast, '_fit', lambda series: fits.append(1) or fit(series))
+    db.add_product('Widget', 'final', 1000, 0, 1)
+    today = datetime.now(timezone.utc).date()
+    for days_ago in range(1, 29):
+        db.add_sale(1, 'Widget', 3, 10, (today - timedelta(days=days_ago)).isoformat())
+    return fits
+
+
+def test_constant_demand_is_forecast_flat(db, sales):
+    [entry] = forecast.forecast_demand(horizon_days=10)
+    assert entry['product_id'] == 1 and entry['product_name'] == 'Widget'
+    assert entry['forecast'] == pytest.approx(30)
+    assert entry['lower'] <= entry['forecast'] <= entry['upper']
+
+
+def test_product_edits_do_not_refit(db, sales):
+    forecast.forecast_demand()
+    db.update_product(1, 'Gadget', 'final', 900, 0, 2)
+    db.update_product_stock(1, -5)
+    [entry] = forecast.forecast_demand()
+    assert entry['product_name'] == 'Gadget'
+    assert len(sales) == 1
+
+
+def test_new_sales_refit(db, sales):
+    forecast.forecast_demand()
+    db.add_sale(1, 'Widget', 30, 10, (datetime.now(timezone.utc).date() - timedelta(days=1)).isoformat())
+    [entry] = forecast.forecast_demand(horizon_days=1)
+    assert len(sales) == 2
+    assert entry['forecast'] > 3
+
+
+def test_deleted_products_are_skipped(db, sales):
+    db.delete_product(1)
+    assert forecast.forecast_demand() == []
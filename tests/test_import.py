@@ -0,0 +1,53 @@
+import io
+
+
+def _import(db, text):
+    return db.import_products_csv(io.StringIO(text))
+
+
+def _product(db, name):
+    with db.connection() as conn:
+        return conn.execute("SELECT * FROM products WHERE name = ?", (name,)).fetchone()
+
+
+def test_reimport_updates_in_place(db):
+    _import(db, "sku,name,product_type,stock,cost\nB-1,Bolt,hijo,10,0.5\n")
+    product_id = _product(db, 'Bolt')['id']
+    result = _import(db, "sku,name,product_type,stock,cost\nB-1,Bolt,hijo,12,0.75\n")
+    assert (result['inserted'], result['updated']) == (0, 1)
+    bolt = _product(db, 'Bolt')
+    assert (bolt['id'], bolt['stock'], bolt['cost']) == (product_id, 12, 0.75)
+
+
+def test_blank_cells_keep_stored_values(db):
+    _import(db, "name,product_type,stock,min_stock,cost,stock_unit_type,supplier\n"
+                "Flour,hijo,500,100,2.5,grams,Mill\n")
+    _import(db, "name,product_type,stock,min_stock,cost,stock_unit_type,supplier\n"
+                "Flour,hijo,,,,,\n")
+    flour = _product(db, 'Flour')
+    assert (flour['stock'], flour['min_stock'], flour['cost']) == (500, 100, 2.5)
+    assert (flour['stock_unit_type'], flour['supplier']) == ('grams', 'Mill')
+    movements = db.get_stock_movements(flour['id'])
+    assert sum(m['quantity'] for m in movements['items']) == 500
+
+
+def test_blank_cells_get_defaults_on_insert(db):
+    result = _import(db, "name,product_type,stock,min_stock,cost,stock_unit_type\nNail,hijo,,,,\n")
+    assert result['inserted'] == 1 and result['errors'] == []
+    nail = _product(db, 'Nail')
+    assert (nail['stock'], nail['min_stock'], nail['cost'], nail['stock_unit_type']) == (0, 0, 0, 'units')
+
+
+def test_invalid_rows_are_reported(db):
+    result = _import(db, "name,product_type,stock\nGood,hijo,1\nBad,hijo,lots\n,hijo,1\n")
+    assert result['inserted'] == 1
+    assert [error['row'] for error in result['errors']] == [2, 3]
+
+
+def test_sku_upsert_on_a_database_upgraded_without_a_unique_sku(legacy_db):
+    db = legacy_db("INSERT INTO products (id, name, product_type, sku, cost) VALUES (1, 'Bolt', 'hijo', 'B-1', 1);")
+    db.init_db()
+    result = _import(db, "sku,name,product_type,cost\nB-1,Bolt M6,hijo,2\n")
+    assert (result['inserted'], result['updated'], result['errors']) == (0, 1, [])
+    bolt = _product(db, 'Bolt M6')
+    assert (bolt['id'], bolt['cost']) == (1, 2)
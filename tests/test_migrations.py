@@ -0,0 +1,123 @@
+import sqlite3
+
+import pytest
+
+from app import database
+
+
+@pytest.fixture
+def migrate_until(tmp_path, monkeypatch):
+    """Returns migrate(last): migrates a fresh database up to (excluding) `last`, or fully with None."""
+    database.close_all_connections()
+    monkeypatch.setattr(database, 'DB_FILE', str(tmp_path / 'erp.db'))
+    migrations = list(database.MIGRATIONS)
+
+    def migrate(stop=None):
+        monkeypatch.setattr(database, 'MIGRATIONS', migrations[:migrations.index(stop)] if stop else migrations)
+        database.init_db()
+        return database
+
+    yield migrate
+    database.close_all_connections()
+
+
+def test_fresh_database_is_at_latest_version(migrate_until):
+    db = migrate_until()
+    assert db.get_schema_version() == len(db.MIGRATIONS)
+    db.init_db()  # idempotent
+    assert db.get_schema_version() == len(db.MIGRATIONS)
+
+
+def test_production_orders_keep_rows_and_ids(migrate_until):
+    db = migrate_until(database._migrate_nullable_production_quantity)
+    with db.transaction(tables=('products', 'production_orders')) as conn:
+        conn.execute("INSERT INTO products (name, product_type) VALUES ('A', 'final')")
+        conn.execute("INSERT INTO production_orders (product_id, product_name, quantity, status) VALUES (1, 'A', 2, 'completed')")
+        conn.execute("INSERT INTO production_orders (product_id, product_name, quantity, status) VALUES (1, 'A', 3, 'completed')")
+        conn.execute("DELETE FROM production_orders WHERE id = 2")
+    db = migrate_until()
+    orders = db.get_production_orders()['items']
+    assert [(order['id'], order['quantity']) for order in orders] == [(1, 2)]
+    with db.transaction(tables=('production_orders',)) as conn:
+        conn.execute("INSERT INTO production_orders (quantity, status) VALUES (NULL, 'failed')")
+        assert conn.execute("SELECT MAX(id) FROM production_orders").fetchone()[0] == 3
+    with pytest.raises(sqlite3.IntegrityError):
+        with db.transaction(tables=('production_orders',)) as conn:
+            conn.execute("INSERT INTO production_orders (quantity, status) VALUES (1, 'queued')")
+
+
+def test_legacy_orphans_are_cleared_on_upgrade(legacy_db):
+    db = legacy_db("""
+        INSERT INTO products (id, name, product_type) VALUES (1, 'Bike', 'final'), (2, 'Bolt', 'hijo');
+        INSERT INTO bill_of_materials (parent_product_id, child_product_id, quantity) VALUES (1, 2, 4), (1, 9, 1), (9, 2, 1);
+        INSERT INTO sales (product_id, product_name, quantity, unit_price, total_amount, date)
+        VALUES (1, 'Bike', 1, 100, 100, '2024-01-05'), (9, 'Scooter', 2, 50, 100, '2024-01-06');
+    """)
+    db.init_db()
+    assert db.get_schema_version() == len(db.MIGRATIONS)
+    with db.connection() as conn:
+        assert conn.execute("PRAGMA foreign_key_check").fetchall() == []
+        sales = [tuple(row) for row in conn.execute("SELECT product_id, product_name FROM sales ORDER BY id")]
+        bom = [tuple(row) for row in conn.execute("SELECT parent_product_id, child_product_id FROM bill_of_materials")]
+    assert sales == [(1, 'Bike'), (None, 'Scooter')]
+    assert bom == [(1, 2)]
+    # Rows that used to dangle can be written again, and deletes cascade
+    db.update_sale(2, None, 'Scooter', 3, 50, '2024-01-06')
+    db.delete_product(1)
+    with db.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM bill_of_materials").fetchone()[0] == 0
+        assert conn.execute("SELECT product_id FROM sales WHERE id = 1").fetchone()[0] is None
+
+
+def test_foreign_keys_are_enforced_after_upgrading_orphans(legacy_db):
+    db = legacy_db("""
+        INSERT INTO products (id, name, product_type) VALUES (1, 'Bike', 'final');
+        INSERT INTO sales (product_id, product_name, quantity, unit_price, total_amount) VALUES (7, 'Gone', 1, 1, 1);
+        INSERT INTO bill_of_materials (parent_product_id, child_product_id) VALUES (1, 7);
+    """)
+    db.init_db()
+    with db.connection() as conn:
+        assert conn.execute("PRAGMA foreign_keys").fetchone()[0] == 1
+    with pytest.raises(sqlite3.IntegrityError):
+        db.add_bom_entry(1, 7, 1)
+    with pytest.raises(sqlite3.IntegrityError):
+        with db.transaction(tables=('sales',)) as conn:
+            conn.execute("INSERT INTO sales (product_id, product_name, quantity, unit_price, total_amount) "
+                         "VALUES (7, 'Gone', 1, 1, 1)")
+
+
+def test_legacy_duplicate_skus_get_a_unique_index(legacy_db):
+    db = legacy_db("""
+        INSERT INTO products (id, name, product_type, sku) VALUES
+            (1, 'Bolt', 'hijo', 'B-1'), (2, 'Bolt copy', 'hijo', 'B-1'), (3, 'Nut', 'hijo', ''), (4, 'Pin', 'hijo', '');
+    """)
+    db.init_db()
+    with db.connection() as conn:
+        skus = [tuple(row) for row in conn.execute("SELECT id, sku FROM products ORDER BY id")]
+    assert skus == [(1, 'B-1'), (2, None), (3, None), (4, None)]
+    with pytest.raises(sqlite3.IntegrityError):
+        db.add_product('Other bolt', 'hijo', 0, 0, 0, sku='B-1')
+
+
+def test_revenue_backfill_links_exact_descriptions_in_id_order(legacy_db):
+    db = legacy_db("""
+        INSERT INTO products (id, name, product_type) VALUES (1, 'Bolt', 'hijo'), (2, 'Bolt xl', 'hijo');
+        INSERT INTO sales (id, product_id, product_name, quantity, unit_price, total_amount, date) VALUES
+            (1, 2, 'Bolt xl', 2, 5, 10, '2024-01-05 10:00:00'),
+            (2, 1, 'Bolt', 2, 5, 10, '2024-01-05 10:00:00'),
+            (3, 1, 'Bolt', 2, 5, 10, '2024-01-05 10:00:00'),
+            (4, 1, 'Bolt', 1, 10, 10, '2024-01-05 10:00:00'),
+            (5, 1, 'Bolt', 3, 1, 3, '2024-01-06 10:00:00');
+        INSERT INTO revenue (id, description, amount, date) VALUES
+            (1, 'Sale: Bolt x2', 10, '2024-01-05 10:00:00'),
+            (2, 'Sale: Bolt xl x2', 10, '2024-01-05 10:00:00'),
+            (3, 'Sale: Bolt x1', 10, '2024-01-05 10:00:00'),
+            (4, 'Sale: Bolt x2.0', 10, '2024-01-05 10:00:00'),
+            (5, 'Sale: Bolt x3', 3, '2024-01-07 10:00:00'),
+            (6, 'Consulting', 10, '2024-01-05 10:00:00');
+    """)
+    db.init_db()
+    with db.connection() as conn:
+        links = dict(conn.execute("SELECT id, sale_id FROM revenue").fetchall())
+    # Sale 1 takes the "Bolt xl" row; sales 2 and 3 take the identical Bolt x2 rows in id order
+    assert links == {1: 2, 2: 1, 3: 4, 4: 3, 5: None, 6: None}
@@ -0,0 +1,42 @@
+import pytest
+
+
+@pytest.fixture
+def catalog(db):
+    """25 products with repeated stock and cost values, so pages split ties."""
+    for index in range(25):
+        db.add_product(f'Part {index:02}', 'hijo', index % 4, 0, (index * 7) % 5)
+    return db
+
+
+def _walk(db, **kwargs):
+    ids, cursor = [], None
+    while True:
+        page = db.get_products_page(limit=4, cursor=cursor, **kwargs)
+        ids += [item['id'] for item in page['items']]
+        cursor = page['next_cursor']
+        if not cursor:
+            return ids
+
+
+@pytest.mark.parametrize('sort', ['name', 'stock', 'cost'])
+@pytest.mark.parametrize('descending', [False, True])
+def test_pages_cover_every_row_once_in_order(catalog, sort, descending):
+    products = [catalog.get_product_by_id(product_id) for product_id in range(1, 26)]
+    expected = sorted(products, key=lambda p: (p[sort], p['id']), reverse=descending)
+    assert _walk(catalog, sort=sort, descending=descending) == [p['id'] for p in expected]
+
+
+@pytest.mark.parametrize('sort, index', [('stock', 'idx_products_stock'), ('cost', 'idx_products_cost')])
+def test_sorts_use_an_index(catalog, sort, index):
+    columns = ', '.join(catalog.PRODUCT_SORTS[sort])
+    with catalog.connection() as conn:
+        plan = ' '.join(row[-1] for row in conn.execute(
+            f"EXPLAIN QUERY PLAN SELECT * FROM products WHERE ({columns}) > (?, ?) ORDER BY {columns} LIMIT 5", (1, 1)))
+    assert index in plan and 'TEMP B-TREE' not in plan
+
+
+def test_cursor_from_another_sort_is_rejected(catalog):
+    cursor = catalog.get_products_page(sort='stock', limit=2)['next_cursor']
+    with pytest.raises(ValueError):
+        catalog.get_products_page(sort='cost', cursor=cursor)
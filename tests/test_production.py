@@ -0,0 +1,174 @@
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+
+@pytest.fixture
+def bike(db):
+    """Bike = 1 Frame + 6 Bolts; Frame = 4 Bolts. Ids: Bolt 1, Frame 2, Bike 3."""
+    db.add_product('Bolt', 'hijo', 40, 0, 0.5)
+    db.add_product('Frame', 'padre', 0, 0, 0, additional_cost=2)
+    db.add_product('Bike', 'final', 0, 0, 0)
+    db.add_bom_entry(2, 1, 4)
+    db.add_bom_entry(3, 2, 1)
+    db.add_bom_entry(3, 1, 6)
+    return db
+
+
+def _stock(db, product_id):
+    return db.get_product_by_id(product_id)['stock']
+
+
+def test_explode_bom_resolves_leaves_across_levels(bike):
+    explosion = bike.explode_bom(3, 2)
+    assert [(c['product_id'], c['required_quantity']) for c in explosion['components']] == [(1, 20)]
+    assert [(s['product_id'], s['required_quantity']) for s in explosion['subassemblies']] == [(2, 2)]
+    assert explosion['cycles'] == []
+
+
+def test_explode_bom_cuts_cycles(bike):
+    with bike.transaction(tables=('bill_of_materials',)) as conn:
+        conn.execute("INSERT INTO bill_of_materials (parent_product_id, child_product_id, quantity) VALUES (2, 3, 1)")
+    explosion = bike.explode_bom(3)
+    assert 3 in explosion['cycles']
+    assert [(c['product_id'], c['required_quantity']) for c in explosion['components']] == [(1, 10)]
+
+
+def test_mrp_without_subassembly_stock(bike):
+    result = bike.calculate_mrp_production(3)
+    assert result['can_produce'] == 4
+    assert result['limiting_component']['child_id'] == 1
+
+
+def test_mrp_uses_subassembly_stock_first(bike):
+    bike.update_product_stock(2, 3)
+    # 3 bikes from the frames on hand (18 bolts), then 2 more building frames (20 bolts)
+    assert bike.calculate_mrp_production(3)['can_produce'] == 5
+    catalog = {entry['product_id']: entry for entry in bike.calculate_mrp_catalog()}
+    assert catalog[3]['can_produce'] == 5
+    assert catalog[2]['can_produce'] == 10
+
+
+def test_production_takes_subassemblies_from_stock(bike):
+    assert bike.execute_production(2, 3)['success']
+    assert _stock(bike, 1) == 28
+    assert _stock(bike, 2) == 3
+
+    result = bike.execute_production(3, 3)
+    assert result['success'], result['message']
+    # The frames built earlier are used: only the 6 bolts per bike are taken
+    assert _stock(bike, 2) == 0
+    assert _stock(bike, 1) == 10
+    assert _stock(bike, 3) == 3
+
+    # Next bike must build its frame: 4 + 6 bolts
+    assert bike.execute_production(3, 1)['success']
+    assert _stock(bike, 1) == 0
+    assert not bike.execute_production(3, 1)['success']
+    assert _stock(bike, 1) == 0
+
+
+def test_production_records_ledger_movements_and_cost(bike):
+    bike.update_product_stock(2, 1)
+    result = bike.execute_production(3, 2)
+    assert result['success']
+    order = bike.get_production_orders()['items'][0]
+    # 1 frame from stock at its rolled-up cost (4 bolts * 0.5 + 2), 16 bolts (4 for the
+    # frame built, 12 for the bikes) and the built frame's additional cost
+    assert order['materials_cost'] == pytest.approx(4.0 + 16 * 0.5 + 2)
+    movements = {(m['product_id'], m['quantity']) for m in bike.get_stock_movements(reason='production')['items']}
+    assert movements == {(1, -16), (2, -1), (3, 2)}
+    with bike.connection() as conn:
+        for product_id, stock in conn.execute("SELECT id, stock FROM products"):
+            ledger = conn.execute("SELECT COALESCE(SUM(quantity), 0) FROM stock_movements WHERE product_id = ?",
+                                  (product_id,)).fetchone()[0]
+            assert stock == pytest.approx(ledger)
+
+
+def test_concurrent_production_never_goes_negative(bike):
+    results = []
+
+    def worker():
+        for _ in range(5):
+            results.append(bike.execute_production(3, 1))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sum(result['success'] for result in results) == 4
+    assert _stock(bike, 1) == 0
+    assert _stock(bike, 3) == 4
+
+
+def test_batch_logs_rejected_orders(bike):
+    result = bike.execute_production_batch([
+        {'product_id': 2, 'quantity': 1},
+        {'product_id': 99, 'quantity': 1},
+        {'product_id': 3, 'quantity': 'x'},
+        {'product_id': 3, 'quantity': 0},
+        {'product_id': 2, 'quantity': 100},
+    ])
+    assert result['completed'] == 1
+    assert result['failed'] == 4
+    assert all(entry['order_id'] for entry in result['results'])
+    orders = {order['id']: order for order in bike.get_production_orders(include_total=True)['items']}
+    assert len(orders) == 5
+    statuses = [orders[entry['order_id']]['status'] for entry in result['results']]
+    assert statuses == ['completed', 'failed', 'failed', 'failed', 'failed']
+    assert orders[result['results'][1]['order_id']]['product_id'] is None
+    assert orders[result['results'][2]['order_id']]['quantity'] is None
+
+
+def test_batch_error_rolls_back_everything(bike, monkeypatch):
+    calls = []
+    original = bike._record_movements
+
+    def failing_record(conn, changes, reason, reference_id=None, movement_at=None):
+        calls.append(reason)
+        if len(calls) == 2:
+            raise RuntimeError('disk full')
+        return original(conn, changes, reason, reference_id, movement_at)
+
+    monkeypatch.setattr(bike, '_record_movements', failing_record)
+    result = bike.execute_production_batch([{'product_id': 2, 'quantity': 1}, {'product_id': 2, 'quantity': 1}])
+    assert not result['success']
+    assert result['results'] == []
+    assert result['completed'] == 0
+    assert _stock(bike, 1) == 40
+    assert bike.get_production_orders(include_total=True)['total'] == 0
+
+
+def _cost_cache(db):
+    with db.connection() as conn:
+        return [tuple(row) for row in conn.execute("SELECT * FROM bom_cost_cache ORDER BY product_id")]
+
+
+def test_cost_changes_propagate_to_every_ancestor(bike):
+    assert [row[2] for row in _cost_cache(bike)] == [0, 4, 7]
+    bike.update_product(1, 'Bolt', 'hijo', 40, 0, 1)
+    assert [row[2] for row in _cost_cache(bike)] == [0, 6, 12]
+    bike.delete_bom_entry(1)  # Frame = 4 Bolts ...
+    bike.add_bom_entry(2, 1, 5)  # ... becomes 5
+    assert [row[2] for row in _cost_cache(bike)] == [0, 7, 13]
+    bike.update_product(2, 'Frame', 'padre', 0, 0, 0, additional_cost=3)
+    assert [row[2] for row in _cost_cache(bike)] == [0, 8, 14]
+    incremental = _cost_cache(bike)
+    bike.rebuild_bom_cost_cache()
+    assert _cost_cache(bike) == incremental
+
+
+def test_reorder_nets_requirements_level_by_level(bike):
+    today = datetime.now(timezone.utc).date()
+    bike.update_product_stock(3, 30)
+    for days_ago in range(30):
+        bike.add_sale(3, 'Bike', 1, 100, (today - timedelta(days=days_ago)).isoformat())  # 1 bike a day
+    bike.update_product_stock(2, 40)  # Frames on hand
+    suggestions = bike.get_reorder_suggestions(window_days=30, lead_time_days=7, safety_days=7, cover_days=30)
+    plan = {item['product_name']: (item['action'], item['suggested_quantity']) for item in suggestions}
+    # 44 days of bikes; the Frames in stock cover 40 of them, Bolts cover 4 Frames + 44 Bikes
+    assert plan == {'Bike': ('produce', 44), 'Frame': ('produce', 4), 'Bolt': ('purchase', 4 * 4 + 44 * 6 - 40)}
+    assert [item['product_name'] for item in suggestions] == ['Bike', 'Bolt', 'Frame']
+    assert {item['product_name']: item['dependent_velocity'] for item in suggestions} == {'Bike': 0, 'Frame': 1, 'Bolt': 10}
@@ -0,0 +1,96 @@
+import pytest
+
+# What each rollup must hold, computed straight from the raw rows
+EXPECTED = {
+    'daily_sales': """
+        SELECT substr(date, 1, 10), SUM(quantity), SUM(total_amount), COUNT(*)
+        FROM sales GROUP BY 1 ORDER BY 1""",
+    'daily_product_sales': """
+        SELECT COALESCE(product_id, 0), substr(date, 1, 10), SUM(quantity), SUM(total_amount),
+               SUM(quantity * COALESCE(unit_cost, 0)), COUNT(*)
+        FROM sales GROUP BY 1, 2 ORDER BY 1, 2""",
+    'product_sales_stats': """
+        SELECT COALESCE(product_id, 0), SUM(quantity), SUM(total_amount),
+               SUM(quantity * COALESCE(unit_cost, 0)), COUNT(*)
+        FROM sales GROUP BY 1 ORDER BY 1""",
+    'daily_revenue': "SELECT substr(date, 1, 10), SUM(amount), COUNT(*) FROM revenue GROUP BY 1 ORDER BY 1",
+}
+STORED = {
+    'daily_sales': "SELECT day, quantity, total_amount, entry_count FROM daily_sales ORDER BY 1",
+    'daily_product_sales': """
+        SELECT product_id, day, quantity, total_amount, cost_of_goods, entry_count
+        FROM daily_product_sales ORDER BY 1, 2""",
+    'product_sales_stats': """
+        SELECT product_id, quantity, total_amount, cost_of_goods, entry_count
+        FROM product_sales_stats ORDER BY 1""",
+    'daily_revenue': "SELECT day, total_amount, entry_count FROM daily_revenue ORDER BY 1",
+}
+
+
+def _assert_in_sync(db):
+    with db.connection() as conn:
+        for rollup, expected in EXPECTED.items():
+            rows = [tuple(row) for row in conn.execute(STORED[rollup])]
+            assert rows == [tuple(row) for row in conn.execute(expected)], rollup
+
+
+@pytest.fixture
+def sales(db):
+    """Bolt (1, cost 0.5) and Nut (2, cost 0.1) with three sales over two days."""
+    db.add_product('Bolt', 'hijo', 100, 0, 0.5)
+    db.add_product('Nut', 'hijo', 100, 0, 0.1)
+    db.add_sale(1, 'Bolt', 2, 3, '2024-03-01 10:00:00')
+    db.add_sale(1, 'Bolt', 1, 3, '2024-03-01 15:00:00')
+    db.add_sale(2, 'Nut', 10, 0.2, '2024-03-02 09:00:00')
+    return db
+
+
+def test_inserts_are_rolled_up(sales):
+    _assert_in_sync(sales)
+    with sales.connection() as conn:
+        assert tuple(conn.execute("SELECT quantity, entry_count FROM daily_sales WHERE day = '2024-03-01'").fetchone()) == (3, 2)
+
+
+def test_update_moving_a_sale_between_products_and_days(sales):
+    sales.update_sale(1, 2, 'Nut', 4, 0.2, '2024-03-05 08:00:00')
+    _assert_in_sync(sales)
+    with sales.connection() as conn:
+        assert tuple(conn.execute("SELECT quantity, entry_count FROM product_sales_stats WHERE product_id = 1").fetchone()) == (1, 1)
+
+
+def test_delete_drops_emptied_rows(sales):
+    sales.delete_sale(3)
+    _assert_in_sync(sales)
+    with sales.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM daily_sales WHERE day = '2024-03-02'").fetchone()[0] == 0
+        assert conn.execute("SELECT COUNT(*) FROM product_sales_stats WHERE product_id = 2").fetchone()[0] == 0
+
+
+def test_deleted_product_sales_roll_up_under_zero(sales):
+    sales.delete_product(2)
+    _assert_in_sync(sales)
+    with sales.connection() as conn:
+        assert conn.execute("SELECT quantity FROM product_sales_stats WHERE product_id = 0").fetchone()[0] == 10
+
+
+def test_rebuild_matches_the_raw_rows(sales):
+    with sales.transaction(tables=('daily_sales', 'product_sales_stats', 'daily_revenue')) as conn:
+        conn.execute("DELETE FROM daily_sales")
+        conn.execute("UPDATE product_sales_stats SET quantity = 999")
+        conn.execute("DELETE FROM daily_revenue")
+    sales.rebuild_rollups()
+    _assert_in_sync(sales)
+
+
+def test_top_products_keep_deleted_products_by_name(sales):
+    sales.add_product('Washer', 'hijo', 100, 0, 0)
+    sales.add_sale(3, 'Washer', 20, 0.1, '2024-03-03 09:00:00')
+    sales.delete_product(2)
+    sales.delete_product(3)
+    top = sales.get_top_products('quantity', limit=5)
+    assert [(item['product_name'], item['product_id'], item['total_quantity']) for item in top] == [
+        ('Washer', None, 20), ('Nut', None, 10), ('Bolt', 1, 3)]
+    assert [item['product_name'] for item in sales.get_top_products('revenue', limit=2)] == ['Bolt', 'Washer']
+    period = sales.get_top_products('quantity', start='2024-03-02', end='2024-03-03')
+    assert [(item['product_name'], item['total_quantity']) for item in period] == [('Nut', 10)]
+    assert sales.get_top_products('profit', limit=1)[0]['total_profit'] == pytest.approx(9 - 1.5)
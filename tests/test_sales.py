@@ -0,0 +1,65 @@
+import pytest
+
+
+@pytest.fixture
+def shop(db):
+    """Bolt (id 1, stock 10) and Nut (id 2, stock 20)."""
+    db.add_product('Bolt', 'hijo', 10, 0, 0.5)
+    db.add_product('Nut', 'hijo', 20, 0, 0.1)
+    return db
+
+
+def _rows(db, sql):
+    with db.connection() as conn:
+        return [tuple(row) for row in conn.execute(sql)]
+
+
+def _stock(db, product_id):
+    return db.get_product_by_id(product_id)['stock']
+
+
+def test_mixed_batch_registers_valid_lines_and_reports_the_rest(shop):
+    result = shop.add_multiple_sales([
+        {'product_id': 1, 'quantity': 2, 'unit_price': 3},
+        {'product_id': 99, 'quantity': 1, 'unit_price': 1},
+        {'product_id': 2, 'quantity': 0, 'unit_price': 1},
+        {'product_id': 2, 'quantity': 'x', 'unit_price': 1},
+        {'product_id': 2, 'quantity': 5, 'unit_price': 1, 'product_name': 'Nut (box)', 'date': '2024-03-01'},
+        {'product_id': 1, 'quantity': 1, 'unit_price': -1},
+    ])
+    assert result['success'] and result['inserted'] == 2
+    assert [error['index'] for error in result['errors']] == [1, 2, 3, 5]
+    assert (_stock(shop, 1), _stock(shop, 2)) == (8, 15)
+    assert _rows(shop, "SELECT product_id, product_name, quantity, total_amount FROM sales ORDER BY id") == [
+        (1, 'Bolt', 2, 6), (2, 'Nut (box)', 5, 5)]
+
+
+def test_all_or_nothing_rejects_the_batch_on_one_bad_line(shop):
+    result = shop.add_multiple_sales([
+        {'product_id': 1, 'quantity': 2, 'unit_price': 3},
+        {'product_id': 99, 'quantity': 1, 'unit_price': 1},
+    ], all_or_nothing=True)
+    assert not result['success'] and result['inserted'] == 0
+    assert [error['index'] for error in result['errors']] == [1]
+    assert _rows(shop, "SELECT COUNT(*) FROM sales") == [(0,)]
+    assert _stock(shop, 1) == 10
+
+
+def test_empty_batch(shop):
+    result = shop.add_multiple_sales([])
+    assert not result['success'] and result['inserted'] == 0 and result['errors'] == []
+
+
+def test_revenue_and_ledger_link_to_each_new_sale(shop):
+    shop.add_sale(1, 'Bolt', 1, 3)
+    shop.delete_sale(1)  # the next batch must not reuse id 1
+    shop.add_multiple_sales([
+        {'product_id': 1, 'quantity': 2, 'unit_price': 3, 'date': '2024-03-01 10:00:00'},
+        {'product_id': 2, 'quantity': 4, 'unit_price': 0.5, 'date': '2024-03-02 11:00:00'},
+    ])
+    assert _rows(shop, "SELECT id FROM sales ORDER BY id") == [(2,), (3,)]
+    assert _rows(shop, "SELECT sale_id, description, amount, date FROM revenue ORDER BY sale_id") == [
+        (2, 'Sale: Bolt x2.0', 6, '2024-03-01 10:00:00'), (3, 'Sale: Nut x4.0', 2, '2024-03-02 11:00:00')]
+    assert _rows(shop, "SELECT reference_id, product_id, quantity FROM stock_movements "
+                       "WHERE reason = 'sale' AND reference_id > 1 ORDER BY reference_id") == [(2, 1, -2), (3, 2, -4)]
+    assert (_stock(shop, 1), _stock(shop, 2)) == (8, 16)
@@ -0,0 +1,54 @@
+import pytest
+
+
+@pytest.fixture
+def catalog(db):
+    db.add_product('Steel bolt M6', 'hijo', 1, 0, 1, supplier='Acme', sku='BLT-6')
+    db.add_product('Steel nut M6', 'hijo', 1, 0, 1, supplier='Bolton Ltd', sku='NUT-6')
+    db.add_product('Wooden frame', 'padre', 1, 0, 1, supplier='Acme', sku='FRM-1')
+    return db
+
+
+def _names(results):
+    return [product['name'] for product in results]
+
+
+def test_prefix_match_on_every_word(catalog):
+    assert _names(catalog.search_products('ste bo')) == ['Steel bolt M6', 'Steel nut M6']
+    assert _names(catalog.search_products('wo acm')) == ['Wooden frame']
+    assert set(_names(catalog.search_products('acm'))) == {'Steel bolt M6', 'Wooden frame'}
+
+
+def test_name_match_ranks_above_supplier(catalog):
+    assert _names(catalog.search_products('bolt')) == ['Steel bolt M6', 'Steel nut M6']
+
+
+def test_exact_sku_comes_first(catalog):
+    assert _names(catalog.search_products('NUT-6'))[0] == 'Steel nut M6'
+
+
+def test_index_follows_edits_and_deletes(catalog):
+    catalog.update_product(3, 'Oak frame', 'padre', 1, 0, 1, supplier='Acme', sku='FRM-1')
+    assert _names(catalog.search_products('oak')) == ['Oak frame']
+    assert catalog.search_products('wooden') == []
+    catalog.delete_product(3)
+    assert catalog.search_products('oak') == []
+
+
+def test_punctuation_only_query_returns_nothing(catalog):
+    assert catalog.search_products('"*') == []
+
+
+def test_exact_sku_is_one_index_lookup_on_upgraded_databases(legacy_db):
+    db = legacy_db("""
+        INSERT INTO products (id, name, product_type, sku) VALUES
+            (1, 'Bolt', 'hijo', 'B-1'), (2, 'Bolt copy', 'hijo', 'B-1'), (3, 'Washer', 'hijo', 'W-1');
+    """)
+    db.init_db()
+    results = db.search_products('B-1')
+    assert [product['sku'] for product in results].count('B-1') == 1
+    assert results[0]['id'] == 1
+    with db.connection() as conn:
+        plan = ' '.join(row[-1] for row in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT id FROM products p WHERE p.sku = ?", ('B-1',)))
+    assert 'idx_products_sku' in plan
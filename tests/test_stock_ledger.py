@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+
+@pytest.fixture
+def bolt(db):
+    """Bolt (id 1) at cost 2, with 10 units dated three months back."""
+    db.add_product('Bolt', 'hijo', 0, 0, 2)
+    with db.transaction(tables=('products', 'stock_movements')) as conn:
+        db._apply_stock_changes(conn, [(1, 10)], 'adjustment', movement_at=_months_ago(3))
+    return db
+
+
+def _months_ago(months):
+    day = datetime.now(timezone.utc).date().replace(day=1)
+    for _ in range(months):
+        day = (day - timedelta(days=1)).replace(day=1)
+    return day.isoformat() + ' 12:00:00'
+
+
+def _last_month_end():
+    return (datetime.now(timezone.utc).date().replace(day=1) - timedelta(days=1)).isoformat()
+
+
+def _snapshots(db):
+    with db.connection() as conn:
+        return [tuple(row) for row in conn.execute(
+            "SELECT snapshot_date, stock, unit_cost FROM stock_snapshots ORDER BY snapshot_date")]
+
+
+def test_month_end_snapshot_is_not_backfilled(bolt):
+    assert bolt.take_month_end_snapshots() == 1
+    assert _snapshots(bolt) == [(_last_month_end(), 10, 2)]
+    assert bolt.take_month_end_snapshots() == 0
+
+
+def test_backdated_movement_adjusts_snapshot_and_keeps_its_cost(bolt):
+    bolt.take_month_end_snapshots()
+    with bolt.transaction(tables=('products',)) as conn:
+        conn.execute("UPDATE products SET cost = 5 WHERE id = 1")
+    with bolt.transaction(tables=('products', 'stock_movements')) as conn:
+        bolt._apply_stock_changes(conn, [(1, -4)], 'adjustment', movement_at=_months_ago(2))
+    assert _snapshots(bolt) == [(_last_month_end(), 6, 2)]
+    [item] = bolt.get_stock_on(_last_month_end())
+    assert (item['stock'], item['unit_cost']) == (6, 2)
+
+
+def test_stock_on_a_day_without_snapshot_reads_the_ledger(bolt):
+    with bolt.transaction(tables=('products', 'stock_movements')) as conn:
+        bolt._apply_stock_changes(conn, [(1, -3)], 'adjustment', movement_at=_months_ago(2))
+    assert bolt.get_stock_on(_months_ago(3)[:10])[0]['stock'] == 10
+    assert bolt.get_stock_on(_months_ago(2)[:10])[0]['stock'] == 7
+    assert bolt.get_stock_on(_months_ago(4)[:10])[0]['stock'] == 0
@@ -0,0 +1,62 @@
+def test_without_token_returns_the_whole_table(db):
+    db.add_product('Bolt', 'hijo', 1, 0, 1)
+    changes = db.get_changes_since('products')
+    assert changes['full'] and [row['name'] for row in changes['rows']] == ['Bolt']
+
+
+def test_token_returns_only_later_changes_and_deletes(db):
+    for name in ('Bolt', 'Nut', 'Washer'):
+        db.add_product(name, 'hijo', 1, 0, 1)
+    token = db.get_changes_since('products')['token']
+    db.update_product_stock(2, 4)
+    db.delete_product(3)
+    changes = db.get_changes_since('products', token)
+    assert not changes['full']
+    assert [row['id'] for row in changes['rows']] == [2]
+    assert changes['rows'][0]['stock'] == 5
+    assert changes['deleted'] == [3]
+    assert db.get_changes_since('products', changes['token'])['rows'] == []
+
+
+def test_sales_write_to_products_is_synced(db):
+    db.add_product('Bolt', 'hijo', 10, 0, 1)
+    token = db.get_changes_since('products')['token']
+    db.add_sale(1, 'Bolt', 3, 2)
+    assert [row['stock'] for row in db.get_changes_since('products', token)['rows']] == [7]
+    assert [row['quantity'] for row in db.get_changes_since('sales', token)['rows']] == [3]
+
+
+def test_unknown_token_falls_back_to_full(db):
+    db.add_product('Bolt', 'hijo', 1, 0, 1)
+    assert db.get_changes_since('products', '999999')['full']
+    assert db.get_changes_since('products', 'garbage')['full']
+
+
+def _age_tombstones(db, days):
+    with db.transaction(tables=('sync_tombstones',)) as conn:
+        conn.execute("UPDATE sync_tombstones SET deleted_at = datetime('now', ?)", (f'-{days} days',))
+
+
+def test_pruned_tombstones_force_a_full_resync(db):
+    for name in ('Bolt', 'Nut', 'Washer'):
+        db.add_product(name, 'hijo', 1, 0, 1)
+    old_token = db.get_changes_since('products')['token']
+    db.delete_product(2)
+    _age_tombstones(db, 100)
+    recent_token = db.get_changes_since('products')['token']
+    db.delete_product(3)
+    assert db.prune_sync_tombstones(retention_days=90) == 1
+    assert db.prune_sync_tombstones(retention_days=90) == 0
+
+    resync = db.get_changes_since('products', old_token)
+    assert resync['full'] and [row['id'] for row in resync['rows']] == [1]
+    delta = db.get_changes_since('products', recent_token)
+    assert not delta['full'] and delta['deleted'] == [3]
+
+
+def test_recent_tombstones_are_kept(db):
+    db.add_product('Bolt', 'hijo', 1, 0, 1)
+    token = db.get_changes_since('products')['token']
+    db.delete_product(1)
+    assert db.prune_sync_tombstones() == 0
+    assert db.get_changes_since('products', token)['deleted'] == [1]
@@ -0,0 +1,86 @@
+import threading
+
+import pytest
+
+
+def _run_concurrently(target, threads=6, calls=50):
+    """Runs target(thread_index, call_index) from several threads; returns the errors raised."""
+    errors = []
+    barrier = threading.Barrier(threads)
+
+    def worker(index):
+        barrier.wait()
+        for call in range(calls):
+            try:
+                target(index, call)
+            except Exception as e:  # collected, asserted by the caller
+                errors.append(e)
+
+    workers = [threading.Thread(target=worker, args=(index,)) for index in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return errors
+
+
+def test_concurrent_update_product_does_not_fail(db):
+    for index in range(6):
+        db.add_product(f'P{index}', 'hijo', 0, 0, 1.0)
+    ids = [product['id'] for product in db.get_all_products()]
+
+    def update(index, call):
+        db.update_product(ids[index], f'P{index}', 'hijo', call, 0, 1.0 + call)
+
+    assert _run_concurrently(update) == []
+    for product in db.get_all_products():
+        assert product['stock'] == 49
+
+
+def test_concurrent_update_sale_does_not_fail(db):
+    db.add_product('Bread', 'final', 10000, 0, 1.0)
+    product_id = db.get_all_products()[0]['id']
+    for _ in range(6):
+        db.add_sale(product_id, 'Bread', 1, 2)
+    sale_ids = [sale['id'] for sale in db.get_all_sales()]
+
+    def update(index, call):
+        db.update_sale(sale_ids[index], product_id, 'Bread', 1 + call % 3, 2)
+
+    assert _run_concurrently(update, calls=40) == []
+    # The ledger still matches the stock: every reversal has its sale movement
+    with db.connection() as conn:
+        stock = conn.execute("SELECT stock FROM products WHERE id = ?", (product_id,)).fetchone()[0]
+        ledger = conn.execute("SELECT SUM(quantity) FROM stock_movements WHERE product_id = ?",
+                              (product_id,)).fetchone()[0]
+    assert stock == pytest.approx(ledger)
+
+
+def test_nested_transaction_rolls_back_only_the_savepoint(db):
+    db.add_product('A', 'hijo', 1, 0, 1.0)
+    with db.transaction(tables=('products',)) as conn:
+        conn.execute("UPDATE products SET stock = 2")
+        with pytest.raises(ValueError):
+            with db.transaction():
+                conn.execute("UPDATE products SET stock = 3")
+                raise ValueError
+    assert db.get_all_products()[0]['stock'] == 2
+
+
+def test_commit_bumps_declared_table_versions(db):
+    before = db.get_table_versions(('products', 'sales'))
+    db.add_product('A', 'hijo', 1, 0, 1.0)
+    after = db.get_table_versions(('products', 'sales'))
+    assert after[0] > before[0]
+    assert after[1] == before[1]
+
+
+def test_read_snapshot_sees_one_state(db):
+    db.add_product('A', 'hijo', 1, 0, 1.0)
+    with db.read_snapshot() as conn:
+        first = conn.execute("SELECT stock FROM products").fetchone()[0]
+        thread = threading.Thread(target=db.update_product_stock, args=(1, 5))
+        thread.start()
+        thread.join()
+        assert conn.execute("SELECT stock FROM products").fetchone()[0] == first
+    assert db.get_all_products()[0]['stock'] == 6